@@ -1,14 +1,32 @@
 # Importando as bibliotecas necessárias
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
 from datetime import timedelta, date
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
+import httpx
 import time
 import base64
 import io
 import random
+import threading
+import zipfile
+import xlsxwriter
+import openpyxl
+import os
+import re
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from itertools import zip_longest 
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 
 # --- Constantes da Aplicação ---
 DIAS_SEMANA_PT = ["SEGUNDA-FEIRA", "TERÇA-FEIRA", "QUARTA-FEIRA", "QUINTA-FEIRA", "SEXTA-FEIRA", "SÁBADO", "DOMINGO"]
@@ -29,6 +47,7 @@ H_VERDE    = ["7:30 HRS", "8:00 HRS", "8:30 HRS", "9:00 HRS", "9:30 HRS", "10:00
 H_ROXO     = ["11:00 HRS", "11:30 HRS", "12:00 HRS", "12:30 HRS", "13:00 HRS", "13:30 HRS", "14:00 HRS", "14:30 HRS", "14:45 HRS", "15:00 HRS", "15:30 HRS", "15:45 HRS", "16:00 HRS", "16:30 HRS", "16:45 HRS"]
 H_CINZA    = ["Folga"]
 H_AMARELO  = ["Ferias", "Afastado(a)", "Atestado"]
+CORES_HORARIOS_EXCEL = [('vermelho', H_VERMELHO), ('verde', H_VERDE), ('roxo', H_ROXO), ('cinza', H_CINZA), ('amarelo', H_AMARELO)]
 
 # --- LISTAS ESPECÍFICAS POR FUNÇÃO ---
 LISTA_OPCOES_CAIXA = ["", "---", "Self", "Recepção", "Delivery", "Magazine", "Salinha"] + [str(i) for i in range(1, 18)]
@@ -55,22 +74,180 @@ def calcular_minutos(horario_str):
     except:
         return 9999
 
+# --- TABELA DE TURNOS (MONTADA UMA VEZ A PARTIR DE HORARIOS_PADRAO) ---
+@dataclass(frozen=True)
+class Turno:
+    codigo: int                       # posição em HORARIOS_PADRAO (-1 = horário fora da lista)
+    horario: str
+    minutos: int                      # entrada em minutos desde 0h (9999 = não é horário de trabalho)
+    intervalo: str                    # almoço/café em dia normal
+    saida_prevista: str
+    saida_estimada: str
+    saida_estimada_min: int           # minutos desde a 0h do dia da entrada (passa de 1440 se virar a noite)
+    saida_prevista_domingo: str
+    saida_estimada_domingo: str
+    saida_estimada_domingo_min: int
+    manha: bool
+    tarde: bool
+    cor: str                          # faixa de cor do Excel ("" = sem cor)
+
+    @property
+    def trabalha(self) -> bool: return self.minutos != 9999
+
+TEXTO_INTERVALO = {15: "15 min (Só Café)", 75: "1h 15m (Almoço+Café)", 90: "1h 30m", 105: "1h 45m (Almoço+Café)"}
+TEXTO_INTERVALO_DOMINGO = "10 min (Só Café)"
+SAIDAS_ESTIMADAS_DOMINGO = {410: 770, 450: 790, 480: 810}  # 6:50 → 12:50, 7:30 → 13:10, 8:00 → 13:30
+
+def obter_intervalo_minutos(h, m):
+    mins = h * 60 + m
+    if mins == 570 or mins == 600: return 105 
+    elif mins == 660 or mins == 720: return 75 
+    elif mins >= 870: return 15
+    else: return 60
+
+def _hora_texto(total_mins: int) -> str:
+    return f"{(total_mins // 60) % 24:02d}:{total_mins % 60:02d}"
+
+def _montar_turno(horario: str, codigo: int = -1) -> Turno:
+    minutos = calcular_minutos(horario)
+    cor = next((cor for cor, lista in CORES_HORARIOS_EXCEL if horario in lista), "")
+    if minutos == 9999: return Turno(codigo, horario, 9999, "", "", "", 9999, "", "", 9999, False, False, cor)
+    intervalo = obter_intervalo_minutos(*divmod(minutos, 60))
+    prevista = minutos + 440 + intervalo; prevista_domingo = minutos + 440 + 10
+    if minutos in (570, 600): estimada = 19 * 60 + 5
+    elif minutos >= 660: estimada = 20 * 60 + 45
+    else: estimada = prevista
+    estimada_domingo = SAIDAS_ESTIMADAS_DOMINGO.get(minutos, prevista_domingo)
+    return Turno(codigo, horario, minutos, TEXTO_INTERVALO.get(intervalo, "1 hora"), _hora_texto(prevista), _hora_texto(estimada), estimada,
+                 _hora_texto(prevista_domingo), _hora_texto(estimada_domingo), estimada_domingo, 0 < minutos <= 600, minutos >= 570, cor)
+
+TURNOS = {h: _montar_turno(h, i) for i, h in enumerate(HORARIOS_PADRAO)}
+DTYPE_TURNO = pd.CategoricalDtype(HORARIOS_PADRAO)
+MINUTOS_POR_CODIGO = np.array([t.minutos for t in TURNOS.values()] + [9999])  # código -1 cai na sentinela do fim
+SAIDAS_POR_CODIGO = np.array([[t.saida_estimada_min, t.saida_estimada_domingo_min] for t in TURNOS.values()] + [[9999, 9999]])
+
+@functools.lru_cache(maxsize=256)
+def _turno_fora_da_tabela(horario: str) -> Turno:
+    return _montar_turno(horario)
+
+def obter_turno(horario) -> Turno:
+    if not isinstance(horario, str): return TURNOS[""]
+    return TURNOS.get(horario) or _turno_fora_da_tabela(horario)
+
+def codigos_turno(horarios: pd.Series) -> np.ndarray:
+    return pd.Categorical(horarios, dtype=DTYPE_TURNO).codes
+
+def minutos_turno(horarios: pd.Series) -> np.ndarray:
+    codigos = codigos_turno(horarios)
+    minutos = MINUTOS_POR_CODIGO[codigos]
+    fora = codigos < 0
+    if fora.any(): minutos[fora] = [obter_turno(h).minutos for h in horarios.to_numpy()[fora]]
+    return minutos
+
+def saidas_turno(horarios: pd.Series, domingo: np.ndarray) -> np.ndarray:
+    # Saída estimada em minutos desde a 0h do dia da entrada; no domingo vale a saída reduzida.
+    codigos = codigos_turno(horarios)
+    saidas = SAIDAS_POR_CODIGO[codigos, domingo.astype(int)]
+    fora = codigos < 0
+    if fora.any():
+        turnos = [obter_turno(h) for h in horarios.to_numpy()[fora]]
+        saidas[fora] = [t.saida_estimada_domingo_min if d else t.saida_estimada_min for t, d in zip(turnos, domingo[fora])]
+    return saidas
+
 # Regras de Negócio para Totais do Excel (Padrao Geral)
-HORARIOS_MANHA = [h for h in HORARIOS_PADRAO if "HRS" in h and calcular_minutos(h) > 0 and calcular_minutos(h) <= 600]
-HORARIOS_TARDE = [h for h in HORARIOS_PADRAO if "HRS" in h and calcular_minutos(h) >= 570]
+HORARIOS_MANHA = [t.horario for t in TURNOS.values() if t.manha]
+HORARIOS_TARDE = [t.horario for t in TURNOS.values() if t.tarde]
 
 # --- Configuração da Página ---
 st.set_page_config(page_title="Frente de Caixa", page_icon="📅", layout="wide", initial_sidebar_state="expanded")
 
 # --- Conexão Supabase ---
+# Um cliente (com um pool HTTP keep-alive) por processo, reaproveitado em todos os reruns e sessões.
+# Timeout configurável pelo secret opcional `supabase_timeout`.
+SUPABASE_TIMEOUT_SEGUNDOS = 15
+SUPABASE_TENTATIVAS = 3
+SUPABASE_BACKOFF_SEGUNDOS = 0.4
+
+# RPCs que só leem: podem ser repetidas como um GET, apesar de irem por POST.
+RPCS_SOMENTE_LEITURA = {'get_escala_semana', 'get_escala_semana_delta', 'get_escala_semanas', 'get_contagem_turnos'}
+STATUS_REPETIVEIS = (502, 503, 504)
+STATUS_REPETIDOS_PELO_POSTGREST = (503, 520)  # em GET/HEAD a própria biblioteca já repete esses
+
+def _leitura_idempotente(request: httpx.Request) -> bool:
+    if request.method in ("GET", "HEAD"): return True
+    caminho = request.url.path
+    return request.method == "POST" and "/rpc/" in caminho and caminho.rsplit("/rpc/", 1)[1] in RPCS_SOMENTE_LEITURA
+
+class _TransporteComRetentativas(httpx.HTTPTransport):
+    # Cada falha é repetida numa camada só. Falha de conexão (a requisição nem saiu): aqui, qualquer método.
+    # Timeout de leitura e 502/503/504: aqui, só em leituras (GET/HEAD e RPCS_SOMENTE_LEITURA), menos o
+    # 503/520 de GET/HEAD, que o postgrest já repete sozinho. Escritas nunca são reenviadas.
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        leitura = _leitura_idempotente(request)
+        repetiveis = [s for s in STATUS_REPETIVEIS if not (request.method in ("GET", "HEAD") and s in STATUS_REPETIDOS_PELO_POSTGREST)] if leitura else []
+        for tentativa in range(SUPABASE_TENTATIVAS):
+            ultima = tentativa == SUPABASE_TENTATIVAS - 1
+            try:
+                resposta = super().handle_request(request)
+                if ultima or resposta.status_code not in repetiveis: return resposta
+                resposta.close()
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if ultima: raise
+            except httpx.ReadTimeout:
+                if ultima or not leitura: raise
+            time.sleep(SUPABASE_BACKOFF_SEGUNDOS * 2 ** tentativa)
+
+@st.cache_resource(show_spinner=False)
+def conectar_supabase(url: str, key: str, timeout: float) -> Client:
+    transporte = _TransporteComRetentativas(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60))
+    http = httpx.Client(transport=transporte, timeout=httpx.Timeout(timeout, connect=5.0), follow_redirects=True)
+    return create_client(url, key, options=ClientOptions(httpx_client=http))
+
 try:
-    url = st.secrets["supabase_url"]
-    key = st.secrets["supabase_key"]
-    supabase: Client = create_client(url, key)
+    supabase: Client = conectar_supabase(st.secrets["supabase_url"], st.secrets["supabase_key"], float(st.secrets.get("supabase_timeout", SUPABASE_TIMEOUT_SEGUNDOS)))
 except Exception:
     st.error("🚨 **Erro de Conexão:** Verifique os Secrets `supabase_url` e `supabase_key`.")
     st.stop()
 
+def verificar_conexao() -> tuple:
+    # (ok, latência em ms, mensagem de erro)
+    inicio = time.perf_counter()
+    try: supabase.table('semanas').select('id').limit(1).execute(); ok, erro = True, ""
+    except Exception as e: ok, erro = False, str(e)
+    ms = (time.perf_counter() - inicio) * 1000
+    registrar_tempo("Supabase: teste de conexão", ms)
+    return ok, ms, erro
+
+TAMANHO_PAGINA_RPC = 1000  # limite padrão de linhas por resposta do Supabase (db-max-rows)
+
+@st.cache_resource
+def _rpcs_sem_paginacao() -> set:
+    return set()
+
+def rpc_paginada(funcao: str, parametros: dict, ordem: list) -> list:
+    # Lê a RPC em páginas ordenadas até vir uma página curta: sem isso o resultado é cortado em silêncio no limite.
+    # Só funciona em funções que devolvem linhas (returns table/setof, ver sql/funcoes_rpc.sql). Uma versão antiga
+    # que devolva um único json recusa o order ou ignora o range: nesses casos a função é lida inteira numa
+    # chamada, como antes, e fica lembrada para não tentar paginar de novo.
+    if funcao in _rpcs_sem_paginacao(): return supabase.rpc(funcao, parametros).execute().data or []
+    linhas = []
+    while True:
+        consulta = supabase.rpc(funcao, parametros)
+        for coluna in ordem: consulta = consulta.order(coluna)
+        try: pagina = consulta.range(len(linhas), len(linhas) + TAMANHO_PAGINA_RPC - 1).execute().data or []
+        except APIError as erro:
+            if linhas or _funcao_inexistente(erro): raise
+            try: dados = supabase.rpc(funcao, parametros).execute().data or []
+            except Exception: raise erro
+            _rpcs_sem_paginacao().add(funcao)
+            return dados
+        # Range ignorado: veio mais que uma página, ou a "segunda página" recomeça do início.
+        if not isinstance(pagina, list) or len(pagina) > TAMANHO_PAGINA_RPC or (linhas and pagina and pagina[0] == linhas[0]):
+            _rpcs_sem_paginacao().add(funcao)
+            return linhas or (pagina if isinstance(pagina, list) else [pagina])
+        linhas += pagina
+        if len(pagina) < TAMANHO_PAGINA_RPC: return linhas
+
 # --- Estado da Sessão ---
 if "logado" not in st.session_state: st.session_state.logado = False
 if "nome_logado" not in st.session_state: st.session_state.nome_logado = ""
@@ -87,27 +264,281 @@ def formatar_lista_folgas_multilinha(lista_nomes, step=2):
     chunks = [sorted_nomes[i:i + step] for i in range(0, len(sorted_nomes), step)]
     return "<br>".join([", ".join(chunk) for chunk in chunks])
 
-@st.cache_data(ttl=1) 
-def carregar_colaboradores() -> pd.DataFrame:
+# --- INVALIDAÇÃO DE CACHE POR ENTIDADE ---
+# Cada entidade ("colaboradores", "semanas", "semana:<id>", "pedidos") tem um número de versão que faz
+# parte da chave do cache. Salvar algo só incrementa a versão daquela entidade: as demais entradas
+# (e as sessões dos outros fiscais) continuam aquecidas.
+@st.cache_resource
+def _estado_cache() -> dict:
+    return {'lock': threading.Lock(), 'versoes': {}, 'acessos': {}, 'misses': {}, 'tempos': {}}
+
+def versao_cache(entidade: str) -> int:
+    return _estado_cache()['versoes'].get(entidade, 0)
+
+def invalidar_cache(*entidades: str):
+    estado = _estado_cache()
+    with estado['lock']:
+        for entidade in entidades: estado['versoes'][entidade] = estado['versoes'].get(entidade, 0) + 1
+
+_origem_acesso = threading.local()  # marca a thread de pré-carga: os acessos dela contam à parte
+
+def _registrar_acesso(funcao: str, miss: bool = False):
+    if getattr(_origem_acesso, 'pre_carga', False): funcao = f"{funcao} (pré-carga)"
+    estado = _estado_cache()
+    contador = estado['misses'] if miss else estado['acessos']
+    with estado['lock']: contador[funcao] = contador.get(funcao, 0) + 1
+
+def estatisticas_cache() -> pd.DataFrame:
+    estado = _estado_cache()
+    linhas = []
+    for funcao, acessos in sorted(estado['acessos'].items()):
+        misses = min(estado['misses'].get(funcao, 0), acessos)
+        linhas.append({'Cache': funcao, 'Acessos': acessos, 'Hits': acessos - misses, 'Misses': misses, 'Taxa de Acerto': f"{(acessos - misses) / acessos:.0%}"})
+    return pd.DataFrame(linhas)
+
+# --- TEMPOS DE EXECUÇÃO (RERUN DAS ABAS E GERAÇÃO DE ARQUIVOS) ---
+def registrar_tempo(etapa: str, ms: float):
+    estado = _estado_cache()
+    with estado['lock']: estado['tempos'].setdefault(etapa, deque(maxlen=50)).append(ms)
+
+@contextmanager
+def cronometro(etapa: str):
+    inicio = time.perf_counter()
+    try: yield
+    finally: registrar_tempo(etapa, (time.perf_counter() - inicio) * 1000)
+
+def cronometrado(etapa: str):
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def wrapper(*args, **kwargs):
+            with cronometro(etapa): return funcao(*args, **kwargs)
+        return wrapper
+    return decorador
+
+def estatisticas_tempos() -> pd.DataFrame:
+    estado = _estado_cache()
+    with estado['lock']: tempos = {etapa: list(ms) for etapa, ms in estado['tempos'].items()}
+    linhas = [{'Etapa': etapa, 'Execuções': len(ms), 'Média (ms)': round(sum(ms) / len(ms), 1), 'Última (ms)': round(ms[-1], 1)} for etapa, ms in sorted(tempos.items()) if ms]
+    return pd.DataFrame(linhas)
+
+# --- DOWNLOADS GERADOS SOB DEMANDA ---
+# O Streamlit roda o callable de data= numa thread própria e ignora st.error lá dentro. A falha fica guardada
+# por sessão e botão e aparece acima do botão no rerun seguinte; o erro é relançado para o download falhar.
+@st.cache_resource
+def _erros_download() -> dict:
+    return {'lock': threading.Lock(), 'erros': {}}
+
+def botao_download_sob_demanda(label: str, gerar, chave: str, **kwargs):
+    ctx = get_script_run_ctx()
+    origem = (ctx.session_id if ctx else None, chave); store = _erros_download()
+    with store['lock']: erro = store['erros'].pop(origem, None)
+    if erro: st.error(f"Erro ao gerar Excel: {erro}")
+    def gerar_com_aviso():
+        try: return gerar()
+        except Exception as e:
+            with store['lock']: store['erros'][origem] = e
+            raise
+    return st.download_button(label, data=gerar_com_aviso, key=chave, **kwargs)
+
+# --- ESQUEMA DO BANCO (COLUNAS OPCIONAIS) ---
+# Bancos mais antigos não têm algumas colunas. Elas são declaradas aqui com o valor padrão usado na
+# leitura; a presença real em 'colaboradores' é sondada uma vez por processo e os payloads de escrita
+# já saem no formato certo, sem gravar, falhar e repetir sem a coluna.
+COLUNAS_OPCIONAIS = {
+    'colaboradores': {'funcao': 'Operador(a) de Caixa', 'nome_social': '', 'folga_fixa': '', 'status': 'Ativo'},
+    'escala': {'numero_caixa': ''},
+}
+
+def _coluna_inexistente(erro: Exception) -> bool:
+    return '42703' in str(erro) or 'does not exist' in str(erro)
+
+def _funcao_inexistente(erro: Exception) -> bool:
+    # RPC não implantada no banco (PostgREST PGRST202 / Postgres 42883); qualquer outro erro é falha de verdade
+    return getattr(erro, 'code', None) in ('PGRST202', '42883') or any(c in str(erro) for c in ('PGRST202', '42883'))
+
+# RPCs opcionais (sql/funcoes_rpc.sql) que o banco não tem: lembradas por processo para não pagar uma
+# chamada falha a cada uso; depois do intervalo tentam de novo, caso a função tenha sido criada.
+INTERVALO_REVERIFICAR_RPC_SEGUNDOS = 600
+
+@st.cache_resource
+def _rpcs_ausentes() -> dict:
+    return {}
+
+def rpc_disponivel(funcao: str) -> bool:
+    marcada = _rpcs_ausentes().get(funcao)
+    return marcada is None or time.monotonic() - marcada >= INTERVALO_REVERIFICAR_RPC_SEGUNDOS
+
+def lembrar_rpc_ausente(funcao: str, erro: Exception) -> bool:
+    if not _funcao_inexistente(erro): return False
+    _rpcs_ausentes()[funcao] = time.monotonic()
+    return True
+
+@st.cache_resource(show_spinner=False)
+def colunas_colaboradores() -> frozenset:
+    # Só uma resposta definitiva fica em cache: erro de rede sobe e a sondagem é refeita na próxima chamada
+    amostra = supabase.table('colaboradores').select('*').limit(1).execute().data
+    if amostra: return frozenset(amostra[0].keys())
+    presentes = {'nome'}
+    for coluna in list(COLUNAS_OPCIONAIS['colaboradores']) + ['updated_at']:
+        try: supabase.table('colaboradores').select(coluna).limit(1).execute(); presentes.add(coluna)
+        except Exception as e:
+            if not _coluna_inexistente(e): raise
+    return frozenset(presentes)
+
+def payload_colaborador(registro: dict) -> dict:
+    colunas = colunas_colaboradores()
+    return {k: v for k, v in registro.items() if k == 'nome' or k in colunas}
+
+def completar_colunas_opcionais(df: pd.DataFrame, tabela: str) -> pd.DataFrame:
+    for coluna, padrao in COLUNAS_OPCIONAIS[tabela].items():
+        df[coluna] = df[coluna].fillna(padrao) if coluna in df.columns else padrao
+    return df
+
+# --- SINCRONIA INCREMENTAL (DELTA POR updated_at) ---
+INTERVALO_SINCRONIA_SEGUNDOS = 5
+INTERVALO_RECARGA_SEM_DELTA_SEGUNDOS = 10  # banco sem delta: mesma frequência do antigo ttl=10
+INTERVALO_RECARGA_TOTAL_SEGUNDOS = 600
+MARGEM_DELTA_SEGUNDOS = 5  # relê esse trecho antes do cursor: pega linhas que commitam atrasadas com updated_at antigo
+LIMITE_SEMANAS_EM_MEMORIA = 12
+
+class TabelaSincronizada:
+    # Guarda um DataFrame em memória (compartilhado entre sessões) e, a cada intervalo, pede ao banco só as
+    # linhas com updated_at >= cursor - margem, aplicando-as por chave. A rede fica fora do lock de estado e
+    # só uma sessão busca por vez: quem já tem dados recebe o df atual em vez de esperar a busca de outra.
+    # Sem updated_at ou sem a RPC de delta (lembrado em delta_disponivel), recarrega tudo num intervalo maior.
+    # forcar=True ignora os intervalos (espera a busca em andamento e consulta o banco de novo) para quem vai
+    # comparar com o que está salvo, como a importação do Excel.
+    def __init__(self, chaves: list, versao_invalidacao: int = 0, intervalos: tuple = None):
+        self.chaves = chaves
+        self.versao_invalidacao = versao_invalidacao
+        self.intervalo_delta, self.intervalo_sem_delta, self.intervalo_total = intervalos or (INTERVALO_SINCRONIA_SEGUNDOS, INTERVALO_RECARGA_SEM_DELTA_SEGUNDOS, INTERVALO_RECARGA_TOTAL_SEGUNDOS)
+        self.lock = threading.Lock()    # estado (df, cursor, versão); nunca fica preso durante uma requisição
+        self._busca = threading.Lock()  # uma busca no banco por vez
+        self.df = None; self.cursor = None; self.versao = 0; self.delta_disponivel = True
+        self._verificado_em = 0.0; self._recarregado_em = 0.0
+
+    def _pendente(self, agora: float, forcar: bool = False):
+        # Chamado com self.lock: None (df atual serve), 'delta' ou 'tudo'.
+        if self.df is None or agora - self._recarregado_em >= self.intervalo_total: return 'tudo'
+        if self.cursor is None or not self.delta_disponivel: return 'tudo' if forcar or agora - self._recarregado_em >= self.intervalo_sem_delta else None
+        return 'delta' if forcar or agora - self._verificado_em >= self.intervalo_delta else None
+
+    def obter(self, buscar_tudo, buscar_delta, forcar: bool = False) -> tuple:
+        # Retorna (df, recarregou_tudo, aplicou_delta).
+        with self.lock: acao = self._pendente(time.monotonic(), forcar); df = self.df
+        if acao is None: return df, False, False
+        if not self._busca.acquire(blocking=df is None or forcar): return df, False, False  # outra sessão já está buscando
+        try:
+            with self.lock:
+                acao = self._pendente(time.monotonic(), forcar); cursor = self.cursor
+                if acao == 'delta': self._verificado_em = time.monotonic()
+            if acao is None: return self.df, False, False
+            if acao == 'delta':
+                try: delta = buscar_delta(_cursor_com_margem(cursor))
+                except Exception as e:
+                    if forcar and not _funcao_inexistente(e): raise  # quem forçou precisa do dado atual, não do da memória
+                    if not _funcao_inexistente(e): return self.df, False, False  # falha passageira: tenta no próximo intervalo
+                    with self.lock: self.delta_disponivel = False
+                else: return self._aplicar_delta(delta)
+            novo = buscar_tudo()
+            with self.lock:
+                # Recarga igual ao que já está em memória não gera versão nova (nem reconstrói o que depende dela).
+                if not _mesmo_conteudo(self.df, novo, self.chaves): self.versao += 1
+                self.df = novo; self.cursor = _maior_updated_at(novo)
+                self._verificado_em = self._recarregado_em = time.monotonic()
+                return self.df, True, False
+        finally: self._busca.release()
+
+    def _aplicar_delta(self, delta: pd.DataFrame) -> tuple:
+        with self.lock:
+            if delta.empty or not _tem_linhas_novas(self.df, delta): return self.df, False, False
+            self.df = pd.concat([self.df, delta], ignore_index=True).drop_duplicates(subset=self.chaves, keep='last').reset_index(drop=True)
+            self.cursor = _maior_updated_at(self.df) or self.cursor
+            self.versao += 1
+            return self.df, False, True
+
+def _maior_updated_at(df: pd.DataFrame):
+    if df is None or df.empty or 'updated_at' not in df.columns: return None
+    maior = df['updated_at'].dropna().max()
+    return None if pd.isna(maior) else str(maior)
+
+def _mesmo_conteudo(df: pd.DataFrame, novo: pd.DataFrame, chaves: list) -> bool:
+    # Compara sem depender da ordem em que o banco devolveu as linhas.
+    if df is None or len(df) != len(novo) or set(df.columns) != set(novo.columns): return False
+    if df.empty: return True
+    colunas = sorted(df.columns)
+    try:
+        a = df[colunas].sort_values(chaves).reset_index(drop=True)
+        b = novo[colunas].sort_values(chaves).reset_index(drop=True)
+    except (KeyError, TypeError): return False
+    return a.equals(b)
+
+def _cursor_com_margem(cursor: str) -> str:
+    return (pd.Timestamp(cursor) - pd.Timedelta(seconds=MARGEM_DELTA_SEGUNDOS)).isoformat()
+
+def _tem_linhas_novas(df: pd.DataFrame, delta: pd.DataFrame) -> bool:
+    # A margem relê linhas já conhecidas: só conta como mudança o que não estiver idêntico no df.
+    colunas = list(delta.columns)
+    if not set(colunas) <= set(df.columns): return True
+    try: cruzado = delta.merge(df[colunas].drop_duplicates(), on=colunas, how='left', indicator=True)
+    except (TypeError, ValueError): return True
+    return bool((cruzado['_merge'] == 'left_only').any())
+
+@st.cache_resource
+def _store_sincronizado() -> dict:
+    # 'semanas'/'escalas' são LRU por id da semana (OrderedDict: a mais recente no fim)
+    return {'lock': threading.Lock(), 'colaboradores': None, 'semanas': OrderedDict(), 'escalas': OrderedDict()}
+
+def _normalizar_colaboradores(df: pd.DataFrame) -> pd.DataFrame:
+    if not df.empty: 
+        df['nome'] = df['nome'].str.strip()
+        df = completar_colunas_opcionais(df, 'colaboradores')
+    return df
+
+# Só as colunas que o app usa (+ updated_at para o delta), respeitando o que o banco realmente tem
+COLUNAS_COLABORADORES = ['nome', 'funcao', 'nome_social', 'folga_fixa', 'status', 'updated_at']
+
+def _buscar_colaboradores(desde: str = None) -> pd.DataFrame:
+    existentes = colunas_colaboradores()
+    query = supabase.table('colaboradores').select(", ".join(c for c in COLUNAS_COLABORADORES if c == 'nome' or c in existentes))
+    if desde: query = query.gte('updated_at', desde)
+    return _normalizar_colaboradores(pd.DataFrame(query.execute().data))
+
+def _tabela_colaboradores() -> TabelaSincronizada:
+    store = _store_sincronizado()
+    with store['lock']:
+        versao = versao_cache('colaboradores')
+        tabela = store['colaboradores']
+        if tabela is None or tabela.versao_invalidacao != versao:
+            tabela = TabelaSincronizada(['nome'], versao); store['colaboradores'] = tabela
+        return tabela
+
+def versao_colaboradores() -> tuple:
+    tabela = _tabela_colaboradores()
+    return (tabela.versao_invalidacao, tabela.versao)
+
+def carregar_colaboradores(funcao: str = None, status: list = None, colunas: list = None) -> pd.DataFrame:
+    # A tabela inteira já fica sincronizada em memória por delta; os filtros são aplicados sobre ela
+    _registrar_acesso('colaboradores')
     try:
-        response = supabase.table('colaboradores').select('*').execute()
-        df = pd.DataFrame(response.data)
-        if not df.empty: 
-            df['nome'] = df['nome'].str.strip()
-            if 'funcao' not in df.columns: df['funcao'] = 'Operador(a) de Caixa'
-            if 'nome_social' not in df.columns: df['nome_social'] = None
-            if 'folga_fixa' not in df.columns: df['folga_fixa'] = None
-            if 'status' not in df.columns: df['status'] = 'Ativo'
-            df['funcao'] = df['funcao'].fillna('Operador(a) de Caixa')
-            df['nome_social'] = df['nome_social'].fillna('')
-            df['folga_fixa'] = df['folga_fixa'].fillna('')
-            df['status'] = df['status'].fillna('Ativo')
-        return df
+        df, recarregou, aplicou_delta = _tabela_colaboradores().obter(_buscar_colaboradores, _buscar_colaboradores)
+        if recarregou: _registrar_acesso('colaboradores', miss=True)
+        if aplicou_delta: _registrar_acesso('colaboradores_delta'); _registrar_acesso('colaboradores_delta', miss=True)
+        if df.empty: return df.copy()
+        if funcao: df = df[df['funcao'] == funcao]
+        if status: df = df[df['status'].isin(status)]
+        if colunas: df = df[colunas]
+        return df.copy()
     except Exception as e: 
         return pd.DataFrame()
 
-@st.cache_data(ttl=60)
 def carregar_indice_semanas(apenas_ativas: bool = False) -> pd.DataFrame:
+    _registrar_acesso('indice_semanas')
+    return _carregar_indice_semanas(apenas_ativas, versao_cache('semanas'))
+
+@st.cache_data(ttl=60)
+def _carregar_indice_semanas(apenas_ativas: bool, versao: int) -> pd.DataFrame:
+    _registrar_acesso('indice_semanas', miss=True)
     try:
         query = supabase.table('semanas').select('id, nome_semana, data_inicio, ativa').order('data_inicio', desc=True)
         if apenas_ativas: query = query.eq('ativa', True)
@@ -115,88 +546,312 @@ def carregar_indice_semanas(apenas_ativas: bool = False) -> pd.DataFrame:
         return pd.DataFrame(response.data)
     except Exception as e: st.error(f"Erro ao carregar índice de semanas: {e}"); return pd.DataFrame()
 
-@st.cache_data(ttl=10)
-def carregar_escala_semana_por_id(id_semana: int) -> pd.DataFrame:
+# --- ESTRUTURA DA SEMANA (ÍNDICES POR PESSOA E POR DIA) ---
+class EscalaSemana:
+    # Montada uma vez por semana carregada: datas já convertidas, minutos pré-calculados
+    # e acesso direto por colaborador, por dia e por (nome, data) sem refazer máscaras.
+    # O objeto é compartilhado entre sessões, então df/do_colaborador/do_dia entregam cópias: quem alterar
+    # o resultado não mexe na escala das outras sessões.
+    def __init__(self, df: pd.DataFrame, chave: tuple = None):
+        self.chave = chave  # versão dos dados que geraram a estrutura (serve de chave para caches derivados)
+        df = df.copy() if not df.empty else pd.DataFrame(columns=['nome', 'data', 'horario', 'numero_caixa'])
+        df['data'] = pd.to_datetime(df['data'], errors='coerce')
+        df['data_date'] = df['data'].dt.date
+        df['codigo_turno'] = codigos_turno(df['horario'])
+        df['minutos'] = minutos_turno(df['horario'])
+        self._df = df.sort_values(['nome', 'data']).reset_index(drop=True)
+        self._por_nome = {nome: g for nome, g in self._df.groupby('nome', sort=False)}
+        self._por_dia = {d: g for d, g in self._df.groupby('data_date', sort=False)}
+        self._celulas = {(n, d): (h, c) for n, d, h, c in zip(self._df['nome'], self._df['data_date'], self._df['horario'], self._df['numero_caixa'])}
+
+    @property
+    def df(self) -> pd.DataFrame: return self._df.copy()
+
+    @property
+    def empty(self) -> bool: return self._df.empty
+
+    def do_colaborador(self, nome: str) -> pd.DataFrame: return self._por_nome.get(nome, self._df.iloc[0:0]).copy()
+
+    def do_dia(self, data_dia: date) -> pd.DataFrame: return self._por_dia.get(data_dia, self._df.iloc[0:0]).copy()
+
+    def horarios(self, nome: str) -> list: return self._por_nome.get(nome, self._df.iloc[0:0])['horario'].tolist()
+
+    def celula(self, nome: str, data_dia: date) -> tuple: return self._celulas.get((nome, data_dia), ("", ""))
+
+def _buscar_escala_semana(id_semana: int, desde: str = None) -> pd.DataFrame:
+    if desde: linhas = rpc_paginada('get_escala_semana_delta', {'p_semana_id': int(id_semana), 'p_desde': desde}, ['nome', 'data'])
+    else: linhas = rpc_paginada('get_escala_semana', {'p_semana_id': int(id_semana)}, ['nome', 'data'])
+    df = pd.DataFrame(linhas)
+    if not df.empty:
+        df['data'] = pd.to_datetime(df['data'], errors='coerce')
+        df['nome'] = df['nome'].str.strip()
+        df = completar_colunas_opcionais(df, 'escala')
+    return df
+
+def _mesclar_colaboradores(df: pd.DataFrame, df_colabs: pd.DataFrame) -> pd.DataFrame:
+    if df.empty or df_colabs.empty or 'funcao' not in df_colabs.columns: return df
+    cols_to_merge = ['funcao', 'nome_social', 'status']
+    df = df.merge(df_colabs.drop_duplicates(subset=['nome'])[['nome'] + cols_to_merge], on='nome', how='left')
+    for coluna in cols_to_merge: df[coluna] = df[coluna].fillna(COLUNAS_OPCIONAIS['colaboradores'][coluna])
+    return df
+
+def _usar_semana_lru(store: dict, id_semana: int):
+    # Chamado com store['lock'] já adquirido: marca a semana como recém-usada e descarta as mais antigas
+    for chave in ('semanas', 'escalas'):
+        if id_semana in store[chave]: store[chave].move_to_end(id_semana)
+        while len(store[chave]) > LIMITE_SEMANAS_EM_MEMORIA: store[chave].popitem(last=False)
+
+def carregar_escala_semana(id_semana: int, silencioso: bool = False, forcar: bool = False) -> EscalaSemana:
+    # O objeto devolvido é compartilhado entre sessões: trate-o como somente leitura.
+    # forcar=True consulta o banco mesmo dentro do intervalo de sincronia (ver TabelaSincronizada.obter).
+    id_semana = int(id_semana)
+    _registrar_acesso('escala_semana')
+    store = _store_sincronizado()
+    with store['lock']:
+        versao = versao_cache(f"semana:{id_semana}")
+        tabela = store['semanas'].get(id_semana)
+        if tabela is None or tabela.versao_invalidacao != versao:
+            tabela = TabelaSincronizada(['nome', 'data'], versao); store['semanas'][id_semana] = tabela
+        _usar_semana_lru(store, id_semana)
     try:
-        params = {'p_semana_id': int(id_semana)}
-        response = supabase.rpc('get_escala_semana', params).execute()
-        df = pd.DataFrame(response.data)
-        if not df.empty:
-            df['data'] = pd.to_datetime(df['data'], errors='coerce')
-            df['nome'] = df['nome'].str.strip()
-            if 'numero_caixa' not in df.columns: df['numero_caixa'] = ""
-            df['numero_caixa'] = df['numero_caixa'].fillna("")
-            
-            df_colabs = carregar_colaboradores()
-            if not df_colabs.empty and 'funcao' in df_colabs.columns:
-                cols_to_merge = ['nome', 'funcao']
-                if 'nome_social' in df_colabs.columns: cols_to_merge.append('nome_social')
-                if 'status' in df_colabs.columns: cols_to_merge.append('status')
-                
-                df_colabs_unique = df_colabs.drop_duplicates(subset=['nome'])
-                df = df.merge(df_colabs_unique[cols_to_merge], on='nome', how='left')
-                df['funcao'] = df['funcao'].fillna('Operador(a) de Caixa')
-                if 'nome_social' in df.columns: df['nome_social'] = df['nome_social'].fillna('')
-                if 'status' in df.columns: df['status'] = df['status'].fillna('Ativo')
-        return df
-    except Exception as e: st.error(f"Erro ao carregar escala: {e}"); return pd.DataFrame()
+        df, recarregou, aplicou_delta = tabela.obter(lambda: _buscar_escala_semana(id_semana), lambda desde: _buscar_escala_semana(id_semana, desde), forcar)
+    except Exception as e:
+        if not silencioso: st.error(f"Erro ao carregar escala: {e}")
+        return EscalaSemana(pd.DataFrame())
+    if recarregou: _registrar_acesso('escala_semana', miss=True)
+    if aplicou_delta: _registrar_acesso('escala_semana_delta'); _registrar_acesso('escala_semana_delta', miss=True)
+
+    # A escala traz função/nome social/status mesclados, então também depende da versão dos colaboradores.
+    df_colabs = carregar_colaboradores()
+    chave = (tabela.versao_invalidacao, tabela.versao, versao_colaboradores())
+    with store['lock']:
+        montada = store['escalas'].get(id_semana)
+        if montada and montada[0] == chave: return montada[1]
+    escala = EscalaSemana(_mesclar_colaboradores(df, df_colabs), (id_semana,) + chave)
+    with store['lock']: store['escalas'][id_semana] = (chave, escala); _usar_semana_lru(store, id_semana)
+    return escala
+
+# --- PRÉ-CARGA DAS SEMANAS VIZINHAS ---
+# Ao abrir a semana W, a anterior, a seguinte e a ativa mais recente são carregadas numa thread de fundo,
+# então trocar de semana nas abas já encontra a escala na memória.
+@st.cache_resource
+def _estado_pre_carga() -> dict:
+    return {'lock': threading.Lock(), 'pendentes': set(), 'executor': ThreadPoolExecutor(max_workers=1, thread_name_prefix="pre-carga-semanas")}
+
+def semana_em_memoria(id_semana: int) -> bool:
+    store = _store_sincronizado()
+    with store['lock']:
+        tabela = store['semanas'].get(id_semana)
+        return tabela is not None and tabela.df is not None and tabela.versao_invalidacao == versao_cache(f"semana:{id_semana}")
+
+def semanas_vizinhas(id_semana: int) -> list:
+    df_semanas = carregar_indice_semanas()
+    if df_semanas.empty: return []
+    df_semanas = df_semanas.sort_values('data_inicio')
+    ids = df_semanas['id'].astype(int).tolist()
+    vizinhas = []
+    if id_semana in ids:
+        pos = ids.index(id_semana)
+        vizinhas += ids[max(pos - 1, 0):pos] + ids[pos + 1:pos + 2]
+    ativas = df_semanas[df_semanas['ativa'] == True]
+    if not ativas.empty: vizinhas.append(int(ativas.iloc[-1]['id']))
+    return [i for i in dict.fromkeys(vizinhas) if i != id_semana]
+
+def semana_anterior(data_ini: date):
+    # Id da semana que começa 7 dias antes (None se não estiver cadastrada).
+    df_semanas = carregar_indice_semanas()
+    if df_semanas.empty: return None
+    anteriores = df_semanas[pd.to_datetime(df_semanas['data_inicio']).dt.date == data_ini - timedelta(days=7)]
+    return int(anteriores.iloc[0]['id']) if not anteriores.empty else None
+
+def _pre_carregar_semana(id_semana: int):
+    # Worker do processo inteiro: roda sem o contexto de nenhuma sessão, para não mandar avisos à sessão
+    # de quem pediu, e com os acessos ao cache marcados como pré-carga (não inflam a taxa de acerto).
+    estado = _estado_pre_carga()
+    _origem_acesso.pre_carga = True
+    try:
+        with cronometro("Pré-carga: semana vizinha"): carregar_escala_semana(id_semana, silencioso=True)
+    finally:
+        _origem_acesso.pre_carga = False
+        with estado['lock']: estado['pendentes'].discard(id_semana)
+
+def pre_carregar_semanas_vizinhas(id_semana: int):
+    estado = _estado_pre_carga()
+    for vizinha in semanas_vizinhas(int(id_semana)):
+        with estado['lock']:
+            if vizinha in estado['pendentes'] or semana_em_memoria(vizinha): continue
+            estado['pendentes'].add(vizinha)
+        estado['executor'].submit(_pre_carregar_semana, vizinha)
+
+def carregar_escala_semana_por_id(id_semana: int) -> pd.DataFrame:
+    return carregar_escala_semana(id_semana).df
+
+@st.cache_data(ttl=60)
+def _carregar_escalas_semanas(ids_semanas: tuple, versoes: tuple) -> pd.DataFrame:
+    df = pd.DataFrame(rpc_paginada('get_escala_semanas', {'p_semana_ids': list(ids_semanas)}, ['semana_id', 'nome', 'data']))
+    if not df.empty:
+        df['data'] = pd.to_datetime(df['data'], errors='coerce')
+        df['nome'] = df['nome'].str.strip()
+    return df
+
+def carregar_escalas_semanas(ids_semanas) -> pd.DataFrame:
+    # Várias semanas em uma única consulta; se o banco não tiver a função, junta as semanas já em cache.
+    ids_semanas = tuple(sorted({int(i) for i in ids_semanas}))
+    if not ids_semanas: return pd.DataFrame(columns=['semana_id', 'nome', 'data', 'horario', 'numero_caixa'])
+    if rpc_disponivel('get_escala_semanas'):
+        try: return _carregar_escalas_semanas(ids_semanas, tuple(versao_cache(f"semana:{i}") for i in ids_semanas))
+        except Exception as e: lembrar_rpc_ausente('get_escala_semanas', e)
+    partes = [carregar_escala_semana(i).df[['nome', 'data', 'horario', 'numero_caixa']].assign(semana_id=i) for i in ids_semanas]
+    return pd.concat(partes, ignore_index=True)
+
+# --- GRAVAÇÃO EM LOTE DA ESCALA ---
+def montar_registro_escala(nome: str, data_dia: date, horario, caixa) -> dict:
+    return {'nome': str(nome).strip(), 'data': data_dia.strftime('%Y-%m-%d'), 'horario': horario, 'caixa': caixa}
+
+def salvar_escala_lote(registros: list, id_semana: int) -> list:
+    # Envia todos os dias/pessoas em um único payload (uma transação no banco) e devolve os erros por linha.
+    # Contrato da função (p_registros e a resposta [{indice, erro}]) em sql/funcoes_rpc.sql.
+    if not registros: return []
+    if not rpc_disponivel('save_escala_lote'): return _salvar_escala_linha_a_linha(registros, id_semana)
+    try: response = supabase.rpc('save_escala_lote', {'p_semana_id': int(id_semana), 'p_registros': registros}).execute()
+    except Exception as e:
+        invalidar_cache(f"semana:{int(id_semana)}")
+        # Timeout, rollback ou 5xx: o lote pode ter sido gravado, então nada é reenviado e o erro sobe para quem chamou.
+        if not lembrar_rpc_ausente('save_escala_lote', e): raise
+        return _salvar_escala_linha_a_linha(registros, id_semana)
+    invalidar_cache(f"semana:{int(id_semana)}")
+    erros = []
+    for e in response.data or []:
+        try: erros.append((registros[int(e['indice'])], e.get('erro', '')))
+        except (KeyError, TypeError, ValueError, IndexError): erros.append(({'nome': '?', 'data': '?'}, f"Resposta inesperada do banco: {e}"))
+    return erros
+
+def _salvar_escala_linha_a_linha(registros: list, id_semana: int) -> list:
+    # Banco sem a função de lote: gravação antiga, uma chamada por linha.
+    erros = []
+    for reg in registros:
+        try: supabase.rpc('save_escala_dia_final', {'p_nome': reg['nome'], 'p_data': reg['data'], 'p_horario': reg['horario'], 'p_caixa': reg['caixa'], 'p_semana_id': int(id_semana)}).execute()
+        except Exception as e: erros.append((reg, str(e)))
+    invalidar_cache(f"semana:{int(id_semana)}")
+    return erros
+
+def exibir_erros_lote(erros: list):
+    if not erros: return
+    linhas = [f"* **{reg['nome']}** em {reg['data']}: {msg}" for reg, msg in erros[:20]]
+    if len(erros) > 20: linhas.append(f"* ... e mais {len(erros) - 20}")
+    st.warning(f"⚠️ {len(erros)} registro(s) não foram salvos:\n" + "\n".join(linhas))
 
 def salvar_escala_individual(nome: str, horarios: list, caixas: list, data_inicio: date, id_semana: int) -> bool:
     try:
+        registros = []
         for i, horario in enumerate(horarios):
-            data_dia = data_inicio + timedelta(days=i)
             cx = caixas[i] if caixas and i < len(caixas) else None
-            supabase.rpc('save_escala_dia_final', {'p_nome': nome.strip(), 'p_data': data_dia.strftime('%Y-%m-%d'), 'p_horario': horario, 'p_caixa': cx, 'p_semana_id': int(id_semana)}).execute()
-        return True
+            registros.append(montar_registro_escala(nome, data_inicio + timedelta(days=i), horario, cx))
+        erros = salvar_escala_lote(registros, id_semana)
+        exibir_erros_lote(erros)
+        return not erros
     except Exception as e: st.error(f"Erro ao salvar: {e}"); return False
 
-def salvar_escala_via_excel(df_excel: pd.DataFrame, data_inicio_semana: date, id_semana: int) -> bool:
+# --- IMPORTAÇÃO DA PLANILHA (LEITURA ÚNICA, FORMATO LONGO, VALIDAÇÃO EM BLOCO) ---
+PADRAO_LINHAS_IGNORADAS = r"TOTAL|MANH|TARDE|OPERADOR"
+
+def _cabecalho_excel(valor) -> str:
+    if isinstance(valor, (datetime.datetime, date)): return valor.strftime('%d/%m/%Y')
+    return "" if valor is None else str(valor).strip()
+
+def _texto_celulas(serie: pd.Series) -> pd.Series:
+    return serie.astype(object).where(serie.notna(), "").astype(str).str.strip()
+
+def ler_planilha_escala(arquivo) -> tuple:
+    # Uma única passada pela primeira aba em modo read-only (sem montar estilos nem células vazias)
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
     try:
-        datas_reais = [(data_inicio_semana + timedelta(days=i)).strftime('%d/%m/%Y') for i in range(7)]
-        res_nomes = supabase.table('colaboradores').select('nome').execute()
-        nomes_banco = {item['nome'] for item in res_nomes.data}
-        barra = st.progress(0, text="Processando arquivo...")
-        total_linhas = len(df_excel)
-        for index, row in df_excel.iterrows():
-            nome = row.get('Nome')
-            if pd.isna(nome) or str(nome).strip() == "" or "TOTAL" in str(nome).upper() or "MANH" in str(nome).upper() or "TARDE" in str(nome).upper() or "OPERADOR" in str(nome).upper(): continue
-            nome_limpo = str(nome).strip()
-            if nome_limpo not in nomes_banco:
-                try:
-                    supabase.table('colaboradores').insert({'nome': nome_limpo, 'funcao': 'Operador(a) de Caixa', 'status': 'Ativo'}).execute()
-                    nomes_banco.add(nome_limpo)
-                except: 
-                    try: supabase.table('colaboradores').insert({'nome': nome_limpo, 'funcao': 'Operador(a) de Caixa'}).execute()
-                    except: pass
-            for i in range(7):
-                data_str_header = datas_reais[i]
-                horario = ""
-                if data_str_header in df_excel.columns: horario = row[data_str_header]
-                if pd.isna(horario): horario = ""
-                horario = str(horario).strip()
-                caixa = None
-                try:
-                    col_idx = df_excel.columns.get_loc(data_str_header)
-                    if col_idx + 1 < len(df_excel.columns):
-                        prox_col_nome = str(df_excel.columns[col_idx + 1]).upper()
-                        if "CX" in prox_col_nome or "TAREFA" in prox_col_nome:
-                            val_caixa = row.iloc[col_idx + 1]
-                            if not pd.isna(val_caixa): caixa = str(val_caixa).strip().replace(".0", "")
-                except: caixa = None
-                data_banco = (data_inicio_semana + timedelta(days=i)).strftime('%Y-%m-%d')
-                supabase.rpc('save_escala_dia_final', {'p_nome': nome_limpo, 'p_data': data_banco, 'p_horario': horario, 'p_caixa': caixa, 'p_semana_id': int(id_semana)}).execute()
-            if index % 5 == 0: barra.progress((index + 1) / total_linhas)
-        barra.empty()
-        return True
-    except Exception as e: st.error(f"Erro ao processar Excel: {e}"); return False
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = [_cabecalho_excel(v) for v in next(linhas, ())]
+        valores = pd.DataFrame(list(linhas)).reindex(columns=range(len(cabecalho)))
+    finally: wb.close()
+    return cabecalho, valores
+
+def planilha_para_formato_longo(cabecalho: list, valores: pd.DataFrame, data_inicio_semana: date) -> pd.DataFrame:
+    maiusculo = [c.upper() for c in cabecalho]
+    if "NOME" not in maiusculo: raise ValueError("coluna 'Nome' não encontrada na planilha")
+    nomes = _texto_celulas(valores[maiusculo.index("NOME")])
+    validos = (nomes != "") & ~nomes.str.upper().str.contains(PADRAO_LINHAS_IGNORADAS)
+    nomes = nomes[validos]; vazio = pd.Series("", index=nomes.index)
+
+    blocos = []
+    for i in range(7):
+        data_dia = data_inicio_semana + timedelta(days=i)
+        d_str = data_dia.strftime('%d/%m/%Y')
+        col = cabecalho.index(d_str) if d_str in cabecalho else None
+        tem_ref = col is not None and col + 1 < len(maiusculo) and ("CX" in maiusculo[col + 1] or "TAREFA" in maiusculo[col + 1])
+        horario = _texto_celulas(valores.loc[validos, col]) if col is not None else vazio
+        caixa = _texto_celulas(valores.loc[validos, col + 1]).str.replace(r"\.0$", "", regex=True) if tem_ref else vazio
+        blocos.append(pd.DataFrame({'nome': nomes, 'data': data_dia, 'horario': horario, 'caixa': caixa}))
+    return pd.concat(blocos, ignore_index=True).drop_duplicates(['nome', 'data'], keep='last')
+
+def validar_formato_longo(df_longo: pd.DataFrame) -> tuple:
+    horarios_invalidos = df_longo[~df_longo['horario'].isin(HORARIOS_PADRAO)]
+    caixas_desconhecidas = df_longo[(df_longo['caixa'] != "") & ~df_longo['caixa'].isin(LISTA_OPCOES_CAIXA + LISTA_TAREFAS_EMPACOTADOR)]
+    return horarios_invalidos, caixas_desconhecidas
+
+def cadastrar_colaboradores_novos(nomes) -> list:
+    nomes_banco = {item['nome'] for item in supabase.table('colaboradores').select('nome').execute().data}
+    novos = sorted(set(nomes) - nomes_banco)
+    if not novos: return []
+    supabase.table('colaboradores').insert([payload_colaborador({'nome': n, 'funcao': 'Operador(a) de Caixa', 'status': 'Ativo'}) for n in novos]).execute()
+    invalidar_cache('colaboradores')
+    return novos
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def analisar_planilha_escala(conteudo: bytes, data_inicio_semana: date) -> pd.DataFrame:
+    return planilha_para_formato_longo(*ler_planilha_escala(io.BytesIO(conteudo)), data_inicio_semana)
+
+def diferenca_escala(df_longo: pd.DataFrame, escala: EscalaSemana) -> pd.DataFrame:
+    # Só as células cuja combinação (horário, caixa) difere do que já está salvo; célula inexistente conta como vazia
+    atual = escala.df[['nome', 'data_date', 'horario', 'numero_caixa']].rename(columns={'data_date': 'data', 'horario': 'horario_atual', 'numero_caixa': 'caixa_atual'})
+    atual['horario_atual'] = _texto_celulas(atual['horario_atual'])
+    atual['caixa_atual'] = _texto_celulas(atual['caixa_atual']).str.replace(r"\.0$", "", regex=True)
+    df = df_longo.merge(atual.drop_duplicates(['nome', 'data'], keep='last'), on=['nome', 'data'], how='left')
+    df[['horario_atual', 'caixa_atual']] = df[['horario_atual', 'caixa_atual']].fillna("")
+    mudou = (df['horario'] != df['horario_atual']) | (df['caixa'] != df['caixa_atual'])
+    return df[mudou].sort_values(['nome', 'data']).reset_index(drop=True)
+
+def exibir_validacao_planilha(df_longo: pd.DataFrame) -> bool:
+    horarios_invalidos, caixas_desconhecidas = validar_formato_longo(df_longo)
+    if not horarios_invalidos.empty:
+        st.error(f"{len(horarios_invalidos)} horário(s) fora da lista padrão. Corrija a planilha e envie novamente:")
+        st.dataframe(horarios_invalidos[['nome', 'data', 'horario']], hide_index=True, use_container_width=True)
+        return False
+    if not caixas_desconhecidas.empty:
+        st.warning("Caixas/tarefas fora da lista padrão (mantidos como estão): " + ", ".join(sorted(caixas_desconhecidas['caixa'].unique())))
+    return True
+
+def salvar_escala_via_excel(df_longo: pd.DataFrame, id_semana: int) -> bool:
+    # Cadastra antes quem é novo (inclusive quem só tem células vazias na planilha) e refaz a diferença contra
+    # a escala lida agora do banco: a prévia pode ter sido montada sobre uma cópia com alguns segundos de atraso.
+    try:
+        novos = cadastrar_colaboradores_novos(df_longo['nome'].unique())
+        if novos: st.info(f"{len(novos)} colaborador(es) novo(s) cadastrado(s): {', '.join(novos)}")
+
+        escala = carregar_escala_semana(id_semana, forcar=True)
+        df_alteracoes = diferenca_escala(df_longo, escala)
+        if df_alteracoes.empty: st.info("Nenhuma célula a gravar: o banco já tem os valores da planilha."); return True
+        registros = [montar_registro_escala(nome, data_dia, horario, caixa or None) for nome, data_dia, horario, caixa in df_alteracoes[['nome', 'data', 'horario', 'caixa']].itertuples(index=False, name=None)]
+        with st.spinner(f"Salvando {len(registros)} registros..."): erros = salvar_escala_lote(registros, id_semana)
+        exibir_erros_lote(erros)
+        return not erros
+    except Exception as e: st.error(f"Erro ao salvar Excel: {e}"); return False
 
 def inicializar_semana_simples(data_inicio: date) -> bool:
     try:
         supabase.rpc('inicializar_escala_semanal', {'p_data_inicio': data_inicio.strftime('%Y-%m-%d')}).execute()
+        invalidar_cache('semanas')
         res = supabase.table('semanas').select('id').eq('data_inicio', data_inicio.strftime('%Y-%m-%d')).execute()
         if not res.data: return False
         new_id = int(res.data[0]['id'])
         df_colabs = carregar_colaboradores()
+        registros = []
         if not df_colabs.empty:
             for index, row in df_colabs.iterrows():
                 nome = row['nome']
@@ -208,53 +863,97 @@ def inicializar_semana_simples(data_inicio: date) -> bool:
                     if status_atual in ["Ferias", "Afastado(a)", "Atestado"]: horario_padrao = status_atual
                     elif folga_fixa == dia_semana_nome: horario_padrao = "Folga"
                     else: horario_padrao = ""
-                    supabase.rpc('save_escala_dia_final', {'p_nome': nome, 'p_data': d.strftime('%Y-%m-%d'), 'p_horario': horario_padrao, 'p_caixa': None, 'p_semana_id': new_id}).execute()
-        return True
+                    registros.append(montar_registro_escala(nome, d, horario_padrao, None))
+        erros = salvar_escala_lote(registros, new_id)
+        exibir_erros_lote(erros)
+        return not erros
     except Exception as e: st.error(f"Erro: {e}"); return False
 
 def arquivar_reativar_semana(id_semana: int, novo_status: bool):
     try:
         func = 'reativar_semana' if novo_status else 'arquivar_semana'
         supabase.rpc(func, {'p_semana_id': int(id_semana)}).execute()
+        invalidar_cache('semanas')
         return True
     except Exception as e: st.error(f"Erro: {e}"); return False
 
 def adicionar_colaborador(nome: str, funcao: str) -> bool:
     try:
-        try: supabase.table('colaboradores').insert({'nome': nome.strip(), 'funcao': funcao, 'status': 'Ativo'}).execute()
-        except: supabase.table('colaboradores').insert({'nome': nome.strip(), 'funcao': funcao}).execute()
+        supabase.table('colaboradores').insert(payload_colaborador({'nome': nome.strip(), 'funcao': funcao, 'status': 'Ativo'})).execute()
+        invalidar_cache('colaboradores')
         return True
     except Exception as e: st.error(f"Erro ao adicionar: {e}"); return False
 
 def remover_colaboradores(lista_nomes: list) -> bool:
     try:
-        supabase.rpc('delete_colaboradores', {'p_nomes': [n.strip() for n in lista_nomes]}).execute(); return True
+        supabase.rpc('delete_colaboradores', {'p_nomes': [n.strip() for n in lista_nomes]}).execute()
+        invalidar_cache('colaboradores')
+        return True
     except Exception as e: st.error(f"Erro: {e}"); return False
 
-def atualizar_dados_colaborador(nome: str, nova_funcao: str, novo_nome_social: str, nova_folga: str, novo_status: str):
+COLUNAS_EDITAVEIS_COLABORADOR = ['funcao', 'nome_social', 'folga_fixa', 'status']
+
+def colaboradores_alterados(df_original: pd.DataFrame, df_editado: pd.DataFrame) -> pd.DataFrame:
+    # Editor com linhas fixas: mesmo índice dos dois lados, então a comparação é célula a célula de uma vez
+    antes = df_original.loc[df_editado.index, COLUNAS_EDITAVEIS_COLABORADOR].fillna("")
+    depois = df_editado[COLUNAS_EDITAVEIS_COLABORADOR].fillna("")
+    return df_editado[(antes != depois).any(axis=1)]
+
+def atualizar_colaboradores_lote(df_alterados: pd.DataFrame) -> bool:
+    # Só UPDATE (um upsert recriaria quem outra sessão acabou de excluir): linhas com os mesmos valores
+    # novos viram um único update ... in_('nome', [...]), então alterar a função de 40 pessoas é 1 requisição.
+    registros = [payload_colaborador(r) for r in df_alterados[['nome'] + COLUNAS_EDITAVEIS_COLABORADOR].fillna("").to_dict('records')]
+    grupos = {}
+    for r in registros: grupos.setdefault(tuple(sorted((k, v) for k, v in r.items() if k != 'nome')), []).append(r['nome'])
     try:
-        try: supabase.table('colaboradores').update({'funcao': nova_funcao, 'nome_social': novo_nome_social, 'folga_fixa': nova_folga, 'status': novo_status}).eq('nome', nome).execute()
-        except: supabase.table('colaboradores').update({'funcao': nova_funcao, 'nome_social': novo_nome_social, 'folga_fixa': nova_folga}).eq('nome', nome).execute()
+        for valores, nomes in grupos.items(): supabase.table('colaboradores').update(dict(valores)).in_('nome', nomes).execute()
+        invalidar_cache('colaboradores')
         return True
-    except Exception as e: st.error(f"Erro: {e}"); return False
+    except Exception as e: invalidar_cache('colaboradores'); st.error(f"Erro ao atualizar colaboradores: {e}"); return False
 
 def salvar_pedido(nome, texto):
     try:
         supabase.table('pedidos').insert({'nome': nome, 'descricao': texto}).execute()
+        invalidar_cache('pedidos')
         return True
     except Exception as e: st.error(f"Erro ao salvar pedido: {e}"); return False
 
-def carregar_pedidos():
-    try:
-        response = supabase.table('pedidos').select('*').order('created_at', desc=True).execute()
-        return pd.DataFrame(response.data)
-    except Exception as e: return pd.DataFrame()
+COLUNAS_PEDIDOS = "id, created_at, nome, descricao, status"
+TAMANHO_PAGINA_PEDIDOS = 50
 
-def atualizar_status_pedido(id_pedido, novo_status):
+def carregar_pedidos(status: str = None, desde: date = None, ate: date = None, cursor: tuple = None, tamanho: int = TAMANHO_PAGINA_PEDIDOS, colunas: str = COLUNAS_PEDIDOS) -> pd.DataFrame:
+    # Paginação por chave (keyset): a próxima página começa depois do (created_at, id) da última linha
+    # carregada, então o custo não cresce com o número de pedidos arquivados. Cada página é uma entrada no cache.
+    _registrar_acesso('pedidos')
+    return _carregar_pedidos(status, desde, ate, cursor, tamanho, colunas, versao_cache('pedidos'))
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _carregar_pedidos(status: str, desde: date, ate: date, cursor: tuple, tamanho: int, colunas: str, versao: int) -> pd.DataFrame:
+    _registrar_acesso('pedidos', miss=True)
     try:
-        supabase.table('pedidos').update({'status': novo_status}).eq('id', int(id_pedido)).execute()
-        return True
-    except Exception as e: st.error(f"Erro ao atualizar: {e}"); return False
+        query = supabase.table('pedidos').select(colunas).order('created_at', desc=True).order('id', desc=True)
+        if status: query = query.eq('status', status)
+        if desde: query = query.gte('created_at', desde.isoformat())
+        if ate: query = query.lt('created_at', (ate + timedelta(days=1)).isoformat())
+        if cursor:
+            criado_em, id_pedido = cursor
+            query = query.or_(f'created_at.lt."{criado_em}",and(created_at.eq."{criado_em}",id.lt.{int(id_pedido)})')
+        return pd.DataFrame(query.limit(tamanho).execute().data)
+    except Exception as e: st.error(f"Erro ao carregar pedidos: {e}"); return pd.DataFrame()
+
+def proximo_cursor_pedidos(df_pagina: pd.DataFrame, tamanho: int = TAMANHO_PAGINA_PEDIDOS):
+    if len(df_pagina) < tamanho: return None
+    ultima = df_pagina.iloc[-1]
+    return (str(ultima['created_at']), int(ultima['id']))
+
+def atualizar_status_pedidos(novos_status: pd.Series) -> int:
+    # novos_status: índice = id do pedido, valor = novo status. Uma chamada por status distinto.
+    try:
+        for status, ids in novos_status.groupby(novos_status).groups.items():
+            supabase.table('pedidos').update({'status': status}).in_('id', [int(i) for i in ids]).execute()
+        invalidar_cache('pedidos')
+        return len(novos_status)
+    except Exception as e: st.error(f"Erro ao atualizar: {e}"); return 0
 
 @st.cache_data
 def carregar_fiscais() -> pd.DataFrame:
@@ -267,134 +966,240 @@ def carregar_fiscais() -> pd.DataFrame:
     ])
 
 # --- FUNÇÃO DE ALOCAÇÃO AUTOMÁTICA DE HORÁRIOS (RODÍZIO) ---
-def gerar_alocacao_semanal(df_colabs_op, data_ini_atual, df_semanas_todas):
+TURNOS_RODIZIO = ["6:50 HRS", "10:00 HRS", "12:00 HRS"]
+SEMANAS_HISTORICO_RODIZIO = 2
+
+def pesos_historico_rodizio(n_semanas: int) -> list:
+    # A semana imediatamente anterior pesa 10; as mais antigas pesam 1.
+    return [10] + [1] * (max(int(n_semanas), 1) - 1)
+
+@st.cache_data(ttl=300)
+def _contar_turnos_servidor(ids_semanas: tuple, versoes: tuple) -> pd.DataFrame:
+    # Agregado no banco: uma linha por (semana_id, nome, horario) com a quantidade de dias.
+    return pd.DataFrame(rpc_paginada('get_contagem_turnos', {'p_semana_ids': list(ids_semanas)}, ['semana_id', 'nome', 'horario']), columns=['semana_id', 'nome', 'horario', 'qtd'])
+
+def carregar_historico_rodizio(df_semanas_todas: pd.DataFrame, data_ini_atual: date, n_semanas: int = SEMANAS_HISTORICO_RODIZIO) -> pd.DataFrame:
+    # Contagem ponderada de cada turno do rodízio por pessoa (índice = nome, colunas = TURNOS_RODIZIO).
+    vazio = pd.DataFrame(columns=TURNOS_RODIZIO, dtype=int)
+    if df_semanas_todas.empty: return vazio
+    pesos = {(data_ini_atual - timedelta(days=7 * (i + 1))).strftime('%Y-%m-%d'): peso for i, peso in enumerate(pesos_historico_rodizio(n_semanas))}
+    semanas = df_semanas_todas[df_semanas_todas['data_inicio'].isin(pesos.keys())]
+    peso_por_id = {int(id_sem): pesos[ini] for id_sem, ini in zip(semanas['id'], semanas['data_inicio'])}
+    if not peso_por_id: return vazio
+    ids = tuple(sorted(peso_por_id))
+    contagem = None
+    if rpc_disponivel('get_contagem_turnos'):
+        try: contagem = _contar_turnos_servidor(ids, tuple(versao_cache(f"semana:{i}") for i in ids))
+        except Exception as e: lembrar_rpc_ausente('get_contagem_turnos', e)
+    if contagem is None:
+        df_hist = carregar_escalas_semanas(ids)
+        if df_hist.empty: return vazio
+        contagem = df_hist.groupby(['semana_id', 'nome', 'horario']).size().reset_index(name='qtd')
+    if contagem.empty: return vazio
+    contagem = contagem.assign(horario=contagem['horario'].replace({"9:30 HRS": "10:00 HRS"}))
+    contagem = contagem[contagem['horario'].isin(TURNOS_RODIZIO)]
+    contagem = contagem.assign(peso=contagem['qtd'].astype(int) * contagem['semana_id'].astype(int).map(peso_por_id))
+    return contagem.pivot_table(index='nome', columns='horario', values='peso', aggfunc='sum', fill_value=0).reindex(columns=TURNOS_RODIZIO, fill_value=0)
+
+def vagas_rodizio(n_total: int) -> np.ndarray:
+    # Cotas fixas na ordem de TURNOS_RODIZIO: 35% às 6:50, 45% às 12:00 e o restante às 10:00.
+    vagas_650 = int(n_total * 0.35); vagas_1200 = int(n_total * 0.45)
+    return np.array([vagas_650, n_total - vagas_650 - vagas_1200, vagas_1200])
+
+def custos_rodizio(historico: pd.DataFrame, semente: int) -> np.ndarray:
+    # Custo = repetição ponderada do turno no histórico. O ruído da semente só desempata: somado em todas
+    # as pessoas fica abaixo de 1, então nunca troca uma solução de custo inteiro menor por outra.
+    n = len(historico)
+    return historico.to_numpy(dtype=float) + np.random.default_rng(semente).random(historico.shape) / (n + 1)
+
+def resolver_rodizio(custos: np.ndarray, vagas: np.ndarray) -> np.ndarray:
+    # Problema de transporte (pessoas × turnos com cotas exatas), resolvido por cancelamento de ciclos negativos.
+    # Com poucos turnos, o grafo residual se resume aos turnos: a aresta a→b custa a menor variação de custo
+    # ao mover alguém de a para b. Sem ciclo negativo entre os turnos, a alocação é ótima.
+    n, k = custos.shape
+    turno = np.empty(n, dtype=int)
+    turno[np.argsort(np.argmin(custos, axis=1), kind='stable')] = np.repeat(np.arange(k), vagas)
+    ciclos = [c for r in range(2, k + 1) for c in itertools.permutations(range(k), r) if c[0] == min(c)]
+    linhas = np.arange(n)
+    for _ in range(n * k):
+        delta = custos - custos[linhas, turno][:, None]
+        melhor = np.full((k, k), np.inf); quem = np.full((k, k), -1)
+        for a in range(k):
+            membros = np.flatnonzero(turno == a)
+            if membros.size == 0: continue
+            for b in range(k):
+                if a == b: continue
+                j = membros[np.argmin(delta[membros, b])]
+                melhor[a, b] = delta[j, b]; quem[a, b] = j
+        custo_ciclos = [sum(melhor[c[i], c[(i + 1) % len(c)]] for i in range(len(c))) for c in ciclos]
+        pior = int(np.argmin(custo_ciclos))
+        if custo_ciclos[pior] >= -1e-9: break
+        ciclo = ciclos[pior]
+        movimentos = [(quem[ciclo[i], ciclo[(i + 1) % len(ciclo)]], ciclo[(i + 1) % len(ciclo)]) for i in range(len(ciclo))]
+        for pessoa, destino in movimentos: turno[pessoa] = destino
+    return turno
+
+def _historico_ativos(df_colabs_op, data_ini_atual, df_semanas_todas, n_semanas_historico) -> pd.DataFrame:
     df_ativos = df_colabs_op[~df_colabs_op['status'].isin(['Ferias', 'Afastado(a)', 'Atestado'])]
-    n_total = len(df_ativos)
-    if n_total == 0: return {}
-    vagas_650 = int(n_total * 0.35)
-    vagas_1200 = int(n_total * 0.45)
-    vagas_1000 = n_total - vagas_650 - vagas_1200 
-    vagas_disponiveis = {"6:50 HRS": vagas_650, "10:00 HRS": vagas_1000, "12:00 HRS": vagas_1200}
-    
-    data_menos_7 = (data_ini_atual - timedelta(days=7)).strftime('%Y-%m-%d')
-    data_menos_14 = (data_ini_atual - timedelta(days=14)).strftime('%Y-%m-%d')
-    semanas_passadas = df_semanas_todas[df_semanas_todas['data_inicio'].isin([data_menos_7, data_menos_14])]
-    historico_colabs = {row['nome']: {"6:50 HRS": 0, "10:00 HRS": 0, "12:00 HRS": 0} for _, row in df_ativos.iterrows()}
-    
-    for _, row_sem in semanas_passadas.iterrows():
-        id_sem = int(row_sem['id'])
-        data_ini_sem = row_sem['data_inicio']
-        peso = 10 if data_ini_sem == data_menos_7 else 1
-        df_escala = carregar_escala_semana_por_id(id_sem)
-        if not df_escala.empty:
-            for _, row in df_escala.iterrows():
-                nome = row['nome']; h = row['horario']
-                if h == "9:30 HRS": h = "10:00 HRS"
-                if nome in historico_colabs and h in historico_colabs[nome]:
-                    historico_colabs[nome][h] += peso
-                    
+    nomes_ativos = df_ativos['nome'].drop_duplicates()
+    historico = carregar_historico_rodizio(df_semanas_todas, data_ini_atual, n_semanas_historico)
+    return historico.reindex(index=nomes_ativos, columns=TURNOS_RODIZIO, fill_value=0).astype(int)
+
+def gerar_alocacao_semanal(df_colabs_op, data_ini_atual, df_semanas_todas, n_semanas_historico: int = SEMANAS_HISTORICO_RODIZIO, semente: int = None):
+    # Determinístico: a mesma semana (ou semente) sempre gera o mesmo rodízio.
+    historico = _historico_ativos(df_colabs_op, data_ini_atual, df_semanas_todas, n_semanas_historico)
+    if historico.empty: return {}
+    semente = data_ini_atual.toordinal() if semente is None else semente
+    with cronometro("Rodízio: otimizado"): turnos = resolver_rodizio(custos_rodizio(historico, semente), vagas_rodizio(len(historico)))
+    return {nome: TURNOS_RODIZIO[t] for nome, t in zip(historico.index, turnos)}
+
+def _alocacao_gulosa(historico: pd.DataFrame, semente: int) -> dict:
+    # Método anterior (passada gulosa sobre nomes embaralhados), mantido só para a comparação na Escala Mágica.
+    vagas_disponiveis = dict(zip(TURNOS_RODIZIO, vagas_rodizio(len(historico)).tolist()))
+    historico_colabs = historico.to_dict('index')
+    nomes = list(historico_colabs.keys()); random.Random(semente).shuffle(nomes)
+    prefs = {nome: sorted(TURNOS_RODIZIO, key=lambda t: historico_colabs[nome][t]) for nome in nomes}
+    nomes.sort(key=lambda n: historico_colabs[n][prefs[n][1]] - historico_colabs[n][prefs[n][0]], reverse=True)
     alocacao = {}
-    nomes_embaralhados = list(historico_colabs.keys())
-    random.shuffle(nomes_embaralhados) 
-    prefs = {}
-    for nome in nomes_embaralhados:
-        prefs[nome] = sorted(["6:50 HRS", "10:00 HRS", "12:00 HRS"], key=lambda t: historico_colabs[nome][t])
-    nomes_embaralhados.sort(key=lambda n: historico_colabs[n][prefs[n][1]] - historico_colabs[n][prefs[n][0]], reverse=True)
-    
-    for nome in nomes_embaralhados:
-        alocado = False
-        for t in prefs[nome]:
-            if vagas_disponiveis[t] > 0:
-                alocacao[nome] = t; vagas_disponiveis[t] -= 1; alocado = True; break
-        if not alocado:
-            for t in vagas_disponiveis.keys():
-                if vagas_disponiveis[t] > 0:
-                    alocacao[nome] = t; vagas_disponiveis[t] -= 1; break
+    for nome in nomes:
+        livre = [t for t in prefs[nome] if vagas_disponiveis[t] > 0] or [t for t in TURNOS_RODIZIO if vagas_disponiveis[t] > 0]
+        alocacao[nome] = livre[0]; vagas_disponiveis[livre[0]] -= 1
     return alocacao
 
+def metricas_rodizio(alocacao: dict, historico: pd.DataFrame) -> dict:
+    # Repetição que cada pessoa carrega no turno recebido (0 = turno que não fez no histórico).
+    peso = np.array([historico.at[nome, turno] for nome, turno in alocacao.items()]) if alocacao else np.zeros(1)
+    return {
+        'Repetição total (ponderada)': int(peso.sum()),
+        'Repetem turno da semana anterior': int((peso >= pesos_historico_rodizio(1)[0]).sum()),
+        'Pior caso individual': int(peso.max()),
+        'Desvio entre pessoas': round(float(peso.std()), 2),
+    }
+
+def comparar_rodizio(df_colabs_op, data_ini_atual, df_semanas_todas, n_semanas_historico: int = SEMANAS_HISTORICO_RODIZIO) -> pd.DataFrame:
+    historico = _historico_ativos(df_colabs_op, data_ini_atual, df_semanas_todas, n_semanas_historico)
+    if historico.empty: return pd.DataFrame()
+    semente = data_ini_atual.toordinal()
+    t0 = time.perf_counter(); gulosa = _alocacao_gulosa(historico, semente)
+    t1 = time.perf_counter(); otima = {nome: TURNOS_RODIZIO[t] for nome, t in zip(historico.index, resolver_rodizio(custos_rodizio(historico, semente), vagas_rodizio(len(historico))))}
+    t2 = time.perf_counter()
+    registrar_tempo("Rodízio: guloso (comparação)", (t1 - t0) * 1000); registrar_tempo("Rodízio: otimizado", (t2 - t1) * 1000)
+    linhas = [{'Método': 'Guloso (anterior)', **metricas_rodizio(gulosa, historico), 'Tempo (ms)': round((t1 - t0) * 1000, 2)},
+              {'Método': 'Otimizado (atual)', **metricas_rodizio(otima, historico), 'Tempo (ms)': round((t2 - t1) * 1000, 2)}]
+    return pd.DataFrame(linhas)
+
 # --- FUNÇÕES DE LÓGICA DA ESCALA MÁGICA (ETAPA 2) ---
-def trabalhou_na_data(nome, data_alvo, df_semanas_todas):
-    for _, w in df_semanas_todas.iterrows():
-        try:
-            d_ini = pd.to_datetime(w['data_inicio']).date()
-            d_fim = d_ini + timedelta(days=6)
-            if d_ini <= data_alvo <= d_fim:
-                df_esc = carregar_escala_semana_por_id(int(w['id']))
-                if not df_esc.empty:
-                    df_esc['data_date'] = pd.to_datetime(df_esc['data']).dt.date
-                    row = df_esc[(df_esc['nome'] == nome) & (df_esc['data_date'] == data_alvo)]
-                    if not row.empty:
-                        h = str(row.iloc[0]['horario'])
-                        if h and "HRS" in h: return True
-        except: pass
-    return False
-
-def atribuir_caixas_dia(dia_items, historico_semana_cx):
-    alocacao = {}
-    abertura = []
-    fechamento = []
-    intermediario = []
-    
-    for nome, h in dia_items:
-        if not isinstance(h, str) or "Folga" in h or "Feria" in h or "Afast" in h or "Atest" in h or h.strip() == "" or h.strip() == "nan":
-            alocacao[nome] = "---"
-            continue
-            
-        if h in ["9:30 HRS", "10:00 HRS", "10:30 HRS"]:
-            intermediario.append(nome)
-        elif calcular_minutos(h) <= 540: 
-            abertura.append(nome)
-        else: 
-            fechamento.append(nome)
-            
-    caixas_prioridade = ['Self', '17', '16', '15', '5', '1']
-    caixas_pares = ['14', '12', '10', '8', '6', '4', '2']
-    caixas_impares = ['13', '11', '9', '7', '3']
-    
-    def escolher_caixa_sem_repetir(nome, lista_disp):
-        # Filtra os caixas que a pessoa AINDA NÃO usou nesta semana
-        opcoes_nao_usadas = [cx for cx in lista_disp if cx not in historico_semana_cx.get(nome, set())]
-        
-        if opcoes_nao_usadas:
-            cx_escolhido = opcoes_nao_usadas[0] # Pega o primeiro disponível que ela não usou
-            lista_disp.remove(cx_escolhido)
-            return cx_escolhido
-        elif lista_disp:
-            # Se ela já usou todos os caixas possíveis (muito raro), repete o que tiver livre
-            cx_escolhido = lista_disp.pop(0)
-            return cx_escolhido
-        return ""
-    
-    random.shuffle(caixas_prioridade)
-    random.shuffle(caixas_pares)
-    random.shuffle(caixas_impares)
-    
-    disp_pares = list(caixas_pares)
-    random.shuffle(intermediario)
-    for nome in intermediario:
-        cx = escolher_caixa_sem_repetir(nome, disp_pares)
-        alocacao[nome] = cx
-        if cx: historico_semana_cx.setdefault(nome, set()).add(cx)
-        
-    disp_pri_m = list(caixas_prioridade)
-    disp_imp_m = list(caixas_impares)
-    random.shuffle(abertura)
-    for nome in abertura:
-        cx = escolher_caixa_sem_repetir(nome, disp_pri_m)
-        if not cx: cx = escolher_caixa_sem_repetir(nome, disp_imp_m)
-        alocacao[nome] = cx
-        if cx: historico_semana_cx.setdefault(nome, set()).add(cx)
-        
-    disp_pri_t = list(caixas_prioridade) 
-    disp_imp_t = list(caixas_impares)
-    random.shuffle(fechamento)
-    for nome in fechamento:
-        cx = escolher_caixa_sem_repetir(nome, disp_pri_t)
-        if not cx: cx = escolher_caixa_sem_repetir(nome, disp_imp_t)
-        alocacao[nome] = cx
-        if cx: historico_semana_cx.setdefault(nome, set()).add(cx)
-        
-    return alocacao
+def montar_indice_presenca(df_semanas_todas: pd.DataFrame, datas_alvo: list) -> set:
+    # Conjunto de (nome, data) em que a pessoa trabalhou, restrito às datas pedidas e carregado de uma vez.
+    datas_alvo = set(datas_alvo)
+    if df_semanas_todas.empty or not datas_alvo: return set()
+    inicios = pd.to_datetime(df_semanas_todas['data_inicio'], errors='coerce').dt.date
+    ids = [int(id_sem) for id_sem, ini in zip(df_semanas_todas['id'], inicios) if pd.notna(ini) and any(ini <= d <= ini + timedelta(days=6) for d in datas_alvo)]
+    df = carregar_escalas_semanas(ids)
+    if df.empty: return set()
+    datas = pd.to_datetime(df['data'], errors='coerce').dt.date
+    mask = df['horario'].fillna('').astype(str).str.contains('HRS', regex=False) & datas.isin(datas_alvo)
+    return set(zip(df.loc[mask, 'nome'], datas[mask]))
+
+def trabalhou_na_data(nome, data_alvo, indice_presenca: set) -> bool:
+    return (nome, data_alvo) in indice_presenca
+
+CAIXAS_PRIORIDADE = ['Self', '17', '16', '15', '5', '1']
+CAIXAS_PARES = ['14', '12', '10', '8', '6', '4', '2']
+CAIXAS_IMPARES = ['13', '11', '9', '7', '3']
+HORARIOS_INTERMEDIARIOS = ["9:30 HRS", "10:00 HRS", "10:30 HRS"]
+CAIXAS_POR_GRUPO = {'intermediario': CAIXAS_PARES, 'abertura': CAIXAS_PRIORIDADE + CAIXAS_IMPARES, 'fechamento': CAIXAS_PRIORIDADE + CAIXAS_IMPARES}
+NOMES_GRUPO_CAIXA = {'intermediario': "intermediário", 'abertura': "manhã", 'fechamento': "tarde"}
+PESO_CAIXA_NAO_PRIORITARIO = 100  # cobrir um prioritário vale mais que qualquer repetição na semana (no máximo 6)
+MAXIMO_RODADAS_CAIXAS = 50  # só segurança: cada rodada que muda algo reduz as repetições da semana
+
+def grupo_caixa(horario):
+    # None = não trabalha no dia (recebe "---"); senão o grupo que define de quais caixas a pessoa pode sair.
+    turno = obter_turno(horario)
+    if not turno.trabalha: return None
+    if horario in HORARIOS_INTERMEDIARIOS: return 'intermediario'
+    return 'abertura' if turno.minutos <= 540 else 'fechamento'
+
+def _atribuicao_minima(custos: np.ndarray) -> np.ndarray:
+    # Algoritmo húngaro O(n²·m): coluna escolhida para cada linha, -1 quando sobram linhas sem coluna.
+    n, m = custos.shape
+    if n > m:
+        linha_por_coluna = _atribuicao_minima(custos.T)
+        resultado = np.full(n, -1); resultado[linha_por_coluna] = np.arange(m)
+        return resultado
+    u = np.zeros(n + 1); v = np.zeros(m + 1); p = np.zeros(m + 1, dtype=int); caminho = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i; j0 = 0
+        minv = np.full(m + 1, np.inf); usado = np.zeros(m + 1, dtype=bool)
+        while True:
+            usado[j0] = True; i0 = p[j0]
+            livres = np.flatnonzero(~usado)
+            reduzido = custos[i0 - 1, livres - 1] - u[i0] - v[livres]
+            melhora = reduzido < minv[livres]
+            minv[livres[melhora]] = reduzido[melhora]; caminho[livres[melhora]] = j0
+            j1 = livres[np.argmin(minv[livres])]; delta = minv[j1]
+            u[p[usado]] += delta; v[usado] -= delta; minv[~usado] -= delta
+            j0 = j1
+            if p[j0] == 0: break
+        while j0:
+            j1 = caminho[j0]; p[j0] = p[j1]; j0 = j1
+    resultado = np.full(n, -1)
+    resultado[p[1:][p[1:] > 0] - 1] = np.flatnonzero(p[1:] > 0)
+    return resultado
+
+def atribuir_caixas_semana(horarios: dict, travados: dict = None, semente: int = 0):
+    # horarios: {(nome, data): horario}; travados: {(nome, data): caixa} definidos à mão, que são mantidos.
+    # Cada (dia, grupo) é uma atribuição ótima pessoas × caixas livres. Os dias são re-resolvidos contra o resto da
+    # semana até nenhum mudar; como cada troca reduz as repetições da semana, isso termina, mas num ótimo local
+    # (não há garantia do melhor global). Devolve ({(nome, data): caixa}, [pendências], [(nome, data, caixa) travados]).
+    travados = {k: str(v).strip() for k, v in (travados or {}).items() if str(v).strip() not in ("", "---", "nan")}
+    rng = np.random.default_rng(semente)
+    alocacao, grupo_de, livres, ocupados, pendencias, mantidos = {}, {}, {}, {}, [], []
+    for (nome, dt), h in horarios.items():
+        grupo = grupo_caixa(h)
+        if grupo is None: alocacao[(nome, dt)] = "---"; continue
+        grupo_de[(nome, dt)] = grupo
+        if (nome, dt) in travados:
+            cx = travados[(nome, dt)]; alocacao[(nome, dt)] = cx; mantidos.append((nome, dt, cx))
+            if cx in ocupados.setdefault((dt, grupo), set()): pendencias.append(f"{dt.strftime('%d/%m')} ({NOMES_GRUPO_CAIXA[grupo]}): caixa {cx} travado para mais de uma pessoa.")
+            ocupados[(dt, grupo)].add(cx)
+        else: livres.setdefault((dt, grupo), []).append(nome)
+
+    ordem = sorted(livres)
+    caixas = {chave: [cx for cx in CAIXAS_POR_GRUPO[chave[1]] if cx not in ocupados.get(chave, set())] for chave in ordem}
+    # Desempate aleatório (mas reprodutível) limitado para nunca superar uma unidade de custo no dia
+    ruido = {chave: rng.random((len(livres[chave]), len(caixas[chave]))) / (len(livres[chave]) + 1) for chave in ordem}
+    uso = {}
+    for (nome, _), cx in alocacao.items():
+        if cx != "---": uso[(nome, cx)] = uso.get((nome, cx), 0) + 1
+
+    convergiu = False
+    for _ in range(MAXIMO_RODADAS_CAIXAS):
+        mudou = False
+        for chave in ordem:
+            dt = chave[0]; nomes = livres[chave]; pool = caixas[chave]
+            atual = [alocacao.get((nome, dt), "") for nome in nomes]
+            for nome, cx in zip(nomes, atual):
+                if cx: uso[(nome, cx)] -= 1
+            custos = np.array([[uso.get((nome, cx), 0) + (0 if cx in CAIXAS_PRIORIDADE else PESO_CAIXA_NAO_PRIORITARIO) for cx in pool] for nome in nomes], dtype=float).reshape(len(nomes), len(pool)) + ruido[chave]
+            novo = [pool[j] if j >= 0 else "" for j in _atribuicao_minima(custos)]
+            for nome, cx in zip(nomes, novo):
+                alocacao[(nome, dt)] = cx
+                if cx: uso[(nome, cx)] = uso.get((nome, cx), 0) + 1
+            mudou |= novo != atual
+        if not mudou: convergiu = True; break
+    if not convergiu: pendencias.append(f"A distribuição não estabilizou em {MAXIMO_RODADAS_CAIXAS} rodadas: pode haver repetições evitáveis.")
+
+    cobertos = {}
+    for chave, grupo in sorted(grupo_de.items(), key=lambda item: (item[0][1], item[0][0])):
+        cobertos.setdefault((chave[1], grupo), set()).add(alocacao[chave])
+        if alocacao[chave] == "": pendencias.append(f"{chave[1].strftime('%d/%m')} ({NOMES_GRUPO_CAIXA[grupo]}): {chave[0]} ficou sem caixa, todos os do turno já estavam ocupados.")
+    for (dt, grupo), usados in sorted(cobertos.items()):
+        faltando = [cx for cx in CAIXAS_PRIORIDADE if cx not in usados]
+        if grupo != 'intermediario' and faltando: pendencias.append(f"{dt.strftime('%d/%m')} ({NOMES_GRUPO_CAIXA[grupo]}): caixas prioritários sem operador: {', '.join(faltando)}.")
+    for (nome, cx), n in sorted(uso.items()):
+        if n > 1: pendencias.append(f"{nome} repete o caixa {cx} {n}x na semana.")
+    return alocacao, pendencias, sorted(mantidos, key=lambda m: (m[1], m[0]))
 
 
 # --- FUNÇÕES DE IMPRESSÃO E LAYOUT ---
@@ -429,158 +1234,137 @@ def gerar_html_escala_semanal(df_escala: pd.DataFrame, nome_colaborador: str, se
     </html>
     """
 
-def gerar_html_layout_exato(df_ops_dia, df_emp_dia, data_str, dia_semana, cor_tema):
-    lista_op_folga = []
-    lista_emp_folga = []
-    status_invisivel = ["Ferias", "Afastado(a)", "Atestado", "", None]
-    c_op_manha = 0; c_self_manha = 0; c_op_tarde = 0; c_self_tarde = 0; c_emp_manha = 0; c_emp_tarde = 0
-    flat_ops_data = []; flat_emp_data = []
-
-    def sort_key_caixa(row):
-        cx = str(row.get('numero_caixa', '')).strip().upper()
-        cx = cx.replace('.0', '')
-        if not cx or cx == 'NAN': return -999 
-        if cx == 'SELF': return 1000
-        if cx.isdigit(): return int(cx)
-        return -50 
-    
-    if not df_ops_dia.empty: df_ops_dia['rank_cx'] = df_ops_dia.apply(sort_key_caixa, axis=1)
-    else: df_ops_dia['rank_cx'] = []
-        
-    df_ops_sorted = df_ops_dia.sort_values(by='rank_cx', ascending=False) if not df_ops_dia.empty else df_ops_dia
-
-    for _, row in df_ops_sorted.iterrows():
-        horario = str(row['horario'])
-        if 'nome_impressao' in row and pd.notna(row['nome_impressao']) and str(row['nome_impressao']).strip() != "": nome = str(row['nome_impressao']).upper()
-        elif 'nome_social' in row and pd.notna(row['nome_social']) and str(row['nome_social']).strip() != "": nome = str(row['nome_social']).upper()
-        else: nome = str(row['nome']).upper()
-            
-        cx = str(row.get('numero_caixa', '')).replace('.0', '')
-        if horario in status_invisivel or horario == "nan": continue
-        if "Folga" in horario:
-            lista_op_folga.append(nome); continue
-            
-        mins = calcular_minutos(horario)
-        is_self = (cx == "Self")
-        cx_upper = cx.upper()
-        is_excluded_count = (cx_upper in ["RECEPÇÃO", "DELIVERY", "MAGAZINE", "SALINHA"])
-
-        if mins == 450: 
-            if is_self: c_self_manha += 1
-            elif not is_excluded_count: c_op_manha += 1
-            if is_self: c_self_tarde += 1
-            elif not is_excluded_count: c_op_tarde += 1
-        else:
-            if mins <= 630: 
-                if is_self: c_self_manha += 1
-                elif not is_excluded_count: c_op_manha += 1
-            if mins >= 570: 
-                if is_self: c_self_tarde += 1
-                elif not is_excluded_count: c_op_tarde += 1
-
-        h_clean = horario.replace(" HRS", "H").replace(":", ":")
-        flat_ops_data.append({ 'cx': cx, 'nome': nome, 'h_clean': h_clean, 'mins': mins, 'rank': row.get('rank_cx', -999), 'has_separator': False })
-
-    df_emp_sorted = df_emp_dia.sort_values(by='nome')
-    for _, row in df_emp_sorted.iterrows():
-        horario = str(row['horario'])
-        if 'nome_impressao' in row and pd.notna(row['nome_impressao']) and str(row['nome_impressao']).strip() != "": nome = str(row['nome_impressao']).upper()
-        elif 'nome_social' in row and pd.notna(row['nome_social']) and str(row['nome_social']).strip() != "": nome = str(row['nome_social']).upper()
-        else: nome = str(row['nome']).upper()
-
-        tarefa = str(row.get('numero_caixa', '')).replace('.0', '').strip()
-        if tarefa == 'nan': tarefa = ""
-
-        if horario in status_invisivel or horario == "nan": continue
-        if "Folga" in horario:
-            lista_emp_folga.append(nome); continue
-            
-        mins = calcular_minutos(horario)
-        if mins <= 630: c_emp_manha += 1
-        if mins >= 570: c_emp_tarde += 1
-        
-        h_clean = horario.replace(" HRS", "H").replace(":", ":")
-        nome_display = nome
-        if tarefa and tarefa != "nan" and tarefa != "": nome_display = f"{nome} <span style='font-size:0.85em'>({tarefa})</span>"
-            
-        flat_emp_data.append({ 'nome': nome_display, 'h_clean': h_clean, 'mins': mins, 'has_separator': False })
-
-    flat_ops_data.sort(key=lambda x: (x['mins'], -x['rank']))
-    flat_emp_data.sort(key=lambda x: (x['mins'], x['nome']))
-
-    for i in range(len(flat_ops_data) - 1):
-        if flat_ops_data[i]['h_clean'] != flat_ops_data[i+1]['h_clean']: flat_ops_data[i]['has_separator'] = True
-    for i in range(len(flat_emp_data) - 1):
-        if flat_emp_data[i]['h_clean'] != flat_emp_data[i+1]['h_clean']: flat_emp_data[i]['has_separator'] = True
-
-    final_emp_list = []
-    for emp in flat_emp_data:
-        final_emp_list.append(emp)
-        if emp.get('has_separator'): final_emp_list.append(None) 
-            
-    rows_html = ""
-    for op, emp in zip_longest(flat_ops_data, final_emp_list, fillvalue=None):
-        op_html = ""
-        op_class_extra = " separator-bottom" if (op and op['has_separator']) else ""
-        if op: op_html = f"<td class='cx-col{op_class_extra}'>{op['cx']}</td><td class='nome-col{op_class_extra}'>{op['nome']}</td><td class='horario-col{op_class_extra}'>{op['h_clean']}</td>"
-        else: op_html = "<td class='cx-col'></td><td class='nome-col'></td><td class='horario-col'></td>"
-        
-        emp_html = ""
-        emp_class_extra = " separator-bottom" if (emp and emp.get('has_separator')) else ""
-        if emp: emp_html = f"<td class='col-emp-nome border-left{emp_class_extra}'>{emp['nome']}</td><td class='horario-col{emp_class_extra}'>{emp['h_clean']}</td>"
-        else: emp_html = "<td class='col-emp-nome border-left'></td><td class='horario-col'></td>"
-            
-        rows_html += f"<tr>{op_html}<td class='divider-col'></td>{emp_html}</tr>"
-
-    str_folga_op = formatar_lista_folgas_multilinha(lista_op_folga, step=2)
-    str_folga_emp = formatar_lista_folgas_multilinha(lista_emp_folga, step=2)
+STATUS_INVISIVEIS_IMPRESSAO = ["Ferias", "Afastado(a)", "Atestado", "", "nan", "None"]
+CAIXAS_FORA_DA_CONTAGEM = ["RECEPÇÃO", "DELIVERY", "MAGAZINE", "SALINHA"]
+CELULAS_OP_VAZIAS = "<td class='cx-col'></td><td class='nome-col'></td><td class='horario-col'></td>"
+CELULAS_EMP_VAZIAS = "<td class='col-emp-nome border-left'></td><td class='horario-col'></td>"
+
+def _valores_texto(df: pd.DataFrame, coluna: str) -> list:
+    # Célula vazia (None/NaN) vira "", não o texto "nan"/"None".
+    if coluna not in df.columns: return [""] * len(df)
+    return ["" if pd.isna(v) else str(v) for v in df[coluna].tolist()]
+
+def _nomes_impressao(df: pd.DataFrame) -> list:
+    # Prioridade: nome editado para impressão > nome social > nome original.
+    nomes = _valores_texto(df, 'nome')
+    for coluna in ['nome_social', 'nome_impressao']:
+        if coluna in df.columns:
+            nomes = [n if pd.isna(v) or str(v).strip() == "" else str(v) for v, n in zip(df[coluna].tolist(), nomes)]
+    return [n.upper() for n in nomes]
+
+def _rank_caixa(caixa: str) -> int:
+    # Ordem na folha: SELF no topo, depois o caixa de número maior; sem caixa vai para o fim.
+    cx = caixa.strip().upper().replace('.0', '')
+    if cx in ('', 'NAN'): return -999
+    if cx == 'SELF': return 1000
+    return int(cx) if cx.isdigit() else -50
+
+def _com_separadores(linhas: list) -> list:
+    # Acrescenta a cada linha se o horário (último campo) muda na linha seguinte.
+    return [linha + (i + 1 < len(linhas) and linha[-1] != linhas[i + 1][-1],) for i, linha in enumerate(linhas)]
+
+def montar_dados_layout_exato(df_ops_dia: pd.DataFrame, df_emp_dia: pd.DataFrame) -> dict:
+    # Uma passada por pessoa sobre listas simples e uma ordenação por lado: um dia da loja tem poucas
+    # dezenas de linhas, tamanho em que operações de DataFrame custam mais do que o próprio trabalho.
+    # --- Operadores: por horário e, no mesmo horário, SELF e caixas maiores primeiro ---
+    ops, folgas_op = [], []
+    c = dict.fromkeys(['op_manha', 'self_manha', 'op_tarde', 'self_tarde'], 0)
+    for caixa, nome, horario in zip(_valores_texto(df_ops_dia, 'numero_caixa'), _nomes_impressao(df_ops_dia), _valores_texto(df_ops_dia, 'horario')):
+        if horario in STATUS_INVISIVEIS_IMPRESSAO: continue
+        if 'Folga' in horario: folgas_op.append(nome); continue
+        mins = obter_turno(horario).minutos
+        cx = caixa.replace('.0', '')
+        tipo = 'self' if cx == "Self" else None if cx.upper() in CAIXAS_FORA_DA_CONTAGEM else 'op'
+        if tipo and mins <= 630: c[f'{tipo}_manha'] += 1
+        if tipo and (mins >= 570 or mins == 450): c[f'{tipo}_tarde'] += 1
+        ops.append((mins, -_rank_caixa(caixa), cx, nome, horario.replace(" HRS", "H")))
+    ops.sort(key=lambda linha: linha[:2])
+    ops = _com_separadores([linha[2:] for linha in ops])
+
+    # --- Empacotadores: por horário e depois por nome ---
+    emp, folgas_emp = [], []
+    c_emp_manha = c_emp_tarde = 0
+    for tarefa, nome, horario in zip(_valores_texto(df_emp_dia, 'numero_caixa'), _nomes_impressao(df_emp_dia), _valores_texto(df_emp_dia, 'horario')):
+        if horario in STATUS_INVISIVEIS_IMPRESSAO: continue
+        if 'Folga' in horario: folgas_emp.append(nome); continue
+        mins = obter_turno(horario).minutos
+        c_emp_manha += mins <= 630; c_emp_tarde += mins >= 570
+        tarefa = tarefa.replace('.0', '').strip()
+        if tarefa and tarefa != 'nan': nome = f"{nome} <span style='font-size:0.85em'>({tarefa})</span>"
+        emp.append((mins, nome, horario.replace(" HRS", "H")))
+    emp.sort(key=lambda linha: linha[:2])
+    emp = _com_separadores([linha[1:] for linha in emp])
+
+    return {
+        'ops': ops, 'emp': emp, 'folgas_op': folgas_op, 'folgas_emp': folgas_emp,
+        'c_op_manha': c['op_manha'], 'c_self_manha': c['self_manha'], 'c_op_tarde': c['op_tarde'], 'c_self_tarde': c['self_tarde'],
+        'c_emp_manha': c_emp_manha, 'c_emp_tarde': c_emp_tarde,
+    }
+
+def _linhas_html_layout_exato(ops: list, emp: list) -> str:
+    # ops: (caixa, nome, horário, separador); emp: (nome, horário, separador)
+    celulas_op = []
+    for cx, nome, h_clean, separador in ops:
+        sep = " separator-bottom" if separador else ""
+        celulas_op.append(f"<td class='cx-col{sep}'>{cx}</td><td class='nome-col{sep}'>{nome}</td><td class='horario-col{sep}'>{h_clean}</td>")
+    # Cada troca de horário dos empacotadores ganha uma linha em branco logo abaixo.
+    celulas_emp = []
+    for nome, h_clean, separador in emp:
+        sep = " separator-bottom" if separador else ""
+        celulas_emp.append(f"<td class='col-emp-nome border-left{sep}'>{nome}</td><td class='horario-col{sep}'>{h_clean}</td>")
+        if separador: celulas_emp.append(None)
+    return "".join(
+        f"<tr>{op or CELULAS_OP_VAZIAS}<td class='divider-col'></td>{emp_html or CELULAS_EMP_VAZIAS}</tr>"
+        for op, emp_html in zip_longest(celulas_op, celulas_emp, fillvalue=None)
+    )
 
+CSS_LAYOUT_EXATO = """
+            @import url('https://fonts.googleapis.com/css2?family=Roboto+Condensed:wght@700&display=swap');
+            @page { size: portrait; margin: 5mm; }
+            body { font-family: 'Roboto Condensed', 'Arial Narrow', Arial, sans-serif; color: #000; margin: 0; padding: 10px; background: white; font-size: 16px; width: 90%; margin-left: auto; margin-right: auto; zoom: 90%; }
+            .print-frame { border: 4px solid var(--cor-tema); padding: 15px; width: 100%; box-sizing: border-box; }
+            .header-main { text-align: center; border-bottom: 3px solid var(--cor-tema); padding-bottom: 5px; margin-bottom: 3px; }
+            .header-dia { font-size: 42px; font-weight: 900; text-transform: uppercase; line-height: 0.9; margin-bottom: 2px; }
+            .header-data { font-size: 28px; font-weight: bold; line-height: 1; color: #000; }
+            table { width: 100%; border-collapse: collapse; border: 2px solid var(--cor-tema); margin-bottom: 2px; table-layout: fixed; }
+            thead th { background-color: var(--cor-tema) !important; color: #fff !important; padding: 6px; text-transform: uppercase; border: 1px solid var(--cor-tema); font-size: 19px; text-align: center; -webkit-print-color-adjust: exact; }
+            td { padding: 4px; border: 1px solid var(--cor-tema); height: 28px; vertical-align: middle; white-space: nowrap; overflow: hidden; text-align: center; }
+            .separator-bottom { border-bottom: 4px solid #000 !important; }
+            .cx-col { width: 8%; font-weight: bold; font-size: 20px; } 
+            .col-op-nome { width: 31.5%; font-weight: bold; font-size: 18px; } 
+            .horario-col { width: 10%; font-weight: bold; font-size: 18px; } 
+            .divider-col { width: 1%; background-color: var(--cor-tema) !important; padding: 0; border: none; -webkit-print-color-adjust: exact; }
+            .col-emp-nome { width: 39.5%; font-weight: bold; font-size: 18px; } 
+            .nome-col { font-weight: bold; text-transform: uppercase; letter-spacing: -0.5px; }
+            .border-left { border-left: 3px solid var(--cor-tema); }
+            tr:nth-child(even) { background-color: #d9d9d9 !important; -webkit-print-color-adjust: exact; }
+            .footer-container { display: flex; border: 2px solid var(--cor-tema); border-top: none; }
+            .footer-box { width: 50%; }
+            .footer-header { background: var(--cor-tema) !important; color: #fff !important; text-align: center; font-weight: bold; font-size: 14px; padding: 4px; -webkit-print-color-adjust: exact; }
+            .footer-content { background: #eee !important; font-size: 14px; padding: 6px; text-align: center; min-height: 40px; text-transform: uppercase; -webkit-print-color-adjust: exact; line-height: 1.2; white-space: normal; }
+            .totals-container { display: flex; border: 2px solid var(--cor-tema); border-top: none; background: var(--cor-tema) !important; color: #fff !important; -webkit-print-color-adjust: exact; }
+            .totals-box { width: 50%; font-size: 12px; font-weight: bold; padding: 6px; text-align: center; line-height: 1.3; }
+            .page-break { page-break-after: always; break-after: page; height: 0; }
+            @media print {
+                body { padding: 0; margin: 0 auto; width: 90%; zoom: 90%; }
+                thead th, .footer-header, .totals-container { background-color: var(--cor-tema) !important; color: #fff !important; }
+                tr:nth-child(even), .footer-content { background-color: #ccc !important; }
+                .separator-bottom { border-bottom: 4px solid #000 !important; }
+            }
+"""
+
+def _pagina_layout_exato(dados: dict, data_str: str, dia_semana: str, cor_tema: str) -> str:
+    rows_html = _linhas_html_layout_exato(dados['ops'], dados['emp'])
+    str_folga_op = formatar_lista_folgas_multilinha(dados['folgas_op'], step=2)
+    str_folga_emp = formatar_lista_folgas_multilinha(dados['folgas_emp'], step=2)
+
+    c_op_manha, c_self_manha, c_op_tarde, c_self_tarde = dados['c_op_manha'], dados['c_self_manha'], dados['c_op_tarde'], dados['c_self_tarde']
     tot_op_m = c_op_manha + c_self_manha; tot_op_t = c_op_tarde + c_self_tarde
     resumo_op = f"MANHÃ: {c_op_manha:02d} OP + {c_self_manha} SELF = {tot_op_m:02d} OPERADORES<br>TARDE: {c_op_tarde:02d} OP + {c_self_tarde} SELF = {tot_op_t:02d} OPERADORES"
-    resumo_emp = f"MANHÃ: {c_emp_manha:02d} EMPACOTADORES<br>TARDE: {c_emp_tarde:02d} EMPACOTADORES"
+    resumo_emp = f"MANHÃ: {dados['c_emp_manha']:02d} EMPACOTADORES<br>TARDE: {dados['c_emp_tarde']:02d} EMPACOTADORES"
 
     return f"""
-    <!DOCTYPE html>
-    <html lang="pt-BR">
-    <head>
-        <meta charset="UTF-8">
-        <title>Escala {dia_semana}</title>
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=Roboto+Condensed:wght@700&display=swap');
-            @page {{ size: portrait; margin: 5mm; }}
-            body {{ font-family: 'Roboto Condensed', 'Arial Narrow', Arial, sans-serif; color: #000; margin: 0; padding: 10px; background: white; font-size: 16px; width: 90%; margin-left: auto; margin-right: auto; zoom: 90%; }}
-            .print-frame {{ border: 4px solid {cor_tema}; padding: 15px; width: 100%; box-sizing: border-box; }}
-            .header-main {{ text-align: center; border-bottom: 3px solid {cor_tema}; padding-bottom: 5px; margin-bottom: 3px; }}
-            .header-dia {{ font-size: 42px; font-weight: 900; text-transform: uppercase; line-height: 0.9; margin-bottom: 2px; }}
-            .header-data {{ font-size: 28px; font-weight: bold; line-height: 1; color: #000; }}
-            table {{ width: 100%; border-collapse: collapse; border: 2px solid {cor_tema}; margin-bottom: 2px; table-layout: fixed; }}
-            thead th {{ background-color: {cor_tema} !important; color: #fff !important; padding: 6px; text-transform: uppercase; border: 1px solid {cor_tema}; font-size: 19px; text-align: center; -webkit-print-color-adjust: exact; }}
-            td {{ padding: 4px; border: 1px solid {cor_tema}; height: 28px; vertical-align: middle; white-space: nowrap; overflow: hidden; text-align: center; }}
-            .separator-bottom {{ border-bottom: 4px solid #000 !important; }}
-            .cx-col {{ width: 8%; font-weight: bold; font-size: 20px; }} 
-            .col-op-nome {{ width: 31.5%; font-weight: bold; font-size: 18px; }} 
-            .horario-col {{ width: 10%; font-weight: bold; font-size: 18px; }} 
-            .divider-col {{ width: 1%; background-color: {cor_tema} !important; padding: 0; border: none; -webkit-print-color-adjust: exact; }}
-            .col-emp-nome {{ width: 39.5%; font-weight: bold; font-size: 18px; }} 
-            .nome-col {{ font-weight: bold; text-transform: uppercase; letter-spacing: -0.5px; }}
-            .border-left {{ border-left: 3px solid {cor_tema}; }}
-            tr:nth-child(even) {{ background-color: #d9d9d9 !important; -webkit-print-color-adjust: exact; }}
-            .footer-container {{ display: flex; border: 2px solid {cor_tema}; border-top: none; }}
-            .footer-box {{ width: 50%; }}
-            .footer-header {{ background: {cor_tema} !important; color: #fff !important; text-align: center; font-weight: bold; font-size: 14px; padding: 4px; -webkit-print-color-adjust: exact; }}
-            .footer-content {{ background: #eee !important; font-size: 14px; padding: 6px; text-align: center; min-height: 40px; text-transform: uppercase; -webkit-print-color-adjust: exact; line-height: 1.2; white-space: normal; }}
-            .totals-container {{ display: flex; border: 2px solid {cor_tema}; border-top: none; background: {cor_tema} !important; color: #fff !important; -webkit-print-color-adjust: exact; }}
-            .totals-box {{ width: 50%; font-size: 12px; font-weight: bold; padding: 6px; text-align: center; line-height: 1.3; }}
-            @media print {{
-                body {{ padding: 0; margin: 0 auto; width: 90%; zoom: 90%; }}
-                thead th, .footer-header, .totals-container {{ background-color: {cor_tema} !important; color: #fff !important; }}
-                tr:nth-child(even), .footer-content {{ background-color: #ccc !important; }}
-                .separator-bottom {{ border-bottom: 4px solid #000 !important; }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="print-frame">
+        <div class="print-frame" style="--cor-tema: {cor_tema};">
             <div class="header-main">
                 <div class="header-dia">{dia_semana}</div>
                 <div class="header-data">DATA: <span style="color: {cor_tema}">{data_str}</span></div>
@@ -619,56 +1403,325 @@ def gerar_html_layout_exato(df_ops_dia, df_emp_dia, data_str, dia_semana, cor_te
                 </div>
             </div>
         </div>
+    """
+
+def _documento_layout_exato(titulo: str, paginas: list) -> str:
+    corpo = "\n        <div class=\"page-break\"></div>\n".join(paginas)
+    return f"""
+    <!DOCTYPE html>
+    <html lang="pt-BR">
+    <head>
+        <meta charset="UTF-8">
+        <title>{titulo}</title>
+        <style>{CSS_LAYOUT_EXATO}        </style>
+    </head>
+    <body>
+        {corpo}
     </body>
     </html>
     """
 
-# --- FUNÇÕES DE CONTROLE DE HORAS E AVISOS ---
+def gerar_html_layout_exato(df_ops_dia, df_emp_dia, data_str, dia_semana, cor_tema):
+    dados = montar_dados_layout_exato(df_ops_dia, df_emp_dia)
+    return _documento_layout_exato(f"Escala {dia_semana}", [_pagina_layout_exato(dados, data_str, dia_semana, cor_tema)])
 
-def obter_intervalo_minutos(h, m):
-    mins = h * 60 + m
-    if mins == 570 or mins == 600: return 105 
-    elif mins == 660 or mins == 720: return 75 
-    elif mins >= 870: return 15
-    else: return 60
+def preparar_dia_impressao(escala: EscalaSemana, df_colaboradores: pd.DataFrame, data_dia: date) -> tuple:
+    df_dia = escala.do_dia(data_dia)
+    if df_dia.empty: df_dia = pd.DataFrame(columns=['nome', 'funcao', 'horario', 'numero_caixa'])
 
-def calcular_saida_prevista(entrada_str, is_domingo_feriado=False):
-    if not entrada_str or "HRS" not in str(entrada_str): return "", ""
-    try:
-        time_part = str(entrada_str).replace(" HRS", "").strip()
-        h, m = map(int, time_part.split(':'))
-        if is_domingo_feriado: intervalo_mins = 10
-        else: intervalo_mins = obter_intervalo_minutos(h, m)
-        td_entrada = timedelta(hours=h, minutes=m)
-        td_saida = td_entrada + timedelta(minutes=(440 + intervalo_mins))
-        total_minutes = int(td_saida.total_seconds() // 60)
-        out_h = (total_minutes // 60) % 24
-        out_m = total_minutes % 60
-        if is_domingo_feriado: str_int = "10 min (Só Café)"
-        elif intervalo_mins == 15: str_int = "15 min (Só Café)"
-        elif intervalo_mins == 75: str_int = "1h 15m (Almoço+Café)"
-        elif intervalo_mins == 90: str_int = "1h 30m"
-        elif intervalo_mins == 105: str_int = "1h 45m (Almoço+Café)"
-        else: str_int = "1 hora"
-        return str_int, f"{out_h:02d}:{out_m:02d}"
-    except: return "", ""
-
-def calcular_saida_estimada(entrada_str, prevista_str, is_domingo_feriado):
-    if not entrada_str or "HRS" not in str(entrada_str): return ""
+    df_ops_base = df_colaboradores[df_colaboradores['funcao'].isin(['Operador(a) de Caixa', 'Recepção'])]
+    df_emp_base = df_colaboradores[df_colaboradores['funcao'] == 'Empacotador(a)']
+
+    resultado = []
+    for df_base in (df_ops_base, df_emp_base):
+        df_final = df_base.merge(df_dia[['nome', 'horario', 'numero_caixa']], on='nome', how='left').fillna("").sort_values('nome')
+        if 'nome_social' not in df_final.columns: df_final['nome_social'] = ""
+        tem_social = df_final['nome_social'].astype(str).str.strip() != ""
+        df_final['nome_impressao'] = df_final['nome_social'].where(tem_social, df_final['nome'])
+        resultado.append(df_final)
+    return tuple(resultado)
+
+def montar_semana_impressao(escala: EscalaSemana, df_colaboradores: pd.DataFrame, data_inicio: date, cores: list) -> list:
+    # Os 7 dias saem da mesma semana já carregada, sem nova consulta ao banco.
+    paginas = []
+    for i in range(7):
+        data_dia = data_inicio + timedelta(days=i)
+        df_ops, df_emp = preparar_dia_impressao(escala, df_colaboradores, data_dia)
+        paginas.append({'data': data_dia, 'dia_semana': DIAS_SEMANA_PT[data_dia.weekday()].upper(), 'cor': cores[i], 'dados': montar_dados_layout_exato(df_ops, df_emp)})
+    return paginas
+
+def _html_pagina_semana(pagina: dict) -> str:
+    return _pagina_layout_exato(pagina['dados'], pagina['data'].strftime('%d/%m/%Y'), pagina['dia_semana'], pagina['cor'])
+
+def gerar_html_semana_impressao(paginas: list, nome_semana: str) -> str:
+    return _documento_layout_exato(f"Escala {nome_semana}", [_html_pagina_semana(p) for p in paginas])
+
+def gerar_zip_semana_impressao(paginas: list) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for pagina in paginas:
+            zf.writestr(f"escala_diaria_{pagina['data'].strftime('%d_%m')}.html", _documento_layout_exato(f"Escala {pagina['dia_semana']}", [_html_pagina_semana(pagina)]))
+    return buffer.getvalue()
+
+# --- EXPORTAÇÃO EM PDF (fpdf2) ---
+# Fonte TrueType embutida no PDF (subconjunto) no lugar do @import do Google Fonts. A DejaVu Sans vai
+# junto com o repositório (fonts/, licença em LICENSE-DejaVu.txt) para o PDF sair igual em qualquer máquina.
+PASTA_FONTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+FONTES_PDF = (os.path.join(PASTA_FONTES, "DejaVuSans.ttf"), os.path.join(PASTA_FONTES, "DejaVuSans-Bold.ttf"))
+PROPORCOES_COLUNAS_PDF = [0.08, 0.315, 0.10, 0.01, 0.395, 0.10]
+ALTURA_LINHA_PDF_MAXIMA = 7.5  # mm; a fonte acompanha (altura × 2 pt)
+ALTURA_LINHA_PDF_MINIMA = 2.5  # abaixo disso a folha continua numa página seguinte, com o cabeçalho repetido
+
+def _novo_pdf() -> tuple:
+    faltando = [f for f in FONTES_PDF if not os.path.exists(f)]
+    if faltando: raise FileNotFoundError(f"Fonte do PDF não encontrada: {', '.join(faltando)}. Reinstale a pasta fonts/ do projeto.")
+    pdf = FPDF(orientation='P', unit='mm', format='A4')
+    pdf.set_margins(8, 8, 8); pdf.set_auto_page_break(True, margin=8)
+    pdf.add_font("Escala", "", FONTES_PDF[0]); pdf.add_font("Escala", "B", FONTES_PDF[1])
+    return pdf, "Escala"
+
+def _texto_pdf(texto) -> str:
+    return re.sub(r"<[^>]+>", "", str(texto))
+
+def _cor_rgb(cor_hex: str) -> tuple:
     try:
-        time_part = str(entrada_str).replace(" HRS", "").strip()
-        h, m = map(int, time_part.split(':'))
-        mins = h * 60 + m
-        if is_domingo_feriado:
-            if mins == 410: return "12:50" 
-            if mins == 450: return "13:10" 
-            if mins == 480: return "13:30" 
-            return prevista_str
+        h = str(cor_hex).lstrip('#')
+        return tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError: return (0, 0, 0)
+
+def _pagina_pdf_layout_exato(pdf: FPDF, familia: str, dados: dict, data_str: str, dia_semana: str, cor_tema: str):
+    cor = _cor_rgb(cor_tema)
+    pdf.add_page()
+    largura = pdf.epw
+    larguras = [p * largura for p in PROPORCOES_COLUNAS_PDF]
+    pdf.set_draw_color(*cor); pdf.set_text_color(0, 0, 0)
+
+    pdf.set_font(familia, "B", 30)
+    pdf.cell(largura, 11, _texto_pdf(dia_semana), align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font(familia, "B", 18)
+    pdf.cell(largura, 8, f"DATA: {data_str}", align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_line_width(0.8); pdf.line(pdf.l_margin, pdf.get_y() + 1, pdf.l_margin + largura, pdf.get_y() + 1); pdf.ln(2)
+
+    # Mesma disposição do HTML: empacotadores ganham uma linha vazia após cada troca de horário.
+    linhas_op = dados['ops']
+    linhas_emp = []
+    for linha in dados['emp']:
+        linhas_emp.append(linha)
+        if linha[-1]: linhas_emp.append(None)
+    linhas = list(zip_longest(linhas_op, linhas_emp, fillvalue=None))
+
+    # A altura da linha sai do espaço que sobra depois do rodapé (folgas + totais), então tabela e rodapé cabem
+    # na folha. A quebra automática fica desligada: só se nem a altura mínima couber a tabela segue numa
+    # página nova, com cabeçalho, e o rodapé vai junto com as últimas linhas.
+    folgas = [formatar_lista_folgas_multilinha(dados['folgas_op'], step=2).split("<br>"), formatar_lista_folgas_multilinha(dados['folgas_emp'], step=2).split("<br>")]
+    n_linhas_folga = max(len(folgas[0]), len(folgas[1]), 2)
+    altura_rodape = 6 + n_linhas_folga * 4.5 + 2 * 5
+    limite = pdf.h - pdf.b_margin
+    altura_linha = max(ALTURA_LINHA_PDF_MINIMA, min(ALTURA_LINHA_PDF_MAXIMA, (limite - pdf.get_y() - altura_rodape) / (len(linhas) + 1)))
+    tamanho_fonte = altura_linha * 2
+    pdf.set_auto_page_break(False)
+
+    def cabecalho_tabela():
+        pdf.set_line_width(0.3); pdf.set_draw_color(*cor); pdf.set_fill_color(*cor); pdf.set_text_color(255, 255, 255); pdf.set_font(familia, "B", tamanho_fonte)
+        for titulo, w in zip(["CX", "OPERADOR(A)", "HORÁRIO", "", "EMPACOTADOR(A)", "HORÁRIO"], larguras):
+            pdf.cell(w, altura_linha, _texto_pdf(titulo), border=1, align='C', fill=True)
+        pdf.ln(altura_linha)
+        pdf.set_text_color(0, 0, 0)
+
+    cabecalho_tabela()
+    for i, (op, emp) in enumerate(linhas):
+        restantes = len(linhas) - i
+        if pdf.get_y() + altura_linha > limite + 0.01 or (restantes == 1 and pdf.get_y() + altura_linha + altura_rodape > limite + 0.01):  # 0,01 mm: arredondamento
+            pdf.add_page(); cabecalho_tabela()
+        y = pdf.get_y()
+        zebra = i % 2 == 1
+        pdf.set_fill_color(217, 217, 217)
+        valores = [op[0], op[1], op[2]] if op else ["", "", ""]
+        for valor, w in zip(valores, larguras[:3]): pdf.cell(w, altura_linha, _texto_pdf(valor), border=1, align='C', fill=zebra)
+        pdf.set_fill_color(*cor); pdf.cell(larguras[3], altura_linha, "", border=0, fill=True)
+        pdf.set_fill_color(217, 217, 217)
+        valores = [emp[0], emp[1]] if emp else ["", ""]
+        for valor, w in zip(valores, larguras[4:]): pdf.cell(w, altura_linha, _texto_pdf(valor), border=1, align='C', fill=zebra)
+        pdf.ln(altura_linha)
+        pdf.set_draw_color(0, 0, 0); pdf.set_line_width(1.0)
+        if op and op[3]: pdf.line(pdf.l_margin, y + altura_linha, pdf.l_margin + sum(larguras[:3]), y + altura_linha)
+        if emp and emp[2]: pdf.line(pdf.l_margin + sum(larguras[:4]), y + altura_linha, pdf.l_margin + largura, y + altura_linha)
+        pdf.set_draw_color(*cor); pdf.set_line_width(0.3)
+    if pdf.get_y() + altura_rodape > limite + 0.01: pdf.add_page()
+
+    # Rodapé: folgas e totais lado a lado.
+    metade = largura / 2
+    pdf.set_font(familia, "B", 10); pdf.set_fill_color(*cor); pdf.set_text_color(255, 255, 255)
+    pdf.cell(metade, 6, "FOLGAS OPERADORES", border=1, align='C', fill=True)
+    pdf.cell(metade, 6, "FOLGAS EMPACOTADORES", border=1, align='C', fill=True, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font(familia, "", 9); pdf.set_fill_color(238, 238, 238); pdf.set_text_color(0, 0, 0)
+    for i in range(n_linhas_folga):
+        for lista in folgas:
+            texto = lista[i] if i < len(lista) else ""
+            pdf.cell(metade, 4.5, _texto_pdf(texto), border='LR', align='C', fill=True)
+        pdf.ln(4.5)
+
+    c_op_m = dados['c_op_manha'] + dados['c_self_manha']; c_op_t = dados['c_op_tarde'] + dados['c_self_tarde']
+    totais_op = [f"MANHÃ: {dados['c_op_manha']:02d} OP + {dados['c_self_manha']} SELF = {c_op_m:02d} OPERADORES", f"TARDE: {dados['c_op_tarde']:02d} OP + {dados['c_self_tarde']} SELF = {c_op_t:02d} OPERADORES"]
+    totais_emp = [f"MANHÃ: {dados['c_emp_manha']:02d} EMPACOTADORES", f"TARDE: {dados['c_emp_tarde']:02d} EMPACOTADORES"]
+    pdf.set_font(familia, "B", 9); pdf.set_fill_color(*cor); pdf.set_text_color(255, 255, 255)
+    for texto_op, texto_emp in zip(totais_op, totais_emp):
+        pdf.cell(metade, 5, _texto_pdf(texto_op), border=1, align='C', fill=True)
+        pdf.cell(metade, 5, _texto_pdf(texto_emp), border=1, align='C', fill=True, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_text_color(0, 0, 0); pdf.set_auto_page_break(True, margin=8)
+
+# Resultados ficam em cache pelo hash do conteúdo (o st.cache_data faz o hash dos DataFrames recebidos).
+@st.cache_data(max_entries=64, show_spinner=False)
+def gerar_pdf_layout_exato(df_ops_dia: pd.DataFrame, df_emp_dia: pd.DataFrame, data_str: str, dia_semana: str, cor_tema: str) -> bytes:
+    pdf, familia = _novo_pdf()
+    _pagina_pdf_layout_exato(pdf, familia, montar_dados_layout_exato(df_ops_dia, df_emp_dia), data_str, dia_semana, cor_tema)
+    return bytes(pdf.output())
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def gerar_pdf_semana_impressao(paginas: list) -> bytes:
+    pdf, familia = _novo_pdf()
+    for pagina in paginas: _pagina_pdf_layout_exato(pdf, familia, pagina['dados'], pagina['data'].strftime('%d/%m/%Y'), pagina['dia_semana'], pagina['cor'])
+    return bytes(pdf.output())
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def gerar_pdf_escala_semanal(df_escala: pd.DataFrame, nome_colaborador: str, semana_str: str) -> bytes:
+    pdf, familia = _novo_pdf()
+    pdf.add_page()
+    largura = pdf.epw
+    pdf.set_text_color(44, 62, 80); pdf.set_font(familia, "B", 20)
+    pdf.cell(largura, 10, "ESCALA SEMANAL", align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_text_color(127, 140, 141); pdf.set_font(familia, "", 13)
+    pdf.cell(largura, 7, _texto_pdf(nome_colaborador), align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.cell(largura, 7, _texto_pdf(semana_str), align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(4)
+
+    w = largura / max(len(df_escala.columns), 1)
+    pdf.set_draw_color(238, 238, 238); pdf.set_fill_color(52, 73, 94); pdf.set_text_color(255, 255, 255); pdf.set_font(familia, "B", 11)
+    for coluna in df_escala.columns: pdf.cell(w, 9, _texto_pdf(str(coluna).upper()), border=1, align='C', fill=True)
+    pdf.ln(9)
+    pdf.set_text_color(51, 51, 51); pdf.set_font(familia, "", 11); pdf.set_fill_color(249, 249, 249)
+    for i, valores in enumerate(df_escala.itertuples(index=False)):
+        for valor in valores: pdf.cell(w, 9, _texto_pdf("" if pd.isna(valor) else valor), border='B', align='C', fill=i % 2 == 1)
+        pdf.ln(9)
+    return bytes(pdf.output())
+
+# --- PLANILHA EXCEL DA ESCALA (MODELO ÚNICO PARA TODAS AS ABAS) ---
+MIME_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+_BORDA_CENTRO = {'align': 'center', 'valign': 'vcenter', 'border': 1}
+FORMATOS_EXCEL = {
+    'grade': {'border': 1, 'align': 'center', 'valign': 'vcenter'},
+    'titulo': {'bold': True, 'align': 'center', 'bg_color': '#D3D3D3', 'border': 1},
+    'data': {'bold': True, 'align': 'center', 'bg_color': '#DDEBF7', 'border': 1, 'font_color': 'black'},
+    'ref': {'bold': True, 'align': 'center', 'bg_color': '#FFF2CC', 'border': 1, 'font_color': 'black'},
+    'nome': {'border': 1, 'valign': 'vcenter', 'align': 'left'},
+    'manha': {'bold': True, 'font_color': 'blue', 'bg_color': '#E0F7FA', **_BORDA_CENTRO},
+    'tarde': {'bold': True, 'font_color': 'orange', 'bg_color': '#FFF3E0', **_BORDA_CENTRO},
+    'vermelho': {'bg_color': '#FFC7CE', 'font_color': '#9C0006', **_BORDA_CENTRO},
+    'verde': {'bg_color': '#C6EFCE', 'font_color': '#006100', **_BORDA_CENTRO},
+    'roxo': {'bg_color': '#E6E6FA', 'font_color': '#4B0082', **_BORDA_CENTRO},
+    'cinza': {'bg_color': '#D3D3D3', 'font_color': '#000000', **_BORDA_CENTRO},
+    'amarelo': {'bg_color': '#FFEB9C', 'font_color': '#9C5700', **_BORDA_CENTRO},
+    'duplicata': {'bg_color': '#FF0000', 'font_color': '#FFFFFF', 'bold': True, 'align': 'center'},
+}
+NOMES_CARGO_EXCEL = {"Operador(a) de Caixa": "Operadoras", "Empacotador(a)": "Empacotadores", "Fiscal de Caixa": "Fiscais", "Recepção": "Recepção"}
+FUNCOES_COM_COLUNA_REF = ["Operador(a) de Caixa", "Empacotador(a)", "Recepção"]
+
+def _letra_coluna_excel(n: int) -> str:
+    s = ""
+    while n >= 0:
+        s = chr(n % 26 + 65) + s
+        n = n // 26 - 1
+    return s
+
+@st.cache_resource(show_spinner=False)
+def _layout_excel(funcao: str, n_linhas: int) -> dict:
+    # Tudo que depende só da função e do tamanho da equipe (colunas, validações e fórmulas) é montado uma vez só
+    is_op = funcao == "Operador(a) de Caixa"
+    tem_ref = funcao in FUNCOES_COM_COLUNA_REF
+    passo = 2 if tem_ref else 1
+    fim = n_linhas + 1
+    fora_contagem = "".join(f', {{cx}}, "<>{c}"' for c in ["Recepção", "Delivery", "Magazine", "Salinha"])
+    dias = []
+    for i in range(7):
+        col = 1 + i * passo
+        letra = _letra_coluna_excel(col)
+        rng = f"{letra}2:{letra}{fim}"
+        dia = {'col': col, 'rng': rng, 'rng_ref': None, 'formula_dup': None}
+        if tem_ref:
+            letra_cx = _letra_coluna_excel(col + 1)
+            dia['rng_ref'] = f"{letra_cx}2:{letra_cx}{fim}"
+        if is_op:
+            rng_cx = dia['rng_ref']
+            cond = fora_contagem.format(cx=rng_cx)
+            dia['formula_m'] = "=SUM(" + ",".join(f'COUNTIFS({rng}, "{h}"{cond})' for h in HORARIOS_MANHA) + ")"
+            dia['formula_t'] = "=SUM(" + ",".join(f'COUNTIFS({rng}, "{h}"{cond})' for h in HORARIOS_TARDE + ["7:30 HRS"]) + ")"
+            dia['formula_dup'] = f'=COUNTIFS(${letra_cx}$2:${letra_cx}${fim}, {letra_cx}2, ${letra}$2:${letra}${fim}, {letra}2) > 1'
         else:
-            if mins == 570 or mins == 600: return "19:05"
-            elif mins >= 660: return "20:45"
-            else: return prevista_str
-    except: return prevista_str
+            dia['formula_m'] = "=SUM(" + ",".join(f'COUNTIF({rng}, "{h}")' for h in HORARIOS_MANHA) + ")"
+            dia['formula_t'] = "=SUM(" + ",".join(f'COUNTIF({rng}, "{h}")' for h in HORARIOS_TARDE) + ")"
+        dias.append(dia)
+
+    usa_caixa = funcao != "Empacotador(a)"
+    return {
+        'dias': dias, 'tem_ref': tem_ref,
+        'largura_nome': 35 if is_op else 30,
+        'titulo_ref': "CX" if usa_caixa else "TAREFAS",
+        'validacao_ref': f"=Dados!$B$1:$B${len(LISTA_OPCOES_CAIXA)}" if usa_caixa else f"=Dados!$C$1:$C${len(LISTA_TAREFAS_EMPACOTADOR)}",
+        'multi_horarios': " ".join(d['rng'] for d in dias),
+        'multi_ref': " ".join(d['rng_ref'] for d in dias) if tem_ref else None,
+        'nome_cargo': NOMES_CARGO_EXCEL.get(funcao, funcao),
+    }
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def gerar_excel_escala(df_grade: pd.DataFrame, data_inicio: date, funcao: str) -> bytes:
+    # df_grade: uma linha por colaborador -> Nome, depois horário (e caixa/tarefa, se a função tiver) de cada dia
+    layout = _layout_excel(funcao, len(df_grade))
+    n = len(df_grade); dias = layout['dias']
+    buffer = io.BytesIO()
+    with xlsxwriter.Workbook(buffer, {'in_memory': True}) as workbook:
+        fmt = {chave: workbook.add_format(spec) for chave, spec in FORMATOS_EXCEL.items()}
+        worksheet = workbook.add_worksheet('Escala'); worksheet.hide_gridlines(2)
+        ws_data = workbook.add_worksheet('Dados'); ws_data.hide()
+        ws_data.write_column('A1', HORARIOS_PADRAO)
+        ws_data.write_column('B1', LISTA_OPCOES_CAIXA)
+        ws_data.write_column('C1', LISTA_TAREFAS_EMPACOTADOR)
+
+        worksheet.write(0, 0, "Nome", fmt['titulo']); worksheet.set_column(0, 0, layout['largura_nome'])
+        for i, dia in enumerate(dias):
+            worksheet.write(0, dia['col'], (data_inicio + timedelta(days=i)).strftime('%d/%m/%Y'), fmt['data']); worksheet.set_column(dia['col'], dia['col'], 12)
+            if layout['tem_ref']: worksheet.write(0, dia['col'] + 1, layout['titulo_ref'], fmt['ref']); worksheet.set_column(dia['col'] + 1, dia['col'] + 1, 10)
+
+        for r, linha in enumerate(df_grade.fillna("").itertuples(index=False, name=None), start=1):
+            worksheet.write(r, 0, linha[0], fmt['nome'])
+            worksheet.write_row(r, 1, linha[1:], fmt['grade'])
+
+        # Uma regra por horário cobrindo os 7 dias de uma vez (multi_range), em vez de repetir por coluna
+        primeiro = dias[0]['col']
+        worksheet.data_validation(1, primeiro, n, primeiro, {'validate': 'list', 'source': f"=Dados!$A$1:$A${len(HORARIOS_PADRAO)}", 'multi_range': layout['multi_horarios']})
+        for cor, horarios in CORES_HORARIOS_EXCEL:
+            for h in horarios: worksheet.conditional_format(1, primeiro, n, primeiro, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt[cor], 'multi_range': layout['multi_horarios']})
+        if layout['tem_ref']: worksheet.data_validation(1, primeiro + 1, n, primeiro + 1, {'validate': 'list', 'source': layout['validacao_ref'], 'multi_range': layout['multi_ref']})
+
+        worksheet.write(n + 1, 0, f"{layout['nome_cargo']} Manhã", fmt['manha'])
+        worksheet.write(n + 2, 0, f"{layout['nome_cargo']} Tarde", fmt['tarde'])
+        for dia in dias:
+            if dia['formula_dup']: worksheet.conditional_format(dia['rng_ref'], {'type': 'formula', 'criteria': dia['formula_dup'], 'format': fmt['duplicata']})
+            worksheet.write_formula(n + 1, dia['col'], dia['formula_m'], fmt['manha'])
+            worksheet.write_formula(n + 2, dia['col'], dia['formula_t'], fmt['tarde'])
+    return buffer.getvalue()
+
+# --- FUNÇÕES DE CONTROLE DE HORAS E AVISOS ---
+
+def calcular_saida_prevista(entrada_str, is_domingo_feriado=False):
+    turno = obter_turno(entrada_str)
+    if not turno.trabalha: return "", ""
+    if is_domingo_feriado: return TEXTO_INTERVALO_DOMINGO, turno.saida_prevista_domingo
+    return turno.intervalo, turno.saida_prevista
+
+def calcular_saida_estimada(entrada_str, is_domingo_feriado):
+    turno = obter_turno(entrada_str)
+    if not turno.trabalha: return ""
+    return turno.saida_estimada_domingo if is_domingo_feriado else turno.saida_estimada
 
 def calcular_diferenca(prevista_str, estimada_str):
     if not prevista_str or not estimada_str: return 0
@@ -688,55 +1741,106 @@ def formatar_minutos(total_mins):
     h = total_mins // 60; m = total_mins % 60
     return f"{sign} {h:02d}h {m:02d}m"
 
-def gerar_alertas_trabalhistas(nome, horarios, data_inicio):
-    alertas = []
-    if len(horarios) < 7: return alertas
-    dias_trabalho = sum(1 for h in horarios if h and "HRS" in h)
-    if dias_trabalho == 7: alertas.append("⚠️ **Sem Folga Semanal:** Escalado(a) os 7 dias seguidos.")
-    for i in range(6):
-        h1 = horarios[i]; h2 = horarios[i+1]
-        if h1 and "HRS" in h1 and h2 and "HRS" in h2:
-            data1 = data_inicio + timedelta(days=i)
-            data2 = data_inicio + timedelta(days=i+1)
-            is_domingo1 = (data1.weekday() == 6)
-            _, prev1 = calcular_saida_prevista(h1, is_domingo1)
-            saida1 = calcular_saida_estimada(h1, prev1, is_domingo1)
-            ent2 = h2.replace(" HRS", "").strip()
-            if saida1 and ent2:
-                try:
-                    s_h, s_m = map(int, saida1.replace("h",":").replace("H",":").split(':'))
-                    e_h, e_m = map(int, ent2.split(':'))
-                    dt1 = datetime.datetime.combine(data1, datetime.time(s_h, s_m))
-                    h1_int = int(h1.replace(" HRS","").split(":")[0])
-                    if s_h < 12 and h1_int >= 12: dt1 += timedelta(days=1)
-                    dt2 = datetime.datetime.combine(data2, datetime.time(e_h, e_m))
-                    diff_hours = (dt2 - dt1).total_seconds() / 3600.0
-                    if diff_hours < 11:
-                        dia1_str = f"{DIAS_SEMANA_PT[data1.weekday()][:3]} ({data1.strftime('%d/%m')})"
-                        dia2_str = f"{DIAS_SEMANA_PT[data2.weekday()][:3]} ({data2.strftime('%d/%m')})"
-                        h_fmt = int(diff_hours); m_fmt = int(round((diff_hours - h_fmt) * 60))
-                        alertas.append(f"⚠️ **Interjornada Curta:** Apenas {h_fmt}h {m_fmt}m de descanso entre {dia1_str} e {dia2_str}.")
-                except: pass
-    return alertas
+# --- VERIFICAÇÃO TRABALHISTA VETORIZADA (PESSOA × DIA) ---
+INTERJORNADA_MINIMA_MIN = 11 * 60
+DIAS_SEGUIDOS_MAXIMO = 6
+DOMINGOS_SEGUIDOS_MAXIMO = 2  # comércio: a folga tem que cair num domingo pelo menos 1 vez a cada 3 semanas
+SEMANAS_AUDITORIA_PADRAO = 8
+
+def matriz_jornadas(df: pd.DataFrame, data_ini: date, n_dias: int):
+    # Uma linha por pessoa e uma coluna por dia, com entrada e saída estimada em minutos (9999 = não trabalha).
+    datas = [data_ini + timedelta(days=i) for i in range(n_dias)]
+    dias = (pd.to_datetime(df['data'], errors='coerce') - pd.Timestamp(data_ini)).dt.days if not df.empty else pd.Series(dtype=float)
+    df = df[dias.between(0, n_dias - 1)]; dias = dias[dias.between(0, n_dias - 1)].to_numpy(dtype=int)
+    codigos_nome, nomes = pd.factorize(df['nome'])
+    entradas = np.full((len(nomes), n_dias), 9999); saidas = np.full((len(nomes), n_dias), 9999)
+    domingo = np.array([d.weekday() == 6 for d in datas])[dias]
+    entradas[codigos_nome, dias] = minutos_turno(df['horario'])
+    saidas[codigos_nome, dias] = saidas_turno(df['horario'], domingo)
+    return list(nomes), datas, entradas, saidas
+
+def _dia_curto(d: date) -> str:
+    return f"{DIAS_SEMANA_PT[d.weekday()][:3]} ({d.strftime('%d/%m')})"
+
+def _sequencias(marcado: np.ndarray):
+    # Comprimento da sequência de True que termina em cada coluna e onde cada sequência acaba (por linha).
+    acumulado = np.cumsum(marcado, axis=1)
+    comprimento = acumulado - np.maximum.accumulate(np.where(marcado, 0, acumulado), axis=1)
+    fim = marcado & np.hstack([~marcado[:, 1:], np.ones((marcado.shape[0], 1), dtype=bool)])
+    return comprimento, fim
+
+def violacoes_jornada(nomes: list, datas: list, entradas: np.ndarray, saidas: np.ndarray, primeiro_dia: int = 0) -> pd.DataFrame:
+    # Descanso entre dias e sequências de trabalho em uma passada; colunas antes de `primeiro_dia` são só contexto
+    # (a semana anterior), então só entram violações que terminam a partir dele.
+    colunas = ['nome', 'regra', 'inicio', 'fim', 'valor', 'mensagem']
+    if not nomes: return pd.DataFrame(columns=colunas)
+    trabalha = entradas != 9999
+    descanso = 24 * 60 + entradas[:, 1:] - saidas[:, :-1]
+    curta = trabalha[:, 1:] & trabalha[:, :-1] & (descanso < INTERJORNADA_MINIMA_MIN)
+    curta[:, :max(primeiro_dia - 1, 0)] = False
+
+    sequencia, fim_sequencia = _sequencias(trabalha)
+    longa = fim_sequencia & (sequencia > DIAS_SEGUIDOS_MAXIMO)
+    longa[:, :primeiro_dia] = False
+
+    domingos = np.array([j for j, d in enumerate(datas) if d.weekday() == 6], dtype=int)
+    seq_domingos, fim_domingos = _sequencias(trabalha[:, domingos])
+    domingos_seguidos = fim_domingos & (seq_domingos > DOMINGOS_SEGUIDOS_MAXIMO) & (domingos >= primeiro_dia)
+
+    linhas = []
+    for p, j in zip(*np.nonzero(longa)):
+        n = int(sequencia[p, j]); inicio = datas[j - n + 1]
+        linhas.append((nomes[p], 'folga_semanal', inicio, datas[j], n, f"⚠️ **Sem Folga Semanal:** {n} dias seguidos de trabalho, de {_dia_curto(inicio)} a {_dia_curto(datas[j])}."))
+    for p, k in zip(*np.nonzero(domingos_seguidos)):
+        n = int(seq_domingos[p, k]); inicio = datas[domingos[k - n + 1]]; fim = datas[domingos[k]]
+        linhas.append((nomes[p], 'folga_domingo', inicio, fim, n, f"⚠️ **Domingos sem Folga:** {n} domingos seguidos trabalhados, de {inicio.strftime('%d/%m')} a {fim.strftime('%d/%m')}."))
+    for p, j in zip(*np.nonzero(curta)):
+        h, m = divmod(int(descanso[p, j]), 60)
+        linhas.append((nomes[p], 'interjornada', datas[j], datas[j + 1], int(descanso[p, j]), f"⚠️ **Interjornada Curta:** Apenas {h}h {m}m de descanso entre {_dia_curto(datas[j])} e {_dia_curto(datas[j + 1])}."))
+    return pd.DataFrame(linhas, columns=colunas).sort_values(['nome', 'fim', 'regra'], kind='stable').reset_index(drop=True)
+
+def gerar_alertas_trabalhistas(nome, horarios, data_inicio, df_anterior: pd.DataFrame = None) -> list:
+    # Semana em edição de uma pessoa; df_anterior (nome, data, horario) traz a semana anterior para checar a virada.
+    df = pd.DataFrame({'nome': nome, 'data': [pd.Timestamp(data_inicio + timedelta(days=i)) for i in range(len(horarios))], 'horario': horarios})
+    if df_anterior is not None and not df_anterior.empty: df = pd.concat([df_anterior[['nome', 'data', 'horario']], df], ignore_index=True)
+    return violacoes_jornada(*matriz_jornadas(df, data_inicio - timedelta(days=7), 14), primeiro_dia=7)['mensagem'].tolist()
+
+@st.cache_data(ttl=3600, max_entries=32)
+def _violacoes_semana(chaves: tuple, data_ini: date, _escalas: tuple) -> pd.DataFrame:
+    partes = [e.df[['nome', 'data', 'horario']] for e in _escalas if not e.empty]
+    df = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['nome', 'data', 'horario'])
+    return violacoes_jornada(*matriz_jornadas(df, data_ini - timedelta(days=7), 14), primeiro_dia=7)
+
+def violacoes_clt_semana(id_semana: int, data_ini: date) -> pd.DataFrame:
+    # Recalculado só quando a versão da semana (ou da anterior, usada na virada) muda.
+    escalas = [carregar_escala_semana(id_semana)]
+    id_anterior = semana_anterior(data_ini)
+    if id_anterior is not None: escalas.append(carregar_escala_semana(id_anterior, silencioso=True))
+    return _violacoes_semana(tuple(e.chave for e in escalas), data_ini, tuple(escalas))
+
+@st.cache_data(ttl=600, max_entries=16)
+def _varrer_conformidade(ids_semanas: tuple, versoes: tuple, data_de: date, data_ate: date) -> pd.DataFrame:
+    df = carregar_escalas_semanas(ids_semanas)
+    n_dias = (data_ate - data_de).days + 1 + 7
+    return violacoes_jornada(*matriz_jornadas(df, data_de - timedelta(days=7), n_dias), primeiro_dia=7)
+
+def varrer_conformidade(df_semanas_todas: pd.DataFrame, data_de: date, data_ate: date) -> pd.DataFrame:
+    # Todas as semanas do período (mais a anterior, para a virada) numa consulta só; custo linear no nº de semanas.
+    if df_semanas_todas.empty or data_ate < data_de: return violacoes_jornada([], [], None, None)
+    inicios = pd.to_datetime(df_semanas_todas['data_inicio'], errors='coerce').dt.date
+    ids = tuple(sorted(int(i) for i, ini in zip(df_semanas_todas['id'], inicios) if pd.notna(ini) and ini + timedelta(days=6) >= data_de - timedelta(days=7) and ini <= data_ate))
+    if not ids: return violacoes_jornada([], [], None, None)
+    return _varrer_conformidade(ids, tuple(versao_cache(f"semana:{i}") for i in ids), data_de, data_ate)
 
 def exibir_painel_alertas(df_semanas_ativas, df_colaboradores):
     if df_semanas_ativas.empty or df_colaboradores.empty: return
     semana_recente = df_semanas_ativas.iloc[0]
-    id_semana = int(semana_recente['id'])
     data_ini = pd.to_datetime(semana_recente['data_inicio']).date()
-    nome_semana = semana_recente['nome_semana']
-    df_escala = carregar_escala_semana_por_id(id_semana)
-    if df_escala.empty: return
-    alertas_gerais = []
-    for nome in df_colaboradores['nome']:
-        escala_colab = df_escala[df_escala['nome'] == nome].sort_values('data')
-        if len(escala_colab) == 7:
-            horarios = escala_colab['horario'].tolist()
-            alertas_colab = gerar_alertas_trabalhistas(nome, horarios, data_ini)
-            for alerta in alertas_colab:
-                alerta_limpo = alerta.replace('⚠️ ', '')
-                alertas_gerais.append(f"**{nome}** ➔ {alerta_limpo}")
-    if alertas_gerais: st.error(f"### 🚨 Alertas Trabalhistas Pendentes ({nome_semana})\n" + "\n".join(["* " + a for a in alertas_gerais]))
+    with cronometro("Alertas trabalhistas"): violacoes = violacoes_clt_semana(int(semana_recente['id']), data_ini)
+    violacoes = violacoes[violacoes['nome'].isin(df_colaboradores['nome'])]
+    if violacoes.empty: return
+    alertas_gerais = [f"**{nome}** ➔ {mensagem.replace('⚠️ ', '')}" for nome, mensagem in zip(violacoes['nome'], violacoes['mensagem'])]
+    st.error(f"### 🚨 Alertas Trabalhistas Pendentes ({semana_recente['nome_semana']})\n" + "\n".join(["* " + a for a in alertas_gerais]))
 
 
 # --- ABAS ---
@@ -761,22 +1865,18 @@ def aba_controle_horas(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Dat
     st.markdown("---")
     if semana_info and colaborador:
         id_semana = semana_info['id']
-        df_full = carregar_escala_semana_por_id(id_semana)
-        escala_colab = df_full[df_full['nome'] == colaborador] if not df_full.empty else pd.DataFrame()
+        escala_colab = carregar_escala_semana(id_semana).do_colaborador(colaborador)
+        pre_carregar_semanas_vizinhas(id_semana)
         
         if escala_colab.empty:
             st.info("Nenhum horário cadastrado para este colaborador nesta semana.")
         else:
-            escala_colab['data'] = pd.to_datetime(escala_colab['data'])
-            escala_colab = escala_colab.sort_values('data')
             dados_tabela = []
-            for _, row in escala_colab.iterrows():
-                data_dt = pd.to_datetime(row['data'])
+            for data_dt, entrada in zip(escala_colab['data'], escala_colab['horario']):
                 dia_str = data_dt.strftime(f'%d/%m ({DIAS_SEMANA_PT[data_dt.weekday()][:3]})')
-                entrada = row['horario']
                 is_domingo = (data_dt.weekday() == 6)
                 intervalo, prevista = calcular_saida_prevista(entrada, is_domingo) if "HRS" in str(entrada) else ("", "")
-                estimada_padrao = calcular_saida_estimada(entrada, prevista, is_domingo)
+                estimada_padrao = calcular_saida_estimada(entrada, is_domingo)
                 dados_tabela.append({
                     "Data": dia_str, "Entrada Escala": entrada, "Tempo Almoço/Café": intervalo,
                     "Saída Prevista (Cravada)": prevista, "Saída Estimada (Aprox)": estimada_padrao, "Dom / Feriado?": is_domingo
@@ -810,6 +1910,24 @@ def aba_controle_horas(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Dat
             cor_saldo = "🟢" if saldo_geral >= 0 else "🔴"
             c_res2.metric(f"{cor_saldo} Saldo Estimado", formatar_minutos(saldo_geral))
 
+    st.markdown("---"); st.markdown("### 📋 Auditoria Trabalhista (Várias Semanas)")
+    st.caption("Confere dias seguidos sem folga, interjornada de 11h (inclusive na virada das semanas) e domingos seguidos trabalhados.")
+    hoje = date.today()
+    periodo = st.date_input("Período:", value=(hoje - timedelta(weeks=SEMANAS_AUDITORIA_PADRAO), hoje), format="DD/MM/YYYY", key="periodo_auditoria")
+    # O resultado fica na sessão: o clique no download reexecuta o script e a tabela continua na tela
+    if st.button("🔍 Verificar Período", key="btn_auditoria") and isinstance(periodo, tuple) and len(periodo) == 2:
+        with cronometro("Auditoria trabalhista"): st.session_state['auditoria'] = (periodo, varrer_conformidade(carregar_indice_semanas(), periodo[0], periodo[1]))
+    if 'auditoria' in st.session_state:
+        periodo_auditado, violacoes = st.session_state['auditoria']
+        st.caption(f"Período verificado: {periodo_auditado[0].strftime('%d/%m/%Y')} a {periodo_auditado[1].strftime('%d/%m/%Y')}")
+        if violacoes.empty: st.success("Nenhuma violação encontrada no período.")
+        else:
+            st.error(f"{len(violacoes)} violação(ões) em {violacoes['nome'].nunique()} colaborador(es).")
+            tabela = violacoes.assign(inicio=pd.to_datetime(violacoes['inicio']).dt.strftime('%d/%m/%Y'), fim=pd.to_datetime(violacoes['fim']).dt.strftime('%d/%m/%Y'), mensagem=violacoes['mensagem'].str.replace(r"⚠️ |\*\*", "", regex=True))
+            tabela = tabela[['nome', 'mensagem', 'inicio', 'fim']].rename(columns={'nome': 'Colaborador', 'mensagem': 'Violação', 'inicio': 'Início', 'fim': 'Fim'})
+            st.dataframe(tabela, hide_index=True, use_container_width=True)
+            st.download_button("📥 Baixar Relatório (CSV)", data=tabela.to_csv(index=False).encode('utf-8-sig'), file_name=f"auditoria_{periodo_auditado[0].strftime('%d-%m')}_{periodo_auditado[1].strftime('%d-%m')}.csv", mime="text/csv", key="down_auditoria")
+
     st.markdown("---"); st.markdown("### 🧮 Calculadora Avulsa de Horas (Base: 7h20m)")
     col_calc1, col_calc2, col_calc3, col_calc4, col_calc5 = st.columns(5)
     with col_calc1: calc_entrada = st.time_input("Entrada (Real)", datetime.time(6, 50))
@@ -852,8 +1970,8 @@ def aba_consultar_escala_publica(df_colaboradores: pd.DataFrame, df_semanas_ativ
         if semana_str:
             semana_info = opcoes_semana[semana_str]
             with st.container(border=True):
-                df = carregar_escala_semana_por_id(semana_info['id'])
-                final = df[df['nome'] == nome_selecionado].sort_values("data")
+                final = carregar_escala_semana(semana_info['id']).do_colaborador(nome_selecionado)
+                pre_carregar_semanas_vizinhas(semana_info['id'])
                 if not final.empty:
                     display = final.copy()
                     display["Data"] = display["data"].apply(formatar_data_completa)
@@ -869,7 +1987,11 @@ def aba_consultar_escala_publica(df_colaboradores: pd.DataFrame, df_semanas_ativ
                     html = gerar_html_escala_semanal(display[cols_renamed], nome_selecionado, semana_str)
                     b64 = base64.b64encode(html.encode('utf-8')).decode()
                     nome_arq = f"escala_{nome_selecionado.strip().replace(' ','_')}.html"
-                    st.markdown(f'<a href="data:text/html;charset=utf-8;base64,{b64}" download="{nome_arq}" style="background-color:#0068c9;color:white;padding:0.5em;text-decoration:none;border-radius:5px;">🖨️ Baixar para Impressão</a>', unsafe_allow_html=True)
+                    c_pdf, c_html = st.columns(2)
+                    with c_pdf:
+                        try: st.download_button("📄 Baixar PDF", data=gerar_pdf_escala_semanal(display[cols_renamed], nome_selecionado, semana_str), file_name=nome_arq.replace(".html", ".pdf"), mime="application/pdf")
+                        except FileNotFoundError as e: st.error(str(e))
+                    with c_html: st.markdown(f'<a href="data:text/html;charset=utf-8;base64,{b64}" download="{nome_arq}" style="background-color:#0068c9;color:white;padding:0.5em;text-decoration:none;border-radius:5px;">🖨️ Baixar para Impressão</a>', unsafe_allow_html=True)
                 else:
                     st.info("Sem horários para esta semana.")
 
@@ -899,7 +2021,7 @@ def aba_gerenciar_semanas(df_semanas_todas: pd.DataFrame):
         if st.button("✨ Inicializar Semana", type="primary", use_container_width=True):
             data_inicio = data_sel - timedelta(days=data_sel.weekday())
             if inicializar_semana_simples(data_inicio):
-                st.cache_data.clear(); st.success("Semana inicializada!"); time.sleep(1.5); st.rerun()
+                st.success("Semana inicializada!"); time.sleep(1.5); st.rerun()
     
     st.markdown("---"); st.markdown("##### 📂 Histórico de Semanas")
     if not df_semanas_todas.empty:
@@ -918,10 +2040,10 @@ def aba_gerenciar_semanas(df_semanas_todas: pd.DataFrame):
             key_arch = f"btn_arch_{row['id']}"
             if row['ativa']:
                 if c2.button("Arquivar", key=key_arch):
-                    arquivar_reativar_semana(int(row['id']), False); st.cache_data.clear(); st.rerun()
+                    arquivar_reativar_semana(int(row['id']), False); st.rerun()
             else:
                 if c2.button("Reativar", key=key_arch):
-                    arquivar_reativar_semana(int(row['id']), True); st.cache_data.clear(); st.rerun()
+                    arquivar_reativar_semana(int(row['id']), True); st.rerun()
     else: st.info("Nenhuma semana criada.")
 
 @st.fragment
@@ -947,11 +2069,8 @@ def aba_editar_escala_individual(df_colaboradores: pd.DataFrame, df_semanas_ativ
     st.markdown("---")
     if semana_info and colaborador:
         id_semana = semana_info['id']; data_ini = semana_info['data_inicio']
-        df_full = carregar_escala_semana_por_id(id_semana)
-        escala_colab = df_full[df_full['nome'] == colaborador] if not df_full.empty else pd.DataFrame()
-        
-        horarios_atuais = {pd.to_datetime(row['data']).date(): row['horario'] for _, row in escala_colab.iterrows()}
-        caixas_atuais = {pd.to_datetime(row['data']).date(): row['numero_caixa'] for _, row in escala_colab.iterrows()}
+        escala = carregar_escala_semana(id_semana)
+        pre_carregar_semanas_vizinhas(id_semana)
 
         funcao_atual = "Não definido"
         if 'funcao' in df_colaboradores.columns:
@@ -967,8 +2086,7 @@ def aba_editar_escala_individual(df_colaboradores: pd.DataFrame, df_semanas_ativ
         for i in range(7):
             dia_atual = data_ini + timedelta(days=i)
             dia_label = f"{DIAS_SEMANA_PT[i]}\n({dia_atual.strftime('%d/%m')})"
-            horario_atual = horarios_atuais.get(dia_atual, "")
-            caixa_atual = caixas_atuais.get(dia_atual, "")
+            horario_atual, caixa_atual = escala.celula(colaborador, dia_atual)
             if pd.isna(caixa_atual): caixa_atual = ""
             
             idx_h = HORARIOS_PADRAO.index(horario_atual) if horario_atual in HORARIOS_PADRAO else 0
@@ -991,15 +2109,18 @@ def aba_editar_escala_individual(df_colaboradores: pd.DataFrame, df_semanas_ativ
                 novos_caixas.append(val_c)
         st.markdown("")
         
-        alertas_clt = gerar_alertas_trabalhistas(colaborador, novos_horarios, data_ini)
+        id_anterior = semana_anterior(data_ini)
+        df_anterior = carregar_escala_semana(id_anterior, silencioso=True).do_colaborador(colaborador) if id_anterior is not None else None
+        alertas_clt = gerar_alertas_trabalhistas(colaborador, novos_horarios, data_ini, df_anterior)
         if alertas_clt: st.error("**🚨 Alertas Trabalhistas (CLT):**\n\n" + "\n\n".join(alertas_clt))
             
         if st.button("💾 Salvar Alterações", type="primary", use_container_width=True):
             if salvar_escala_individual(colaborador, novos_horarios, novos_caixas, data_ini, id_semana):
-                st.cache_data.clear(); st.success(f"Salvo!"); time.sleep(1); st.rerun()
+                st.success(f"Salvo!"); time.sleep(1); st.rerun()
 
 # ------------------- NOVA ABA: ESCALA MÁGICA -------------------
 @st.fragment
+@cronometrado("Aba Escala Mágica (rerun)")
 def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.DataFrame, df_semanas_todas: pd.DataFrame):
     st.header("✨ Escala Mágica")
     st.markdown("**Siga os dois passos abaixo:**")
@@ -1009,13 +2130,15 @@ def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Data
     # ---------------- ETAPA 1: GERAR HORÁRIOS ----------------
     st.markdown("---")
     st.subheader("1️⃣ Gerar Horários (Rodízio Inteligente)")
-    st.info("Baixe a planilha com os horários pré-preenchidos. O sistema vai analisar os últimos 14 dias para rodar a equipe de forma justa de Segunda a Sábado.")
+    st.info("Baixe a planilha com os horários pré-preenchidos. O sistema vai analisar as últimas semanas para rodar a equipe de forma justa de Segunda a Sábado.")
     
     col1, col2 = st.columns(2)
     with col1:
         opcoes_m = {row['nome_semana']: {'id': int(row['id']), 'data_inicio': pd.to_datetime(row['data_inicio']).date()} for _, row in df_semanas_ativas.iterrows()}
         semana_str_m = st.selectbox("Qual semana?", options=opcoes_m.keys(), key="sel_sem_magica_down")
         semana_info_m = opcoes_m[semana_str_m]
+    with col2:
+        n_semanas_hist = st.number_input("Semanas de histórico para o rodízio:", min_value=1, max_value=12, value=SEMANAS_HISTORICO_RODIZIO, key="num_sem_hist_magica")
     
     if semana_info_m:
         data_ini_m = semana_info_m['data_inicio']
@@ -1029,52 +2152,14 @@ def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Data
         
         if df_filtrado_m.empty: st.error("Não há Operadores de Caixa cadastrados.")
         else:
-            colunas_m = ['Nome']
-            for i in range(7):
-                d_str_m = (data_ini_m + timedelta(days=i)).strftime('%d/%m/%Y')
-                colunas_m.append(d_str_m); colunas_m.append(f"CX_REF_{d_str_m}")
-
-            df_template_m = pd.DataFrame(columns=colunas_m)
-            df_template_m['Nome'] = sorted(df_filtrado_m['nome'].unique())
-            
-            buffer_m = io.BytesIO()
-            try:
-                with pd.ExcelWriter(buffer_m, engine='xlsxwriter') as writer:
-                    df_template_m.to_excel(writer, index=False, sheet_name='Escala')
-                    workbook = writer.book; worksheet = writer.sheets['Escala']
-                    worksheet.hide_gridlines(2)
-                    
-                    fmt_grid = workbook.add_format({'border': 1, 'align': 'center', 'valign': 'vcenter'})
-                    fmt_bold = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#D3D3D3', 'border': 1})
-                    fmt_date_header = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#DDEBF7', 'border': 1, 'font_color': 'black'}) 
-                    fmt_cx_header = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#FFF2CC', 'border': 1, 'font_color': 'black'})
-                    fmt_manha = workbook.add_format({'bold': True, 'font_color': 'blue', 'bg_color': '#E0F7FA', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_tarde = workbook.add_format({'bold': True, 'font_color': 'orange', 'bg_color': '#FFF3E0', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_vermelho = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_verde    = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_roxo     = workbook.add_format({'bg_color': '#E6E6FA', 'font_color': '#4B0082', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_cinza    = workbook.add_format({'bg_color': '#D3D3D3', 'font_color': '#000000', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_amarelo  = workbook.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C5700', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_duplicata = workbook.add_format({'bg_color': '#FF0000', 'font_color': '#FFFFFF', 'bold': True, 'align': 'center'})
-                    
-                    ws_data = workbook.add_worksheet('Dados'); ws_data.hide()
-                    ws_data.write_column('A1', HORARIOS_PADRAO)
-                    ws_data.write_column('B1', LISTA_OPCOES_CAIXA)
-                    
-                    fmt_nome = workbook.add_format({'border': 1, 'valign': 'vcenter', 'align': 'left'})
-                    worksheet.write(0, 0, "Nome", fmt_bold); worksheet.set_column(0, 0, 35, None)
+            # O rodízio (com o histórico das semanas anteriores) e a planilha só são montados no clique do download
+            def gerar_planilha_horarios() -> bytes:
+                with cronometro("Excel Mágica: horários (sob demanda)"):
+                    alocacao_auto = gerar_alocacao_semanal(df_filtrado_m, data_ini_m, df_semanas_todas, int(n_semanas_hist))
                     
-                    alocacao_auto = gerar_alocacao_semanal(df_filtrado_m, data_ini_m, df_semanas_todas)
-                    
-                    last_data_row = len(df_template_m)
-                    row_total_m = last_data_row + 1
-                    row_total_t = last_data_row + 2
-                    
-                    for r_idx, row_name in enumerate(df_template_m['Nome']):
-                        row_excel = r_idx + 1
-                        worksheet.write(row_excel, 0, row_name, fmt_nome)
-                        
-                        current_c = 1
+                    linhas = []
+                    for row_name in sorted(df_filtrado_m['nome'].unique()):
+                        linha = [row_name]
                         for i_day in range(7):
                             d_atual = data_ini_m + timedelta(days=i_day)
                             h_val = alocacao_auto.get(row_name, "")
@@ -1087,75 +2172,24 @@ def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Data
                             if status_colab in ["Ferias", "Afastado(a)", "Atestado"]:
                                 h_val = status_colab
                                 c_val = "---"
-                            else:
-                                dia_semana_atual = DIAS_SEMANA_PT[d_atual.weekday()]
-                                if mapa_folga_fixa_m.get(row_name, "") == dia_semana_atual: 
-                                    h_val = "Folga"
-                                    c_val = "---"
-                            
-                            worksheet.write(row_excel, current_c, h_val, fmt_grid); current_c += 1
-                            worksheet.write(row_excel, current_c, c_val, fmt_grid); current_c += 1
-
-                    col_idx = 1
-                    for i in range(7):
-                        d_str = (data_ini_m + timedelta(days=i)).strftime('%d/%m/%Y')
-                        worksheet.write(0, col_idx, d_str, fmt_date_header); worksheet.set_column(col_idx, col_idx, 12, None)
-                        worksheet.data_validation(1, col_idx, last_data_row, col_idx, {'validate': 'list', 'source': '=Dados!$A$1:$A$' + str(len(HORARIOS_PADRAO))})
-                        for h in H_VERMELHO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_vermelho})
-                        for h in H_VERDE: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_verde})
-                        for h in H_ROXO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_roxo})
-                        for h in H_CINZA: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_cinza})
-                        for h in H_AMARELO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_amarelo})
-                        col_idx += 1
-                        
-                        worksheet.write(0, col_idx, "CX", fmt_cx_header); worksheet.set_column(col_idx, col_idx, 10, None)
-                        worksheet.data_validation(1, col_idx, last_data_row, col_idx, {'validate': 'list', 'source': '=Dados!$B$1:$B$' + str(len(LISTA_OPCOES_CAIXA))})
-                        col_idx += 1
-                        
-                    worksheet.write(row_total_m, 0, "Operadoras Manhã", fmt_manha)
-                    worksheet.write(row_total_t, 0, "Operadoras Tarde", fmt_tarde)
-                    
-                    def num_to_col(n):
-                        s = ""
-                        while n >= 0:
-                            s = chr(n % 26 + 65) + s
-                            n = n // 26 - 1
-                        return s
-
-                    current_col = 1
-                    for i in range(7):
-                        letra = num_to_col(current_col)
-                        rng = f"{letra}2:{letra}{last_data_row+1}"
-                        letra_cx = num_to_col(current_col + 1)
-                        rng_cx = f"{letra_cx}2:{letra_cx}{last_data_row+1}"
-                        
-                        lista_h_tarde_op = HORARIOS_TARDE + ["7:30 HRS"]
-                        crit_m = ",".join([f'COUNTIFS({rng}, "{h}", {rng_cx}, "<>Recepção", {rng_cx}, "<>Delivery", {rng_cx}, "<>Magazine", {rng_cx}, "<>Salinha")' for h in HORARIOS_MANHA])
-                        crit_t = ",".join([f'COUNTIFS({rng}, "{h}", {rng_cx}, "<>Recepção", {rng_cx}, "<>Delivery", {rng_cx}, "<>Magazine", {rng_cx}, "<>Salinha")' for h in lista_h_tarde_op])
-                        
-                        rng_abs = f"${letra}$2:${letra}${last_data_row+1}"
-                        rng_cx_abs = f"${letra_cx}$2:${letra_cx}${last_data_row+1}"
-                        crit_cx = f"{letra_cx}2"
-                        crit_h = f"{letra}2"
-                        formula_dup = f'=COUNTIFS({rng_cx_abs}, {crit_cx}, {rng_abs}, {crit_h}) > 1'
-                        worksheet.conditional_format(rng_cx, {'type': 'formula', 'criteria': formula_dup, 'format': fmt_duplicata})
-
-                        if crit_m: worksheet.write_formula(row_total_m, current_col, f"=SUM({crit_m})", fmt_manha)
-                        else: worksheet.write(row_total_m, current_col, 0, fmt_manha)
-
-                        if crit_t: worksheet.write_formula(row_total_t, current_col, f"=SUM({crit_t})", fmt_tarde)
-                        else: worksheet.write(row_total_t, current_col, 0, fmt_tarde)
-                            
-                        current_col += 2
+                            elif mapa_folga_fixa_m.get(row_name, "") == DIAS_SEMANA_PT[d_atual.weekday()]:
+                                h_val = "Folga"
+                                c_val = "---"
+                            linha += [h_val, c_val]
+                        linhas.append(linha)
+                    return gerar_excel_escala(pd.DataFrame(linhas), data_ini_m, "Operador(a) de Caixa")
 
-            except Exception as e: st.error(f"Erro ao gerar Excel: {e}"); return
+            botao_download_sob_demanda("📥 1. Baixar Excel com Horários Inteligentes", gerar_planilha_horarios, "btn_excel_magica", file_name=f"escala_MAGICA_horarios_{data_ini_m.strftime('%d-%m')}.xlsx", mime=MIME_XLSX, type="primary")
 
-            st.download_button(label="📥 1. Baixar Excel com Horários Inteligentes", data=buffer_m.getvalue(), file_name=f"escala_MAGICA_horarios_{data_ini_m.strftime('%d-%m')}.xlsx", mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', type="primary")
+            if st.button("📊 Comparar rodízio com o método anterior", key="btn_comparar_rodizio"):
+                with st.spinner("Calculando..."): df_comparacao = comparar_rodizio(df_filtrado_m, data_ini_m, df_semanas_todas, int(n_semanas_hist))
+                if df_comparacao.empty: st.info("Nenhum operador ativo para comparar.")
+                else: st.dataframe(df_comparacao, hide_index=True, use_container_width=True); st.caption("Menor é melhor: repetição = turnos já feitos no histórico (semana anterior pesa 10). O otimizado troca alguns milissegundos a mais por menos repetição.")
 
     # ---------------- ETAPA 2: ATRIBUIR CAIXAS E DOMINGOS ----------------
     st.markdown("---")
     st.subheader("2️⃣ Atribuir Caixas e Domingos Automaticamente")
-    st.info("Faça o upload da planilha (após seus ajustes manuais se houver). O sistema vai cobrir os buracos dos Domingos (regra 1x1) e distribuir os caixas respeitando as prioridades e SEM REPETIR o mesmo caixa para a pessoa na semana!")
+    st.info("Faça o upload da planilha (após seus ajustes manuais se houver). O sistema vai cobrir os buracos dos Domingos (regra 1x1) e distribuir os caixas respeitando as prioridades e SEM REPETIR o mesmo caixa para a pessoa na semana! Caixas que você já preencheu na planilha são mantidos.")
     
     arquivo_upload_magica = st.file_uploader("Arraste o Excel **com os horários preenchidos** aqui:", type=["xlsx"], key="magica_upload_cx")
     
@@ -1177,6 +2211,10 @@ def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Data
                 try: data_ini_up = datetime.datetime.strptime(datas_cols[0], "%d/%m/%Y").date()
                 except Exception as e: st.error(f"Formato de data inválido na planilha. Erro: {e}"); st.stop()
                     
+                datas_planilha = [datetime.datetime.strptime(c, "%d/%m/%Y").date() for c in datas_cols]
+                domingos_anteriores = [d - timedelta(days=7) for d in datas_planilha if d.weekday() == 6]
+                indice_presenca = montar_indice_presenca(df_semanas_todas, domingos_anteriores)
+                
                 dados_existentes = {}; nomes_validos = []
                 for r_idx, row in df_up.iterrows():
                     nome = row.get('Nome', "")
@@ -1193,136 +2231,31 @@ def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Data
                         if c_val == "nan": c_val = ""
                         
                         if dt.weekday() == 6 and h_val.strip() == "":
-                            trab_passado = trabalhou_na_data(nome, dt - timedelta(days=7), df_semanas_todas)
+                            trab_passado = trabalhou_na_data(nome, dt - timedelta(days=7), indice_presenca)
                             if trab_passado: h_val = "Folga"
                             else: h_val = random.choice(["8:00 HRS", "12:00 HRS"]) 
                                 
                         dados_existentes[(nome, dt)] = {'horario': h_val, 'caixa': c_val}
                         
-                # CADERNINHO INVISÍVEL: MEMÓRIA DA SEMANA PARA NÃO REPETIR CAIXAS
-                historico_semana_cx = {}
-                
-                for col_data in datas_cols:
-                    dt = datetime.datetime.strptime(col_data, "%d/%m/%Y").date()
-                    dia_items = []
-                    for nome in nomes_validos:
-                        h = dados_existentes.get((nome, dt), {}).get('horario', "")
-                        dia_items.append((nome, h))
-                        
-                    alocacao = atribuir_caixas_dia(dia_items, historico_semana_cx)
-                    
-                    for nome in nomes_validos:
-                        if (nome, dt) in dados_existentes:
-                            h_val = dados_existentes[(nome, dt)]['horario']
-                            if h_val in ["Folga", "Ferias", "Atestado", "Afastado(a)"]:
-                                dados_existentes[(nome, dt)]['caixa'] = "---"
-                            else:
-                                dados_existentes[(nome, dt)]['caixa'] = alocacao.get(nome, "")
-                            
-                colunas_f = ['Nome']
-                for i in range(7):
-                    d_str_f = (data_ini_up + timedelta(days=i)).strftime('%d/%m/%Y')
-                    colunas_f.append(d_str_f); colunas_f.append(f"CX_REF_{d_str_f}")
-
-                df_template_f = pd.DataFrame(columns=colunas_f)
-                df_template_f['Nome'] = sorted(nomes_validos)
-                
-                buffer_out = io.BytesIO()
+                # Caixas já preenchidos na planilha são ajustes manuais: ficam travados e o resto da semana se ajusta a eles
+                horarios_semana = {chave: info['horario'] for chave, info in dados_existentes.items()}
+                travados = {chave: info['caixa'] for chave, info in dados_existentes.items()}
+                with cronometro("Escala Mágica: caixas da semana"): alocacao, pendencias, mantidos = atribuir_caixas_semana(horarios_semana, travados, semente=data_ini_up.toordinal())
+                for chave, info in dados_existentes.items(): info['caixa'] = alocacao.get(chave, "")
+                st.session_state['magica_pendencias'] = pendencias
+                st.session_state['magica_travados'] = mantidos
+                linhas = []
+                for nome in sorted(nomes_validos):
+                    linha = [nome]
+                    for i_day in range(7):
+                        info = dados_existentes.get((nome, data_ini_up + timedelta(days=i_day)), {})
+                        linha += [info.get('horario', ""), info.get('caixa', "")]
+                    linhas.append(linha)
                 try:
-                    with pd.ExcelWriter(buffer_out, engine='xlsxwriter') as writer:
-                        df_template_f.to_excel(writer, index=False, sheet_name='Escala')
-                        workbook = writer.book; worksheet = writer.sheets['Escala']
-                        worksheet.hide_gridlines(2)
-                        
-                        fmt_grid = workbook.add_format({'border': 1, 'align': 'center', 'valign': 'vcenter'})
-                        fmt_bold = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#D3D3D3', 'border': 1})
-                        fmt_date_header = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#DDEBF7', 'border': 1, 'font_color': 'black'}) 
-                        fmt_cx_header = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#FFF2CC', 'border': 1, 'font_color': 'black'})
-                        fmt_manha = workbook.add_format({'bold': True, 'font_color': 'blue', 'bg_color': '#E0F7FA', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_tarde = workbook.add_format({'bold': True, 'font_color': 'orange', 'bg_color': '#FFF3E0', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_vermelho = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_verde    = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_roxo     = workbook.add_format({'bg_color': '#E6E6FA', 'font_color': '#4B0082', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_cinza    = workbook.add_format({'bg_color': '#D3D3D3', 'font_color': '#000000', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_amarelo  = workbook.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C5700', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                        fmt_duplicata = workbook.add_format({'bg_color': '#FF0000', 'font_color': '#FFFFFF', 'bold': True, 'align': 'center'})
-                        
-                        ws_data = workbook.add_worksheet('Dados'); ws_data.hide()
-                        ws_data.write_column('A1', HORARIOS_PADRAO)
-                        ws_data.write_column('B1', LISTA_OPCOES_CAIXA)
-                        
-                        fmt_nome = workbook.add_format({'border': 1, 'valign': 'vcenter', 'align': 'left'})
-                        worksheet.write(0, 0, "Nome", fmt_bold); worksheet.set_column(0, 0, 35, None)
-                        
-                        last_data_row = len(df_template_f)
-                        row_total_m = last_data_row + 1
-                        row_total_t = last_data_row + 2
-                        
-                        for r_idx, row_name in enumerate(df_template_f['Nome']):
-                            row_excel = r_idx + 1
-                            worksheet.write(row_excel, 0, row_name, fmt_nome)
-                            current_c = 1
-                            for i_day in range(7):
-                                d_atual = data_ini_up + timedelta(days=i_day)
-                                info = dados_existentes.get((row_name, d_atual), {})
-                                worksheet.write(row_excel, current_c, info.get('horario', ""), fmt_grid); current_c += 1
-                                worksheet.write(row_excel, current_c, info.get('caixa', ""), fmt_grid); current_c += 1
-
-                        col_idx = 1
-                        for i in range(7):
-                            d_str = (data_ini_up + timedelta(days=i)).strftime('%d/%m/%Y')
-                            worksheet.write(0, col_idx, d_str, fmt_date_header); worksheet.set_column(col_idx, col_idx, 12, None)
-                            worksheet.data_validation(1, col_idx, last_data_row, col_idx, {'validate': 'list', 'source': '=Dados!$A$1:$A$' + str(len(HORARIOS_PADRAO))})
-                            for h in H_VERMELHO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_vermelho})
-                            for h in H_VERDE: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_verde})
-                            for h in H_ROXO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_roxo})
-                            for h in H_CINZA: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_cinza})
-                            for h in H_AMARELO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_amarelo})
-                            col_idx += 1
-                            
-                            worksheet.write(0, col_idx, "CX", fmt_cx_header); worksheet.set_column(col_idx, col_idx, 10, None)
-                            worksheet.data_validation(1, col_idx, last_data_row, col_idx, {'validate': 'list', 'source': '=Dados!$B$1:$B$' + str(len(LISTA_OPCOES_CAIXA))})
-                            col_idx += 1
-                            
-                        worksheet.write(row_total_m, 0, "Operadoras Manhã", fmt_manha)
-                        worksheet.write(row_total_t, 0, "Operadoras Tarde", fmt_tarde)
-                        
-                        def num_to_col(n):
-                            s = ""
-                            while n >= 0:
-                                s = chr(n % 26 + 65) + s
-                                n = n // 26 - 1
-                            return s
-
-                        current_col = 1
-                        for i in range(7):
-                            letra = num_to_col(current_col)
-                            rng = f"{letra}2:{letra}{last_data_row+1}"
-                            letra_cx = num_to_col(current_col + 1)
-                            rng_cx = f"{letra_cx}2:{letra_cx}{last_data_row+1}"
-                            
-                            lista_h_tarde_op = HORARIOS_TARDE + ["7:30 HRS"]
-                            crit_m = ",".join([f'COUNTIFS({rng}, "{h}", {rng_cx}, "<>Recepção", {rng_cx}, "<>Delivery", {rng_cx}, "<>Magazine", {rng_cx}, "<>Salinha")' for h in HORARIOS_MANHA])
-                            crit_t = ",".join([f'COUNTIFS({rng}, "{h}", {rng_cx}, "<>Recepção", {rng_cx}, "<>Delivery", {rng_cx}, "<>Magazine", {rng_cx}, "<>Salinha")' for h in lista_h_tarde_op])
-                            
-                            rng_abs = f"${letra}$2:${letra}${last_data_row+1}"
-                            rng_cx_abs = f"${letra_cx}$2:${letra_cx}${last_data_row+1}"
-                            crit_cx = f"{letra_cx}2"
-                            crit_h = f"{letra}2"
-                            formula_dup = f'=COUNTIFS({rng_cx_abs}, {crit_cx}, {rng_abs}, {crit_h}) > 1'
-                            worksheet.conditional_format(rng_cx, {'type': 'formula', 'criteria': formula_dup, 'format': fmt_duplicata})
-
-                            if crit_m: worksheet.write_formula(row_total_m, current_col, f"=SUM({crit_m})", fmt_manha)
-                            else: worksheet.write(row_total_m, current_col, 0, fmt_manha)
-
-                            if crit_t: worksheet.write_formula(row_total_t, current_col, f"=SUM({crit_t})", fmt_tarde)
-                            else: worksheet.write(row_total_t, current_col, 0, fmt_tarde)
-                                
-                            current_col += 2
-                            
+                    with cronometro("Excel Mágica: caixas"): excel_bytes = gerar_excel_escala(pd.DataFrame(linhas), data_ini_up, "Operador(a) de Caixa")
                 except Exception as e: st.error(f"Erro ao gerar Excel: {e}"); return
                 
-                st.session_state['magica_buffer'] = buffer_out.getvalue()
+                st.session_state['magica_buffer'] = excel_bytes
                 st.session_state['magica_filename'] = f"escala_FINALIZADA_{data_ini_up.strftime('%d-%m')}.xlsx"
                 st.success("✅ Caixas processados com sucesso!")
                 
@@ -1335,10 +2268,20 @@ def aba_escala_magica(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Data
             type="primary"
         )
         st.info("⬆️ Faça o download deste arquivo e suba na aba tradicional **'📤 Importar / Baixar'** para salvar tudo no banco de dados!")
+        mantidos = st.session_state.get('magica_travados', [])
+        if mantidos:
+            with st.expander(f"🔒 {len(mantidos)} caixa(s) já preenchido(s) na planilha foram mantidos sem alteração"):
+                for nome, dt, cx in mantidos: st.write(f"- {dt.strftime('%d/%m')}: {nome} → caixa {cx}")
+                st.caption("Para o sistema redistribuir esses dias, apague o caixa na planilha antes de subir.")
+        pendencias = st.session_state.get('magica_pendencias', [])
+        if pendencias:
+            with st.expander(f"⚠️ {len(pendencias)} regra(s) que não deu para cumprir"):
+                for p in pendencias: st.write(f"- {p}")
 
 
 # --- ABA DE IMPORTAÇÃO PADRÃO (LIMPA, APENAS TEMPLATE MANUAL) ---
 @st.fragment
+@cronometrado("Aba Importar Excel (rerun)")
 def aba_importar_excel(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.DataFrame):
     st.subheader("📤 Importar / Baixar Escala (Excel)")
     st.info("Utilize esta aba para baixar o modelo em branco (ou backup) e subir a escala manual pronta para o banco de dados.")
@@ -1357,7 +2300,7 @@ def aba_importar_excel(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Dat
         data_ini = semana_info['data_inicio']
         id_semana = semana_info['id']
         
-        df_dados_db = carregar_escala_semana_por_id(id_semana)
+        escala = carregar_escala_semana(id_semana)
         
         df_filtrado = df_colaboradores.copy()
         if 'funcao' in df_filtrado.columns:
@@ -1369,195 +2312,45 @@ def aba_importar_excel(df_colaboradores: pd.DataFrame, df_semanas_ativas: pd.Dat
         if df_filtrado.empty:
             st.error(f"Não há colaboradores com função '{funcao_selecionada}'.")
         else:
-            colunas = ['Nome']
-            for i in range(7):
-                d_str = (data_ini + timedelta(days=i)).strftime('%d/%m/%Y')
-                colunas.append(d_str)
-                if funcao_selecionada == "Operador(a) de Caixa":
-                     colunas.append(f"CX_REF_{d_str}")
-                elif funcao_selecionada == "Empacotador(a)":
-                     colunas.append(f"TAREFA_REF_{d_str}")
-
-            df_template = pd.DataFrame(columns=colunas)
-            df_template['Nome'] = sorted(df_filtrado['nome'].unique())
-            
-            dados_existentes = {}
-            if not df_dados_db.empty:
-                df_db_filt = df_dados_db[df_dados_db['nome'].isin(df_filtrado['nome'])]
-                for _, row_db in df_db_filt.iterrows():
-                    d_db = pd.to_datetime(row_db['data']).date()
-                    dados_existentes[(row_db['nome'], d_db)] = {
-                        'horario': row_db['horario'],
-                        'caixa': row_db['numero_caixa']
-                    }
-            
-            buffer = io.BytesIO()
-            try:
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df_template.to_excel(writer, index=False, sheet_name='Escala')
-                    workbook = writer.book
-                    worksheet = writer.sheets['Escala']
-
-                    worksheet.hide_gridlines(2)
-                    
-                    fmt_grid = workbook.add_format({'border': 1, 'align': 'center', 'valign': 'vcenter'})
-                    fmt_bold = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#D3D3D3', 'border': 1})
-                    fmt_date_header = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#DDEBF7', 'border': 1, 'font_color': 'black'}) 
-                    fmt_cx_header = workbook.add_format({'bold': True, 'align': 'center', 'bg_color': '#FFF2CC', 'border': 1, 'font_color': 'black'})
-                    
-                    fmt_manha = workbook.add_format({'bold': True, 'font_color': 'blue', 'bg_color': '#E0F7FA', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_tarde = workbook.add_format({'bold': True, 'font_color': 'orange', 'bg_color': '#FFF3E0', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    
-                    fmt_vermelho = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_verde    = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_roxo     = workbook.add_format({'bg_color': '#E6E6FA', 'font_color': '#4B0082', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_cinza    = workbook.add_format({'bg_color': '#D3D3D3', 'font_color': '#000000', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    fmt_amarelo  = workbook.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C5700', 'align': 'center', 'valign': 'vcenter', 'border': 1})
-                    
-                    fmt_duplicata = workbook.add_format({'bg_color': '#FF0000', 'font_color': '#FFFFFF', 'bold': True, 'align': 'center'})
-
-                    ws_data = workbook.add_worksheet('Dados'); ws_data.hide()
-                    ws_data.write_column('A1', HORARIOS_PADRAO)
-                    ws_data.write_column('B1', LISTA_OPCOES_CAIXA)
-                    ws_data.write_column('C1', LISTA_TAREFAS_EMPACOTADOR)
-                    
-                    fmt_nome = workbook.add_format({'border': 1, 'valign': 'vcenter', 'align': 'left'})
-                    worksheet.write(0, 0, "Nome", fmt_bold)
-                    
-                    is_op = (funcao_selecionada == "Operador(a) de Caixa")
-                    is_emp = (funcao_selecionada == "Empacotador(a)")
-                    
-                    width_name = 35 if is_op else 30
-                    worksheet.set_column(0, 0, width_name, None)
-                    
-                    col_idx = 1
-                    last_data_row = len(df_template) 
-                    row_total_m = last_data_row + 1
-                    row_total_t = last_data_row + 2
-                    
-                    for r_idx, row_name in enumerate(df_template['Nome']):
-                        row_excel = r_idx + 1
-                        worksheet.write(row_excel, 0, row_name, fmt_nome)
-                        
-                        current_c = 1
+            def gerar_modelo_manual() -> bytes:
+                with cronometro("Excel Importar: modelo (sob demanda)"):
+                    linhas = []
+                    tem_ref = funcao_selecionada in FUNCOES_COM_COLUNA_REF
+                    for nome in sorted(df_filtrado['nome'].unique()):
+                        status_colab = mapa_status.get(nome, "Ativo"); folga_fixa_colab = mapa_folga_fixa.get(nome, "")
+                        linha = [nome]
                         for i_day in range(7):
                             d_atual = data_ini + timedelta(days=i_day)
-                            info = dados_existentes.get((row_name, d_atual), {})
-                            
-                            h_val = info.get('horario', "")
-                            c_val = info.get('caixa', "")
-                            
-                            dia_semana_atual = DIAS_SEMANA_PT[d_atual.weekday()]
-                            folga_fixa_colab = mapa_folga_fixa.get(row_name, "")
-                            status_colab = mapa_status.get(row_name, "Ativo")
-                            
-                            if status_colab in ["Ferias", "Afastado(a)", "Atestado"]:
-                                h_val = status_colab
-                                c_val = "---"
-                            elif folga_fixa_colab == dia_semana_atual:
-                                h_val = "Folga"
-                                c_val = "---"
-                            
-                            worksheet.write(row_excel, current_c, h_val, fmt_grid)
-                            current_c += 1
-                            
-                            is_recep = (funcao_selecionada == "Recepção")
-                            
-                            if is_op or is_emp or is_recep:
-                                worksheet.write(row_excel, current_c, c_val, fmt_grid)
-                                current_c += 1
-
-                    col_idx = 1
-                    for i in range(7):
-                        d_str = (data_ini + timedelta(days=i)).strftime('%d/%m/%Y')
-                        
-                        worksheet.write(0, col_idx, d_str, fmt_date_header)
-                        worksheet.set_column(col_idx, col_idx, 12, None)
-                        
-                        worksheet.data_validation(1, col_idx, last_data_row, col_idx, {'validate': 'list', 'source': '=Dados!$A$1:$A$' + str(len(HORARIOS_PADRAO))})
-                        
-                        for h in H_VERMELHO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_vermelho})
-                        for h in H_VERDE: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_verde})
-                        for h in H_ROXO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_roxo})
-                        for h in H_CINZA: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_cinza})
-                        for h in H_AMARELO: worksheet.conditional_format(1, col_idx, last_data_row, col_idx, {'type': 'cell', 'criteria': 'equal to', 'value': f'"{h}"', 'format': fmt_amarelo})
-
-                        col_idx += 1
-                        
-                        is_recep = (funcao_selecionada == "Recepção")
-                        
-                        if is_op or is_emp or is_recep:
-                            header_title = "CX" if (is_op or is_recep) else "TAREFAS"
-                            valid_list = '=Dados!$B$1:$B$' + str(len(LISTA_OPCOES_CAIXA)) if (is_op or is_recep) else '=Dados!$C$1:$C$' + str(len(LISTA_TAREFAS_EMPACOTADOR))
-                            
-                            worksheet.write(0, col_idx, header_title, fmt_cx_header)
-                            worksheet.set_column(col_idx, col_idx, 10, None)
-                            worksheet.data_validation(1, col_idx, last_data_row, col_idx, {'validate': 'list', 'source': valid_list})
-                            col_idx += 1
-                    
-                    mapa_nomes = {"Operador(a) de Caixa": "Operadoras", "Empacotador(a)": "Empacotadores", "Fiscal de Caixa": "Fiscais", "Recepção": "Recepção"}
-                    nome_cargo = mapa_nomes.get(funcao_selecionada, funcao_selecionada)
-                    
-                    worksheet.write(row_total_m, 0, f"{nome_cargo} Manhã", fmt_manha)
-                    worksheet.write(row_total_t, 0, f"{nome_cargo} Tarde", fmt_tarde)
-                    
-                    step = 2 if (is_op or is_emp or is_recep) else 1
-                    
-                    def num_to_col(n):
-                        s = ""
-                        while n >= 0:
-                            s = chr(n % 26 + 65) + s
-                            n = n // 26 - 1
-                        return s
-
-                    total_data_cols = 7
-                    current_col = 1
-                    for i in range(total_data_cols):
-                        letra = num_to_col(current_col)
-                        rng = f"{letra}2:{letra}{last_data_row+1}"
-                        
-                        if is_op:
-                            letra_cx = num_to_col(current_col + 1)
-                            rng_cx = f"{letra_cx}2:{letra_cx}{last_data_row+1}"
-                            
-                            lista_h_tarde_op = HORARIOS_TARDE + ["7:30 HRS"]
-                            
-                            crit_m = ",".join([f'COUNTIFS({rng}, "{h}", {rng_cx}, "<>Recepção", {rng_cx}, "<>Delivery", {rng_cx}, "<>Magazine", {rng_cx}, "<>Salinha")' for h in HORARIOS_MANHA])
-                            crit_t = ",".join([f'COUNTIFS({rng}, "{h}", {rng_cx}, "<>Recepção", {rng_cx}, "<>Delivery", {rng_cx}, "<>Magazine", {rng_cx}, "<>Salinha")' for h in lista_h_tarde_op])
-                            
-                            rng_abs = f"${letra}$2:${letra}${last_data_row+1}"
-                            rng_cx_abs = f"${letra_cx}$2:${letra_cx}${last_data_row+1}"
-                            crit_cx = f"{letra_cx}2"
-                            crit_h = f"{letra}2"
-                            formula_dup = f'=COUNTIFS({rng_cx_abs}, {crit_cx}, {rng_abs}, {crit_h}) > 1'
-                            worksheet.conditional_format(rng_cx, {'type': 'formula', 'criteria': formula_dup, 'format': fmt_duplicata})
-
-                        else:
-                            crit_m = ",".join([f'COUNTIF({rng}, "{h}")' for h in HORARIOS_MANHA])
-                            crit_t = ",".join([f'COUNTIF({rng}, "{h}")' for h in HORARIOS_TARDE])
-                        
-                        if crit_m:
-                            worksheet.write_formula(row_total_m, current_col, f"=SUM({crit_m})", fmt_manha)
-                        else:
-                            worksheet.write(row_total_m, current_col, 0, fmt_manha)
-
-                        if crit_t:
-                            worksheet.write_formula(row_total_t, current_col, f"=SUM({crit_t})", fmt_tarde)
-                        else:
-                            worksheet.write(row_total_t, current_col, 0, fmt_tarde)
-                            
-                        current_col += step
-
-            except Exception as e: st.error(f"Erro ao gerar Excel: {e}"); return
-
-            st.download_button(label="📥 Baixar Planilha (Modelo Manual)", data=buffer.getvalue(), file_name=f"escala_{funcao_selecionada.split()[0]}_{data_ini.strftime('%d-%m')}.xlsx", mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', type="secondary")
+                            h_val, c_val = escala.celula(nome, d_atual)
+                            if status_colab in ["Ferias", "Afastado(a)", "Atestado"]: h_val, c_val = status_colab, "---"
+                            elif folga_fixa_colab == DIAS_SEMANA_PT[d_atual.weekday()]: h_val, c_val = "Folga", "---"
+                            linha += [h_val, c_val] if tem_ref else [h_val]
+                        linhas.append(linha)
+                    return gerar_excel_escala(pd.DataFrame(linhas), data_ini, funcao_selecionada)
+
+            botao_download_sob_demanda("📥 Baixar Planilha (Modelo Manual)", gerar_modelo_manual, "btn_excel_modelo", file_name=f"escala_{funcao_selecionada.split()[0]}_{data_ini.strftime('%d-%m')}.xlsx", mime=MIME_XLSX, type="secondary")
             
             st.markdown("---")
             arquivo_upload = st.file_uploader("Arraste o Excel preenchido para Salvar:", type=["xlsx"], key="upl_excel_uniq")
             if arquivo_upload is not None:
-                if st.button("🚀 Processar e Salvar no Banco", type="primary", key="btn_proc_excel"):
-                    if salvar_escala_via_excel(pd.read_excel(arquivo_upload), data_ini, id_semana):
-                        st.success("Importado com sucesso!"); time.sleep(2); st.cache_data.clear(); st.rerun()
+                try: df_longo = analisar_planilha_escala(arquivo_upload.getvalue(), data_ini)
+                except Exception as e: st.error(f"Erro ao processar Excel: {e}"); return
+                if df_longo.empty: st.warning("Nenhum colaborador encontrado na planilha."); return
+                if not exibir_validacao_planilha(df_longo): return
+
+                df_alteracoes = diferenca_escala(df_longo, escala)
+                if df_alteracoes.empty: st.success(f"✅ Nenhuma alteração: as {len(df_longo)} células da planilha já estão salvas."); return
+
+                st.markdown(f"##### 🔍 {len(df_alteracoes)} célula(s) alterada(s) de {len(df_longo)} na planilha")
+                df_preview = df_alteracoes.assign(data=df_alteracoes['data'].map(lambda d: f"{d.strftime('%d/%m')} {DIAS_SEMANA_PT[d.weekday()][:3]}"))
+                df_preview = df_preview[['nome', 'data', 'horario_atual', 'horario', 'caixa_atual', 'caixa']]
+                df_preview.columns = ['Nome', 'Dia', 'Horário Antes', 'Horário Depois', 'Caixa Antes', 'Caixa Depois']
+                st.dataframe(df_preview, hide_index=True, use_container_width=True)
+                st.download_button("📄 Baixar Log de Alterações (CSV)", data=df_preview.to_csv(index=False).encode('utf-8-sig'), file_name=f"alteracoes_{data_ini.strftime('%d-%m')}.csv", mime="text/csv", key="btn_log_excel")
+
+                if st.button(f"🚀 Salvar {len(df_alteracoes)} Alteração(ões) no Banco", type="primary", key="btn_proc_excel"):
+                    if salvar_escala_via_excel(df_longo, id_semana):
+                        st.success("Importado com sucesso!"); time.sleep(2); st.rerun()
 
 @st.fragment
 def aba_gerenciar_colaboradores(df_colaboradores: pd.DataFrame):
@@ -1565,19 +2358,16 @@ def aba_gerenciar_colaboradores(df_colaboradores: pd.DataFrame):
     st.markdown("##### ✏️ Classificar / Editar Colaboradores Existentes")
     
     if not df_colaboradores.empty:
-        mapa_original = {row['nome']: row['funcao'] for _, row in df_colaboradores.iterrows()}
-        mapa_social = {row['nome']: row['nome_social'] for _, row in df_colaboradores.iterrows()}
-        mapa_folga = {row['nome']: row.get('folga_fixa', '') for _, row in df_colaboradores.iterrows()}
-        mapa_status = {row['nome']: row.get('status', 'Ativo') for _, row in df_colaboradores.iterrows()}
-        
         df_editor = df_colaboradores.copy()
+        try: colunas_banco = colunas_colaboradores()
+        except Exception: colunas_banco = frozenset(COLUNAS_OPCIONAIS['colaboradores'])
         
         col_config = {
             "nome": st.column_config.TextColumn("Nome", disabled=True),
-            "funcao": st.column_config.SelectboxColumn("Função (Cargo)", options=FUNCOES_LOJA, required=True, width="medium"),
-            "nome_social": st.column_config.TextColumn("Nome Social (Para Impressão)", width="medium"),
-            "folga_fixa": st.column_config.SelectboxColumn("Folga Fixa", options=[""] + DIAS_SEMANA_PT, width="medium"),
-            "status": st.column_config.SelectboxColumn("Status Atual", options=["Ativo", "Ferias", "Afastado(a)", "Atestado"], width="medium")
+            "funcao": st.column_config.SelectboxColumn("Função (Cargo)", options=FUNCOES_LOJA, required=True, width="medium", disabled='funcao' not in colunas_banco),
+            "nome_social": st.column_config.TextColumn("Nome Social (Para Impressão)", width="medium", disabled='nome_social' not in colunas_banco),
+            "folga_fixa": st.column_config.SelectboxColumn("Folga Fixa", options=[""] + DIAS_SEMANA_PT, width="medium", disabled='folga_fixa' not in colunas_banco),
+            "status": st.column_config.SelectboxColumn("Status Atual", options=["Ativo", "Ferias", "Afastado(a)", "Atestado"], width="medium", disabled='status' not in colunas_banco)
         }
         
         df_editado = st.data_editor(
@@ -1589,26 +2379,10 @@ def aba_gerenciar_colaboradores(df_colaboradores: pd.DataFrame):
         )
         
         if st.button("💾 Salvar Alterações"):
-            barra = st.progress(0, text="Atualizando dados...")
-            total = len(df_editado)
-            contador_updates = 0
-            
-            for index, row in df_editado.iterrows():
-                nome = row['nome']
-                nova_funcao = row['funcao']
-                novo_social = row['nome_social']
-                nova_folga = row['folga_fixa']
-                novo_status = row['status']
-                
-                if nova_funcao != mapa_original.get(nome, "") or novo_social != mapa_social.get(nome, "") or nova_folga != mapa_folga.get(nome, "") or novo_status != mapa_status.get(nome, ""):
-                    atualizar_dados_colaborador(nome, nova_funcao, novo_social, nova_folga, novo_status)
-                    contador_updates += 1
-                if index % 5 == 0: barra.progress((index+1)/total)
-            
-            barra.empty()
-            if contador_updates > 0: st.success(f"{contador_updates} colaboradores atualizados!")
-            else: st.info("Nenhuma alteração.")
-            time.sleep(1); st.cache_data.clear(); st.rerun()
+            df_alterados = colaboradores_alterados(df_editor, df_editado)
+            if df_alterados.empty: st.info("Nenhuma alteração.")
+            elif atualizar_colaboradores_lote(df_alterados): st.success(f"{len(df_alterados)} colaboradores atualizados!")
+            time.sleep(1); st.rerun()
     else:
         st.info("Sem colaboradores cadastrados.")
 
@@ -1622,7 +2396,6 @@ def aba_gerenciar_colaboradores(df_colaboradores: pd.DataFrame):
             if st.button("Adicionar", use_container_width=True):
                 if nome_novo: 
                     adicionar_colaborador(nome_novo, funcao_novo)
-                    st.cache_data.clear()
                     st.success("Adicionado!")
                     time.sleep(1)
                     st.rerun()
@@ -1635,7 +2408,6 @@ def aba_gerenciar_colaboradores(df_colaboradores: pd.DataFrame):
                 if st.button("Remover Selecionados", type="secondary", use_container_width=True):
                     if rem: 
                         remover_colaboradores(rem)
-                        st.cache_data.clear()
                         st.success("Removido!")
                         time.sleep(1)
                         st.rerun()
@@ -1646,60 +2418,64 @@ def aba_gerenciar_pedidos():
     st.subheader("📌 Gerenciar Pedidos e Solicitações")
     st.info("Visualize os pedidos das operadoras e atualize o status. Pedidos 'Concluídos' são arquivados automaticamente.")
     
-    df_pedidos = carregar_pedidos()
+    mostrar_arquivados = st.toggle("📂 Mostrar APENAS pedidos arquivados (Concluídos)", value=False)
+    desde = ate = None
+    if mostrar_arquivados:
+        periodo = st.date_input("Período:", value=(date.today() - timedelta(days=30), date.today()), format="DD/MM/YYYY", key="periodo_pedidos")
+        if isinstance(periodo, (tuple, list)) and len(periodo) == 2: desde, ate = periodo
+    status_filtro = 'Concluido' if mostrar_arquivados else 'Pendente'
     
-    if not df_pedidos.empty:
-        df_pedidos['created_at'] = pd.to_datetime(df_pedidos['created_at']).dt.strftime('%d/%m/%Y %H:%M')
-        
-        mostrar_arquivados = st.toggle("📂 Mostrar APENAS pedidos arquivados (Concluídos)", value=False)
-        
+    # Cursores das páginas já abertas nesta visão; mudar o filtro volta para a primeira página
+    forma = (status_filtro, desde, ate)
+    if st.session_state.get('pedidos_forma') != forma: st.session_state['pedidos_forma'] = forma; st.session_state['pedidos_cursores'] = [None]
+    paginas = [carregar_pedidos(status_filtro, desde, ate, cursor) for cursor in st.session_state['pedidos_cursores']]
+    df_pedidos = pd.concat([p for p in paginas if not p.empty] or [pd.DataFrame()], ignore_index=True)
+    if not df_pedidos.empty: df_pedidos = df_pedidos.drop_duplicates('id')
+    proximo = proximo_cursor_pedidos(paginas[-1])
+    
+    df_editor = df_pedidos.copy()
+    if not df_editor.empty: df_editor['created_at'] = pd.to_datetime(df_editor['created_at']).dt.strftime('%d/%m/%Y %H:%M')
+    
+    if df_editor.empty:
         if mostrar_arquivados:
-            df_editor = df_pedidos[df_pedidos['status'] == 'Concluido'].copy()
+            st.success("📂 Nenhum pedido arquivado encontrado.")
         else:
-            df_editor = df_pedidos[df_pedidos['status'] == 'Pendente'].copy()
-            
-        if df_editor.empty:
-            if mostrar_arquivados:
-                st.success("📂 Nenhum pedido arquivado encontrado.")
-            else:
-                st.success("🎉 Nenhum pedido pendente no momento!")
-        else:
-            edited_df = st.data_editor(
-                df_editor[['id', 'created_at', 'nome', 'descricao', 'status']],
-                column_config={
-                    "id": None, 
-                    "created_at": st.column_config.TextColumn("Data do Pedido", disabled=True),
-                    "nome": st.column_config.TextColumn("Nome", disabled=True),
-                    "descricao": st.column_config.TextColumn("Pedido/Solicitação", disabled=True, width="large"),
-                    "status": st.column_config.SelectboxColumn(
-                        "Status",
-                        options=["Pendente", "Concluido"],
-                        required=True,
-                        width="medium"
-                    )
-                },
-                hide_index=True,
-                use_container_width=True,
-                num_rows="fixed",
-                key="editor_pedidos"
-            )
-            
-            if st.button("💾 Salvar Status dos Pedidos", type="primary"):
-                count = 0
-                for index, row in edited_df.iterrows():
-                    original_status = df_pedidos.loc[df_pedidos['id'] == row['id'], 'status'].values[0]
-                    if row['status'] != original_status:
-                        if atualizar_status_pedido(row['id'], row['status']):
-                            count += 1
-                if count > 0:
-                    st.success(f"{count} pedidos atualizados!")
-                    time.sleep(1.5)
-                    st.cache_data.clear()
-                    st.rerun()
-                else:
-                    st.info("Nenhuma alteração detectada.")
+            st.success("🎉 Nenhum pedido pendente no momento!")
     else:
-        st.info("Nenhum pedido encontrado.")
+        edited_df = st.data_editor(
+            df_editor[['id', 'created_at', 'nome', 'descricao', 'status']],
+            column_config={
+                "id": None, 
+                "created_at": st.column_config.TextColumn("Data do Pedido", disabled=True),
+                "nome": st.column_config.TextColumn("Nome", disabled=True),
+                "descricao": st.column_config.TextColumn("Pedido/Solicitação", disabled=True, width="large"),
+                "status": st.column_config.SelectboxColumn(
+                    "Status",
+                    options=["Pendente", "Concluido"],
+                    required=True,
+                    width="medium"
+                )
+            },
+            hide_index=True,
+            use_container_width=True,
+            num_rows="fixed",
+            key="editor_pedidos"
+        )
+        
+        if st.button("💾 Salvar Status dos Pedidos", type="primary"):
+            status_original = df_pedidos.set_index('id')['status']
+            status_editado = edited_df.set_index('id')['status']
+            alterados = status_editado[status_editado != status_original.reindex(status_editado.index)]
+            count = atualizar_status_pedidos(alterados) if not alterados.empty else 0
+            if count > 0:
+                st.success(f"{count} pedidos atualizados!")
+                time.sleep(1.5)
+                st.rerun()
+            else:
+                st.info("Nenhuma alteração detectada.")
+        
+        if proximo is not None and st.button(f"⬇️ Carregar mais {TAMANHO_PAGINA_PEDIDOS} pedidos", key="btn_mais_pedidos"):
+            st.session_state['pedidos_cursores'].append(proximo); st.rerun()
 
 # --- ABA DE ESCALA DIÁRIA (IMPRESSÃO ESTILO FOTO - PRETO E BRANCO) ---
 @st.fragment
@@ -1728,31 +2504,9 @@ def aba_escala_diaria_impressao(df_colaboradores: pd.DataFrame, df_semanas_ativa
     with col_cor:
         cor_tema = st.color_picker("Cor do Tema", "#000000")
 
-    df_full = carregar_escala_semana_por_id(id_semana)
-    df_dia = df_full[pd.to_datetime(df_full['data']).dt.date == data_selecionada].copy()
-    if df_dia.empty: df_dia = pd.DataFrame(columns=['nome', 'funcao', 'horario', 'numero_caixa'])
-
-    df_ops_base = df_colaboradores[df_colaboradores['funcao'].isin(['Operador(a) de Caixa', 'Recepção'])]
-    df_emp_base = df_colaboradores[df_colaboradores['funcao'] == 'Empacotador(a)']
-
-    df_ops_final = df_ops_base.merge(df_dia[['nome', 'horario', 'numero_caixa']], on='nome', how='left').fillna("")
-    df_emp_final = df_emp_base.merge(df_dia[['nome', 'horario', 'numero_caixa']], on='nome', how='left').fillna("")
-
-    df_ops_final = df_ops_final.sort_values('nome')
-    df_emp_final = df_emp_final.sort_values('nome')
-
-    if 'nome_social' not in df_ops_final.columns: df_ops_final['nome_social'] = ""
-    if 'nome_social' not in df_emp_final.columns: df_emp_final['nome_social'] = ""
-
-    df_ops_final['nome_impressao'] = df_ops_final.apply(
-        lambda row: row['nome_social'] if pd.notna(row['nome_social']) and str(row['nome_social']).strip() != "" else row['nome'], 
-        axis=1
-    )
-    
-    df_emp_final['nome_impressao'] = df_emp_final.apply(
-        lambda row: row['nome_social'] if pd.notna(row['nome_social']) and str(row['nome_social']).strip() != "" else row['nome'], 
-        axis=1
-    )
+    escala = carregar_escala_semana(id_semana)
+    pre_carregar_semanas_vizinhas(id_semana)
+    df_ops_final, df_emp_final = preparar_dia_impressao(escala, df_colaboradores, data_selecionada)
 
     c1, c2 = st.columns(2)
     with c1:
@@ -1783,17 +2537,66 @@ def aba_escala_diaria_impressao(df_colaboradores: pd.DataFrame, df_semanas_ativa
     st.markdown("---")
     
     if st.button("🖨️ Gerar Impressão", type="primary"):
-        html_content = gerar_html_layout_exato(df_ops_edited, df_emp_edited, data_selecionada.strftime('%d/%m/%Y'), dia_semana_nome, cor_tema)
+        with cronometro("Impressão: folha do dia"): html_content = gerar_html_layout_exato(df_ops_edited, df_emp_edited, data_selecionada.strftime('%d/%m/%Y'), dia_semana_nome, cor_tema)
         b64 = base64.b64encode(html_content.encode('utf-8')).decode()
-        st.markdown(f'<a href="data:text/html;charset=utf-8;base64,{b64}" download="escala_diaria_{data_selecionada.strftime("%d_%m")}.html" style="background-color:#0068c9;color:white;padding:10px 20px;text-decoration:none;border-radius:5px;font-weight:bold;">📥 Baixar Arquivo de Impressão</a>', unsafe_allow_html=True)
+        c_pdf, c_html = st.columns(2)
+        with c_pdf:
+            try: st.download_button("📄 Baixar PDF para Impressão", data=gerar_pdf_layout_exato(df_ops_edited, df_emp_edited, data_selecionada.strftime('%d/%m/%Y'), dia_semana_nome, cor_tema), file_name=f"escala_diaria_{data_selecionada.strftime('%d_%m')}.pdf", mime="application/pdf", type="primary")
+            except FileNotFoundError as e: st.error(str(e))
+        with c_html: st.markdown(f'<a href="data:text/html;charset=utf-8;base64,{b64}" download="escala_diaria_{data_selecionada.strftime("%d_%m")}.html" style="background-color:#0068c9;color:white;padding:10px 20px;text-decoration:none;border-radius:5px;font-weight:bold;">📥 Baixar Arquivo de Impressão</a>', unsafe_allow_html=True)
         with st.expander("Pré-visualização"): st.components.v1.html(html_content, height=600, scrolling=True)
 
+    st.markdown("---")
+    st.markdown("##### 🗓️ Imprimir a Semana Inteira")
+    st.caption("Gera as 7 folhas de uma vez com os dados salvos da semana (as edições de nome feitas acima valem só para a impressão do dia).")
+    cores_semana = [cor_tema] * 7
+    if st.toggle("🎨 Usar uma cor diferente por dia", value=False, key="toggle_cores_semana"):
+        cols_cor = st.columns(7)
+        for i in range(7):
+            with cols_cor[i]: cores_semana[i] = st.color_picker(DIAS_SEMANA_PT[i][:3], cor_tema, key=f"cor_semana_{i}")
+    formato = st.radio("Formato:", ["📄 PDF", "🌐 HTML (uma página por dia)", "📦 ZIP (um arquivo por dia)"], horizontal=True, key="radio_formato_semana")
+
+    if st.button("🖨️ Gerar Semana Completa", type="primary"):
+        with cronometro("Impressão: 7 folhas da semana"): paginas = montar_semana_impressao(escala, df_colaboradores, data_inicio_semana, cores_semana)
+        nome_arq = f"escala_semana_{data_inicio_semana.strftime('%d_%m')}"
+        if formato.startswith("📄"):
+            try: st.download_button("📥 Baixar PDF da Semana", data=gerar_pdf_semana_impressao(paginas), file_name=f"{nome_arq}.pdf", mime="application/pdf")
+            except FileNotFoundError as e: st.error(str(e))
+        elif formato.startswith("📦"):
+            st.download_button("📥 Baixar ZIP da Semana", data=gerar_zip_semana_impressao(paginas), file_name=f"{nome_arq}.zip", mime="application/zip")
+        else:
+            html_semana = gerar_html_semana_impressao(paginas, semana_str)
+            st.download_button("📥 Baixar Semana para Impressão", data=html_semana.encode('utf-8'), file_name=f"{nome_arq}.html", mime="text/html")
+            with st.expander("Pré-visualização"): st.components.v1.html(html_semana, height=600, scrolling=True)
+
+# --- CARGA INICIAL EM PARALELO ---
+def _anexar_contexto(ctx):
+    # Threads do pool herdam o contexto do script para que caches e st.* funcionem dentro delas
+    return lambda: add_script_run_ctx(threading.current_thread(), ctx)
+
+def carregar_dados_iniciais() -> tuple:
+    # Fiscais, colaboradores e índice de semanas não dependem um do outro e saem juntos. A semana ativa mais
+    # recente (lida pelo painel de alertas) é buscada logo após o índice, enquanto as outras cargas ainda chegam.
+    def medir(etapa, funcao, *args):
+        with cronometro(f"Carga inicial: {etapa}"): return funcao(*args)
+
+    def indice_e_semana_recente():
+        df_semanas = medir("índice de semanas", carregar_indice_semanas)
+        ativas = df_semanas[df_semanas['ativa'] == True] if not df_semanas.empty else df_semanas
+        if not ativas.empty: medir("semana mais recente", carregar_escala_semana, int(ativas.iloc[0]['id']))
+        return df_semanas
+
+    with cronometro("Carga inicial: total"):
+        with ThreadPoolExecutor(max_workers=3, initializer=_anexar_contexto(get_script_run_ctx())) as executor:
+            f_fiscais = executor.submit(medir, "fiscais", carregar_fiscais)
+            f_colaboradores = executor.submit(medir, "colaboradores", carregar_colaboradores)
+            f_semanas = executor.submit(indice_e_semana_recente)
+            return f_fiscais.result(), f_colaboradores.result(), f_semanas.result()
+
 # --- Main ---
 def main():
     st.title("📅 Sistema de Escalas")
-    df_fiscais = carregar_fiscais()
-    df_colaboradores = carregar_colaboradores()
-    df_semanas = carregar_indice_semanas()
+    df_fiscais, df_colaboradores, df_semanas = carregar_dados_iniciais()
     df_semanas_ativas = df_semanas[df_semanas['ativa'] == True] if not df_semanas.empty else pd.DataFrame()
 
     with st.sidebar:
@@ -1808,6 +2611,16 @@ def main():
         else:
             st.success(f"Olá, {st.session_state.nome_logado}")
             if st.button("Sair"): st.session_state.logado = False; st.rerun()
+            with st.expander("📊 Desempenho do Cache"):
+                df_cache = estatisticas_cache()
+                if df_cache.empty: st.caption("Sem acessos registrados.")
+                else: st.dataframe(df_cache, hide_index=True, use_container_width=True)
+                if st.button("🩺 Testar Conexão", use_container_width=True, key="btn_health"):
+                    ok, ms, erro = verificar_conexao()
+                    if ok: st.success(f"Supabase respondeu em {ms:.0f} ms.")
+                    else: st.error(f"Sem resposta do Supabase ({ms:.0f} ms): {erro}")
+                df_tempos = estatisticas_tempos()
+                if not df_tempos.empty: st.markdown("**⏱️ Tempos (últimas 50 execuções)**"); st.dataframe(df_tempos, hide_index=True, use_container_width=True)
         st.markdown("---"); st.caption("DEV @Rogério Souza")
 
     if st.session_state.logado:
@@ -0,0 +1,51 @@
+# Benchmark da gravação da escala: um lote (save_escala_lote) × uma RPC por linha (save_escala_dia_final).
+# Roda as funções do app.py contra um PostgREST simulado com latência fixa por requisição, então conta as
+# idas e voltas e mede o tempo de parede sem gravar em banco nenhum. O tempo do lote não inclui o trabalho
+# do banco, que é o mesmo nos dois casos (um upsert por linha).
+#   python benchmarks/bench_gravacao_escala.py --pessoas 200 --latencia-ms 40
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import httpx
+from supabase import create_client, ClientOptions
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+
+
+def cliente_simulado(latencia_s: float, contagem: dict):
+    def responder(request: httpx.Request) -> httpx.Response:
+        funcao = request.url.path.rsplit("/", 1)[-1]
+        contagem[funcao] = contagem.get(funcao, 0) + 1
+        time.sleep(latencia_s)
+        return httpx.Response(200, json=[] if funcao == 'save_escala_lote' else None)
+    http = httpx.Client(transport=httpx.MockTransport(responder))
+    return create_client("http://bench.local", "chave-de-benchmark", options=ClientOptions(httpx_client=http))
+
+
+def medir(nome: str, gravar, registros: list, latencia_s: float) -> dict:
+    contagem = {}
+    app.supabase = cliente_simulado(latencia_s, contagem)
+    inicio = time.perf_counter(); erros = gravar(registros, 1); segundos = time.perf_counter() - inicio
+    return {'Método': nome, 'Registros': len(registros), 'Requisições': sum(contagem.values()), 'Tempo (s)': round(segundos, 2), 'Erros': len(erros)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pessoas", type=int, default=200)
+    parser.add_argument("--latencia-ms", type=float, default=40.0)
+    args = parser.parse_args()
+    inicio_semana = date(2026, 1, 5)
+    registros = [app.montar_registro_escala(f"PESSOA {p:03d}", inicio_semana + timedelta(days=d), "6:50 HRS", None) for p in range(args.pessoas) for d in range(7)]
+    latencia_s = args.latencia_ms / 1000
+    linhas = [medir("Uma RPC por linha (antes)", app._salvar_escala_linha_a_linha, registros, latencia_s),
+              medir("Lote único (save_escala_lote)", app.salvar_escala_lote, registros, latencia_s)]
+    print(f"{args.pessoas} pessoas × 7 dias, {args.latencia_ms:.0f} ms por requisição")
+    for linha in linhas: print("  ".join(f"{k}: {v}" for k, v in linha.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# Benchmark da folha de impressão do dia: gerar_html_layout_exato atual × a versão anterior (iterrows +
+# apply, copiada abaixo como referência), em dias sintéticos com o número de pessoas pedido.
+#   python benchmarks/bench_layout_exato.py --operadores 250 --empacotadores 150
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import zip_longest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+from app import calcular_minutos, formatar_lista_folgas_multilinha  # noqa: E402,F401
+
+HORARIOS = ["6:50 HRS", "7:30 HRS", "8:00 HRS", "9:30 HRS", "10:00 HRS", "11:00 HRS", "12:00 HRS", "13:30 HRS", "Folga", "Ferias"]
+CAIXAS = [str(i) for i in range(1, 30)] + ["Self", "RECEPÇÃO", ""]
+TAREFAS = ["", "Carrinho", "Reposição"]
+
+
+# --- Versão anterior (referência) ---
+def gerar_html_layout_exato_antes(df_ops_dia, df_emp_dia, data_str, dia_semana, cor_tema):
+    lista_op_folga = []
+    lista_emp_folga = []
+    status_invisivel = ["Ferias", "Afastado(a)", "Atestado", "", None]
+    c_op_manha = 0; c_self_manha = 0; c_op_tarde = 0; c_self_tarde = 0; c_emp_manha = 0; c_emp_tarde = 0
+    flat_ops_data = []; flat_emp_data = []
+
+    def sort_key_caixa(row):
+        cx = str(row.get('numero_caixa', '')).strip().upper()
+        cx = cx.replace('.0', '')
+        if not cx or cx == 'NAN': return -999 
+        if cx == 'SELF': return 1000
+        if cx.isdigit(): return int(cx)
+        return -50 
+    
+    if not df_ops_dia.empty: df_ops_dia['rank_cx'] = df_ops_dia.apply(sort_key_caixa, axis=1)
+    else: df_ops_dia['rank_cx'] = []
+        
+    df_ops_sorted = df_ops_dia.sort_values(by='rank_cx', ascending=False) if not df_ops_dia.empty else df_ops_dia
+
+    for _, row in df_ops_sorted.iterrows():
+        horario = str(row['horario'])
+        if 'nome_impressao' in row and pd.notna(row['nome_impressao']) and str(row['nome_impressao']).strip() != "": nome = str(row['nome_impressao']).upper()
+        elif 'nome_social' in row and pd.notna(row['nome_social']) and str(row['nome_social']).strip() != "": nome = str(row['nome_social']).upper()
+        else: nome = str(row['nome']).upper()
+            
+        cx = str(row.get('numero_caixa', '')).replace('.0', '')
+        if horario in status_invisivel or horario == "nan": continue
+        if "Folga" in horario:
+            lista_op_folga.append(nome); continue
+            
+        mins = calcular_minutos(horario)
+        is_self = (cx == "Self")
+        cx_upper = cx.upper()
+        is_excluded_count = (cx_upper in ["RECEPÇÃO", "DELIVERY", "MAGAZINE", "SALINHA"])
+
+        if mins == 450: 
+            if is_self: c_self_manha += 1
+            elif not is_excluded_count: c_op_manha += 1
+            if is_self: c_self_tarde += 1
+            elif not is_excluded_count: c_op_tarde += 1
+        else:
+            if mins <= 630: 
+                if is_self: c_self_manha += 1
+                elif not is_excluded_count: c_op_manha += 1
+            if mins >= 570: 
+                if is_self: c_self_tarde += 1
+                elif not is_excluded_count: c_op_tarde += 1
+
+        h_clean = horario.replace(" HRS", "H").replace(":", ":")
+        flat_ops_data.append({ 'cx': cx, 'nome': nome, 'h_clean': h_clean, 'mins': mins, 'rank': row.get('rank_cx', -999), 'has_separator': False })
+
+    df_emp_sorted = df_emp_dia.sort_values(by='nome')
+    for _, row in df_emp_sorted.iterrows():
+        horario = str(row['horario'])
+        if 'nome_impressao' in row and pd.notna(row['nome_impressao']) and str(row['nome_impressao']).strip() != "": nome = str(row['nome_impressao']).upper()
+        elif 'nome_social' in row and pd.notna(row['nome_social']) and str(row['nome_social']).strip() != "": nome = str(row['nome_social']).upper()
+        else: nome = str(row['nome']).upper()
+
+        tarefa = str(row.get('numero_caixa', '')).replace('.0', '').strip()
+        if tarefa == 'nan': tarefa = ""
+
+        if horario in status_invisivel or horario == "nan": continue
+        if "Folga" in horario:
+            lista_emp_folga.append(nome); continue
+            
+        mins = calcular_minutos(horario)
+        if mins <= 630: c_emp_manha += 1
+        if mins >= 570: c_emp_tarde += 1
+        
+        h_clean = horario.replace(" HRS", "H").replace(":", ":")
+        nome_display = nome
+        if tarefa and tarefa != "nan" and tarefa != "": nome_display = f"{nome} <span style='font-size:0.85em'>({tarefa})</span>"
+            
+        flat_emp_data.append({ 'nome': nome_display, 'h_clean': h_clean, 'mins': mins, 'has_separator': False })
+
+    flat_ops_data.sort(key=lambda x: (x['mins'], -x['rank']))
+    flat_emp_data.sort(key=lambda x: (x['mins'], x['nome']))
+
+    for i in range(len(flat_ops_data) - 1):
+        if flat_ops_data[i]['h_clean'] != flat_ops_data[i+1]['h_clean']: flat_ops_data[i]['has_separator'] = True
+    for i in range(len(flat_emp_data) - 1):
+        if flat_emp_data[i]['h_clean'] != flat_emp_data[i+1]['h_clean']: flat_emp_data[i]['has_separator'] = True
+
+    final_emp_list = []
+    for emp in flat_emp_data:
+        final_emp_list.append(emp)
+        if emp.get('has_separator'): final_emp_list.append(None) 
+            
+    rows_html = ""
+    for op, emp in zip_longest(flat_ops_data, final_emp_list, fillvalue=None):
+        op_html = ""
+        op_class_extra = " separator-bottom" if (op and op['has_separator']) else ""
+        if op: op_html = f"<td class='cx-col{op_class_extra}'>{op['cx']}</td><td class='nome-col{op_class_extra}'>{op['nome']}</td><td class='horario-col{op_class_extra}'>{op['h_clean']}</td>"
+        else: op_html = "<td class='cx-col'></td><td class='nome-col'></td><td class='horario-col'></td>"
+        
+        emp_html = ""
+        emp_class_extra = " separator-bottom" if (emp and emp.get('has_separator')) else ""
+        if emp: emp_html = f"<td class='col-emp-nome border-left{emp_class_extra}'>{emp['nome']}</td><td class='horario-col{emp_class_extra}'>{emp['h_clean']}</td>"
+        else: emp_html = "<td class='col-emp-nome border-left'></td><td class='horario-col'></td>"
+            
+        rows_html += f"<tr>{op_html}<td class='divider-col'></td>{emp_html}</tr>"
+
+    str_folga_op = formatar_lista_folgas_multilinha(lista_op_folga, step=2)
+    str_folga_emp = formatar_lista_folgas_multilinha(lista_emp_folga, step=2)
+
+    tot_op_m = c_op_manha + c_self_manha; tot_op_t = c_op_tarde + c_self_tarde
+    resumo_op = f"MANHÃ: {c_op_manha:02d} OP + {c_self_manha} SELF = {tot_op_m:02d} OPERADORES<br>TARDE: {c_op_tarde:02d} OP + {c_self_tarde} SELF = {tot_op_t:02d} OPERADORES"
+    resumo_emp = f"MANHÃ: {c_emp_manha:02d} EMPACOTADORES<br>TARDE: {c_emp_tarde:02d} EMPACOTADORES"
+
+    return f"""
+    <!DOCTYPE html>
+    <html lang="pt-BR">
+    <head>
+        <meta charset="UTF-8">
+        <title>Escala {dia_semana}</title>
+        <style>
+            @import url('https://fonts.googleapis.com/css2?family=Roboto+Condensed:wght@700&display=swap');
+            @page {{ size: portrait; margin: 5mm; }}
+            body {{ font-family: 'Roboto Condensed', 'Arial Narrow', Arial, sans-serif; color: #000; margin: 0; padding: 10px; background: white; font-size: 16px; width: 90%; margin-left: auto; margin-right: auto; zoom: 90%; }}
+            .print-frame {{ border: 4px solid {cor_tema}; padding: 15px; width: 100%; box-sizing: border-box; }}
+            .header-main {{ text-align: center; border-bottom: 3px solid {cor_tema}; padding-bottom: 5px; margin-bottom: 3px; }}
+            .header-dia {{ font-size: 42px; font-weight: 900; text-transform: uppercase; line-height: 0.9; margin-bottom: 2px; }}
+            .header-data {{ font-size: 28px; font-weight: bold; line-height: 1; color: #000; }}
+            table {{ width: 100%; border-collapse: collapse; border: 2px solid {cor_tema}; margin-bottom: 2px; table-layout: fixed; }}
+            thead th {{ background-color: {cor_tema} !important; color: #fff !important; padding: 6px; text-transform: uppercase; border: 1px solid {cor_tema}; font-size: 19px; text-align: center; -webkit-print-color-adjust: exact; }}
+            td {{ padding: 4px; border: 1px solid {cor_tema}; height: 28px; vertical-align: middle; white-space: nowrap; overflow: hidden; text-align: center; }}
+            .separator-bottom {{ border-bottom: 4px solid #000 !important; }}
+            .cx-col {{ width: 8%; font-weight: bold; font-size: 20px; }} 
+            .col-op-nome {{ width: 31.5%; font-weight: bold; font-size: 18px; }} 
+            .horario-col {{ width: 10%; font-weight: bold; font-size: 18px; }} 
+            .divider-col {{ width: 1%; background-color: {cor_tema} !important; padding: 0; border: none; -webkit-print-color-adjust: exact; }}
+            .col-emp-nome {{ width: 39.5%; font-weight: bold; font-size: 18px; }} 
+            .nome-col {{ font-weight: bold; text-transform: uppercase; letter-spacing: -0.5px; }}
+            .border-left {{ border-left: 3px solid {cor_tema}; }}
+            tr:nth-child(even) {{ background-color: #d9d9d9 !important; -webkit-print-color-adjust: exact; }}
+            .footer-container {{ display: flex; border: 2px solid {cor_tema}; border-top: none; }}
+            .footer-box {{ width: 50%; }}
+            .footer-header {{ background: {cor_tema} !important; color: #fff !important; text-align: center; font-weight: bold; font-size: 14px; padding: 4px; -webkit-print-color-adjust: exact; }}
+            .footer-content {{ background: #eee !important; font-size: 14px; padding: 6px; text-align: center; min-height: 40px; text-transform: uppercase; -webkit-print-color-adjust: exact; line-height: 1.2; white-space: normal; }}
+            .totals-container {{ display: flex; border: 2px solid {cor_tema}; border-top: none; background: {cor_tema} !important; color: #fff !important; -webkit-print-color-adjust: exact; }}
+            .totals-box {{ width: 50%; font-size: 12px; font-weight: bold; padding: 6px; text-align: center; line-height: 1.3; }}
+            @media print {{
+                body {{ padding: 0; margin: 0 auto; width: 90%; zoom: 90%; }}
+                thead th, .footer-header, .totals-container {{ background-color: {cor_tema} !important; color: #fff !important; }}
+                tr:nth-child(even), .footer-content {{ background-color: #ccc !important; }}
+                .separator-bottom {{ border-bottom: 4px solid #000 !important; }}
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="print-frame">
+            <div class="header-main">
+                <div class="header-dia">{dia_semana}</div>
+                <div class="header-data">DATA: <span style="color: {cor_tema}">{data_str}</span></div>
+            </div>
+            <table>
+                <thead>
+                    <tr>
+                        <th class="cx-col">CX</th>
+                        <th class="col-op-nome">OPERADOR(A)</th>
+                        <th class="horario-col">HORÁRIO</th>
+                        <th class="divider-col"></th>
+                        <th class="col-emp-nome border-left">EMPACOTADOR(A)</th>
+                        <th class="horario-col">HORÁRIO</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows_html}
+                </tbody>
+            </table>
+            <div class="footer-container">
+                <div class="footer-box" style="border-right: 2px solid {cor_tema};">
+                    <div class="footer-header">FOLGAS OPERADORES</div>
+                    <div class="footer-content">{str_folga_op}</div>
+                </div>
+                <div class="footer-box">
+                    <div class="footer-header">FOLGAS EMPACOTADORES</div>
+                    <div class="footer-content">{str_folga_emp}</div>
+                </div>
+            </div>
+            <div class="totals-container">
+                <div class="totals-box" style="border-right: 1px solid #fff;">
+                    {resumo_op}
+                </div>
+                <div class="totals-box">
+                    {resumo_emp}
+                </div>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def dia_sintetico(n: int, opcoes_caixa: list, semente: int) -> pd.DataFrame:
+    rng = random.Random(semente)
+    return pd.DataFrame({'nome': [f"PESSOA {i:04d}" for i in range(n)], 'horario': [rng.choice(HORARIOS) for _ in range(n)],
+                         'numero_caixa': [rng.choice(opcoes_caixa) for _ in range(n)], 'nome_social': [''] * n})
+
+
+def mediana_ms(funcao, df_ops: pd.DataFrame, df_emp: pd.DataFrame, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        ops, emp = df_ops.copy(), df_emp.copy()
+        inicio = time.perf_counter(); funcao(ops, emp, "05/01/2026", "SEGUNDA", "#2c3e50"); tempos.append((time.perf_counter() - inicio) * 1000)
+    return sorted(tempos)[len(tempos) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--operadores", type=int, nargs="+", default=[60, 250, 1000])
+    parser.add_argument("--empacotadores", type=int, nargs="+", default=[30, 150, 500])
+    parser.add_argument("--repeticoes", type=int, default=15)
+    args = parser.parse_args()
+    for n_op, n_emp in zip(args.operadores, args.empacotadores):
+        df_ops, df_emp = dia_sintetico(n_op, CAIXAS, 1), dia_sintetico(n_emp, TAREFAS, 2)
+        antes = mediana_ms(gerar_html_layout_exato_antes, df_ops, df_emp, args.repeticoes)
+        depois = mediana_ms(app.gerar_html_layout_exato, df_ops, df_emp, args.repeticoes)
+        print(f"{n_op:>5} operadores / {n_emp:>4} empacotadores: antes {antes:7.1f} ms   depois {depois:6.1f} ms   ({antes / depois:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+-- Funções RPC usadas pelo app.py além das originais (save_escala_dia_final, inicializar_escala_semanal,
+-- arquivar_semana, reativar_semana, delete_colaboradores). Rode no SQL Editor do Supabase.
+--
+-- Supõe a tabela de escala com uma linha por (semana, pessoa, dia):
+--   escala(semana_id bigint references semanas(id), nome text, data date, horario text,
+--          numero_caixa text, updated_at timestamptz)  com unique (semana_id, nome, data)
+-- Se a sua tabela tiver outro nome ou outras colunas, ajuste os SELECT/INSERT abaixo.
+--
+-- Todas as leituras são "returns table" (conjunto de linhas), nunca um único json: o app pagina com
+-- order=...&offset=...&limit=... para não ser cortado no db-max-rows, e o PostgREST só aplica isso a
+-- funções que devolvem linhas. Sem qualquer uma delas o app continua funcionando pelo caminho antigo
+-- (uma chamada por linha/semana), só que mais lento.
+
+-- updated_at mantido pelo banco: é o cursor da sincronia incremental (get_escala_semana_delta)
+alter table escala add column if not exists updated_at timestamptz not null default now();
+create index if not exists escala_semana_updated_at_idx on escala (semana_id, updated_at);
+
+create or replace function escala_tocar_updated_at() returns trigger language plpgsql as $$
+begin
+  new.updated_at := now();
+  return new;
+end $$;
+
+drop trigger if exists escala_updated_at on escala;
+create trigger escala_updated_at before insert or update on escala
+  for each row execute function escala_tocar_updated_at();
+
+-- Escala de uma semana. Colunas consumidas por _buscar_escala_semana.
+-- Precisa continuar "returns table": rpc_paginada pede order=nome,data e offset/limit sobre ela. Se a sua
+-- versão antiga devolve um único json, o app percebe (order recusado ou range ignorado), lê a função
+-- inteira numa chamada como antes e não tenta paginar de novo, mas fica sujeito ao corte do db-max-rows.
+create or replace function get_escala_semana(p_semana_id bigint)
+returns table (nome text, data date, horario text, numero_caixa text, updated_at timestamptz)
+language sql stable as $$
+  select e.nome, e.data, e.horario, e.numero_caixa, e.updated_at
+  from escala e where e.semana_id = p_semana_id
+$$;
+
+-- Só as linhas alteradas desde p_desde (o app já manda o cursor com margem). Mesmas colunas de get_escala_semana.
+create or replace function get_escala_semana_delta(p_semana_id bigint, p_desde timestamptz)
+returns table (nome text, data date, horario text, numero_caixa text, updated_at timestamptz)
+language sql stable as $$
+  select e.nome, e.data, e.horario, e.numero_caixa, e.updated_at
+  from escala e where e.semana_id = p_semana_id and e.updated_at >= p_desde
+$$;
+
+-- Várias semanas numa chamada (histórico do rodízio, presença, auditoria trabalhista).
+create or replace function get_escala_semanas(p_semana_ids bigint[])
+returns table (semana_id bigint, nome text, data date, horario text, numero_caixa text)
+language sql stable as $$
+  select e.semana_id, e.nome, e.data, e.horario, e.numero_caixa
+  from escala e where e.semana_id = any (p_semana_ids)
+$$;
+
+-- Dias por (semana, pessoa, horário), agregado no banco para o histórico do rodízio.
+create or replace function get_contagem_turnos(p_semana_ids bigint[])
+returns table (semana_id bigint, nome text, horario text, qtd bigint)
+language sql stable as $$
+  select e.semana_id, e.nome, e.horario, count(*)
+  from escala e where e.semana_id = any (p_semana_ids) and coalesce(e.horario, '') <> ''
+  group by e.semana_id, e.nome, e.horario
+$$;
+
+-- Gravação em lote numa transação, com erro por linha.
+-- p_registros: [{"nome": text, "data": "YYYY-MM-DD", "horario": text, "caixa": text | null}, ...]
+-- Retorno: uma linha {indice, erro} por registro que falhou (indice começa em 0, na ordem de p_registros);
+-- nenhuma linha = tudo gravado. Cada registro roda num bloco próprio (savepoint), então uma linha inválida
+-- não desfaz as outras; uma falha fora dos blocos (timeout, conexão) desfaz o lote inteiro.
+create or replace function save_escala_lote(p_semana_id bigint, p_registros jsonb)
+returns table (indice int, erro text)
+language plpgsql as $$
+declare
+  r jsonb;
+  i int := 0;
+begin
+  for r in select value from jsonb_array_elements(p_registros) loop
+    begin
+      insert into escala (semana_id, nome, data, horario, numero_caixa)
+      values (p_semana_id, trim(r->>'nome'), (r->>'data')::date, r->>'horario', nullif(r->>'caixa', ''))
+      on conflict (semana_id, nome, data)
+      do update set horario = excluded.horario, numero_caixa = excluded.numero_caixa;
+    exception when others then
+      indice := i; erro := sqlerrm;
+      return next;
+    end;
+    i := i + 1;
+  end loop;
+end $$;
+
+grant execute on function get_escala_semana(bigint), get_escala_semana_delta(bigint, timestamptz),
+  get_escala_semanas(bigint[]), get_contagem_turnos(bigint[]), save_escala_lote(bigint, jsonb)
+  to anon, authenticated;
@@ -0,0 +1,112 @@
+# Cenários da TabelaSincronizada contra um feed de alterações em memória (sem Supabase).
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+import pytest
+from postgrest.exceptions import APIError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import TabelaSincronizada  # noqa: E402
+
+
+class FeedAlteracoesLocal:
+    # Imita o banco: linhas com updated_at, busca completa, delta por updated_at >= desde
+    # e, se pedido, delta indisponível como num banco sem a RPC.
+    def __init__(self, chaves: list, delta_disponivel: bool = True, atraso_segundos: float = 0.0):
+        self.chaves = chaves; self.delta_disponivel = delta_disponivel; self.atraso_segundos = atraso_segundos
+        self.linhas = {}; self.buscas_completas = 0; self.buscas_delta = 0
+        self.relogio = pd.Timestamp('2026-01-05 08:00', tz='UTC')
+
+    def gravar(self, segundos_atras: float = 0, **linha):
+        # Avança o relógio e grava; segundos_atras simula um commit que chega com updated_at mais antigo.
+        self.relogio += pd.Timedelta(seconds=1)
+        self.linhas[tuple(linha[c] for c in self.chaves)] = {**linha, 'updated_at': (self.relogio - pd.Timedelta(seconds=segundos_atras)).isoformat()}
+
+    def buscar_tudo(self) -> pd.DataFrame:
+        self.buscas_completas += 1
+        time.sleep(self.atraso_segundos)
+        return pd.DataFrame(list(self.linhas.values()))
+
+    def buscar_delta(self, desde: str) -> pd.DataFrame:
+        self.buscas_delta += 1
+        time.sleep(self.atraso_segundos)
+        if not self.delta_disponivel: raise APIError({'code': 'PGRST202', 'message': 'Could not find the function get_escala_semana_delta'})
+        return pd.DataFrame([l for l in self.linhas.values() if pd.Timestamp(l['updated_at']) >= pd.Timestamp(desde)])
+
+
+@pytest.fixture
+def feed():
+    feed = FeedAlteracoesLocal(['nome'])
+    feed.gravar(nome='ANA', horario='6:50 HRS'); feed.gravar(nome='BIA', horario='12:00 HRS')
+    return feed
+
+
+def obter(tabela, feed, **kwargs):
+    return tabela.obter(feed.buscar_tudo, feed.buscar_delta, **kwargs)
+
+
+def test_carga_inicial_faz_uma_busca_completa(feed):
+    df, recarregou, _ = obter(TabelaSincronizada(['nome'], intervalos=(0, 0, 3600)), feed)
+    assert recarregou and len(df) == 2 and feed.buscas_completas == 1
+
+
+def test_alteracao_chega_por_delta_sem_recarga(feed):
+    tabela = TabelaSincronizada(['nome'], intervalos=(0, 0, 3600)); obter(tabela, feed)
+    feed.gravar(nome='ANA', horario='10:00 HRS')
+    df, recarregou, aplicou = obter(tabela, feed)
+    assert aplicou and not recarregou
+    assert df.set_index('nome').at['ANA', 'horario'] == '10:00 HRS'
+
+
+def test_releitura_da_margem_sem_mudanca_nao_gera_versao(feed):
+    tabela = TabelaSincronizada(['nome'], intervalos=(0, 0, 3600)); obter(tabela, feed)
+    versao = tabela.versao
+    obter(tabela, feed)
+    assert tabela.versao == versao
+
+
+def test_commit_atrasado_antes_do_cursor_e_recuperado(feed):
+    tabela = TabelaSincronizada(['nome'], intervalos=(0, 0, 3600)); obter(tabela, feed)
+    feed.gravar(segundos_atras=3, nome='CAIO', horario='8:00 HRS')
+    df, _, aplicou = obter(tabela, feed)
+    assert aplicou and 'CAIO' in set(df['nome'])
+
+
+def test_sem_rpc_de_delta_tenta_uma_vez_so():
+    feed = FeedAlteracoesLocal(['nome'], delta_disponivel=False); feed.gravar(nome='ANA', horario='6:50 HRS')
+    tabela = TabelaSincronizada(['nome'], intervalos=(0, 3600, 3600))
+    for _ in range(4): obter(tabela, feed)
+    assert feed.buscas_delta == 1 and not tabela.delta_disponivel and feed.buscas_completas == 2
+
+
+def test_forcar_le_o_banco_dentro_do_intervalo(feed):
+    tabela = TabelaSincronizada(['nome'], intervalos=(3600, 3600, 3600)); obter(tabela, feed)
+    feed.gravar(nome='ANA', horario='10:00 HRS')
+    assert obter(tabela, feed)[0].set_index('nome').at['ANA', 'horario'] == '6:50 HRS'
+    assert obter(tabela, feed, forcar=True)[0].set_index('nome').at['ANA', 'horario'] == '10:00 HRS'
+
+
+def test_busca_lenta_de_uma_sessao_nao_bloqueia_as_outras():
+    feed = FeedAlteracoesLocal(['nome']); feed.gravar(nome='ANA', horario='6:50 HRS')
+    tabela = TabelaSincronizada(['nome'], intervalos=(0, 3600, 3600)); obter(tabela, feed)
+    feed.atraso_segundos = 0.5
+    lenta = threading.Thread(target=obter, args=(tabela, feed)); lenta.start(); time.sleep(0.05)
+    inicio = time.perf_counter(); df, _, _ = obter(tabela, feed); espera = time.perf_counter() - inicio
+    lenta.join()
+    assert espera < 0.2 and len(df) == 1
+
+
+def test_recarga_completa_igual_nao_gera_versao():
+    feed = FeedAlteracoesLocal(['nome'], delta_disponivel=False)
+    feed.gravar(nome='ANA', horario='6:50 HRS'); feed.gravar(nome='BIA', horario='12:00 HRS')
+    tabela = TabelaSincronizada(['nome'], intervalos=(0, 3600, 3600)); obter(tabela, feed)
+    versao = tabela.versao
+    feed.linhas = dict(reversed(list(feed.linhas.items())))  # mesma tabela, outra ordem de resposta
+    _, recarregou, _ = obter(tabela, feed, forcar=True)
+    assert recarregou and tabela.versao == versao
+    feed.gravar(nome='ANA', horario='10:00 HRS')
+    obter(tabela, feed, forcar=True)
+    assert tabela.versao == versao + 1